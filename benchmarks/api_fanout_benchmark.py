@@ -0,0 +1,75 @@
+"""api_fanout_benchmark.py compares serial discord calls against the rate limited scheduler
+
+Each fake call sleeps for a simulated round trip, and the first call on every route
+answers with a 429 so the retry path is exercised too.
+
+usage: python benchmarks/api_fanout_benchmark.py [calls] [latency_ms]
+"""
+
+import asyncio
+import functools
+from pathlib import Path
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+import discord
+
+import ratelimit
+
+
+class FakeResponse:
+    status = 429
+    reason = 'Too Many Requests'
+
+    def __init__(self, retry_after):
+        self.headers = {'Retry-After': str(retry_after)}
+
+
+class FakeRoute:
+    def __init__(self, latency, rate_limit_first=True):
+        self.latency = latency
+        self.rate_limit_first = rate_limit_first
+        self.calls = 0
+
+    async def call(self, index):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.rate_limit_first:
+            self.rate_limit_first = False
+            raise discord.HTTPException(FakeResponse(self.latency), 'rate limited')
+        return index
+
+
+async def serial(calls, latency):
+    route = FakeRoute(latency, rate_limit_first=False)
+    return [await route.call(index) for index in range(calls)]
+
+
+async def scheduled(calls, latency):
+    route = FakeRoute(latency)
+    scheduler = ratelimit.ApiScheduler()
+    results = await scheduler.gather('benchmark', [functools.partial(route.call, index) for index in range(calls)])
+    assert results == list(range(calls)), 'results came back out of order'
+    return scheduler.rate_limited
+
+
+def main(calls=50, latency_ms=50):
+    latency = latency_ms / 1000
+    start = time.perf_counter()
+    asyncio.run(serial(calls, latency))
+    serial_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rate_limited = asyncio.run(scheduled(calls, latency))
+    scheduled_seconds = time.perf_counter() - start
+
+    print(f'{calls} calls at {latency_ms} ms each')
+    print(f'serial     {serial_seconds * 1000:8.1f} ms')
+    print(f'scheduled  {scheduled_seconds * 1000:8.1f} ms  ({rate_limited} 429 retries)')
+    print(f'speedup    {serial_seconds / scheduled_seconds:8.1f}x')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
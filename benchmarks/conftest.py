@@ -0,0 +1,85 @@
+"""conftest.py sets up the pytest-benchmark suite
+
+Each benchmark runs the bot's code against a temporary SQLite database seeded with a small
+set of reference data and a discord_stand_in guild, and records the wall time, the discord
+API calls and the SQL statements of a round so regressions in any of them show up.
+
+usage: pip install -r requirements-dev.txt
+       python -m pytest benchmarks [--latency-ms 50] [--benchmark-autosave]
+"""
+
+from pathlib import Path
+import sys
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+import database as db
+import globals
+from werewolf import announcement
+
+from discord_stand_in import DiscordStandIn, QueryCounter
+
+def pytest_addoption(parser):
+    parser.addoption('--latency-ms', type=float, default=0, help='delay added to every fake discord API call')
+
+
+REFERENCE_DATA = {
+    'role': [(1, 'alive', 'alive'), (2, 'deceased', 'deceased'), (3, 'everyone', 'everyone'),
+             (4, 'spectator', 'spectator')],
+    'channel': [(1, 'moderator', 1, 'text'), (2, 'player', 2, 'text'), (3, 'werewolf', 3, 'text'),
+                (4, 'dead', 4, 'text'), (5, 'voice', 5, 'voice')],
+    'character': [(1, 'villager', 1, 1000, 'village'), (2, 'werewolf', -6, 1000, 'werewolf'),
+                  (3, 'seer', 7, 1, 'village')],
+    'character_permission': [(2, 3, 'read_messages', 1, None, None, 'alive'),
+                             (2, 3, 'send_messages', 1, None, 'night', 'alive'),
+                             (1, 2, 'send_messages', 1, None, 'day', 'alive'),
+                             (2, 2, 'send_messages', 1, None, 'day', 'alive'),
+                             (3, 2, 'send_messages', 1, None, 'day', 'alive')],
+    'role_permission': [(1, 'read_messages', 1, 1, None, None), (2, 'read_messages', 1, 1, None, None),
+                        (2, 'send_messages', 0, 1, None, 'night'), (4, 'read_messages', 1, 2, None, None),
+                        (4, 'send_messages', 1, 2, None, None), (2, 'read_messages', 1, 2, None, None)],
+}
+REFERENCE_COLUMNS = {
+    'role': ('role_id', 'role_name', 'default_value'),
+    'channel': ('channel_id', 'channel_name', 'channel_order', 'channel_type'),
+    'character': ('character_id', 'character_name', 'weighting', 'max_duplicates', 'starting_affiliation'),
+    'character_permission': ('character_id', 'channel_id', 'permission_name', 'permission_value', 'game_status',
+                             'game_phase', 'vitals_required'),
+    'role_permission': ('channel_id', 'permission_name', 'permission_value', 'role_id', 'game_status', 'game_phase'),
+}
+
+
+@pytest.fixture
+def database(tmp_path):
+    db.close_connections()
+    globals.DB_FILE_LOCATION = tmp_path / 'benchmark.db'
+    db.create_database_tables()
+    for table, rows in REFERENCE_DATA.items():
+        db.insert_many(table, [dict(zip(REFERENCE_COLUMNS[table], row)) for row in rows])
+    db.reference_data.invalidate()
+    yield globals.DB_FILE_LOCATION
+    db.close_connections()
+    db.reference_data.invalidate()
+
+
+@pytest.fixture
+def api(request):
+    return DiscordStandIn(request.config.getoption('--latency-ms') / 1000)
+
+
+@pytest.fixture
+def queries():
+    counter = QueryCounter()
+    db.statement_listeners.append(counter)
+    yield counter
+    db.statement_listeners.remove(counter)
+
+
+@pytest.fixture(autouse=True)
+def instant_announcements():
+    interval = announcement.updater.interval
+    announcement.updater.interval = 0
+    yield
+    announcement.updater.interval = interval
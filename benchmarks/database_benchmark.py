@@ -0,0 +1,89 @@
+"""database_benchmark.py compares the pooled ConnectionManager against a connection per call
+
+Runs the same mix of inserts, updates and point selects that a burst of reactions and
+moderator commands produces, once opening a fresh sqlite3 connection per statement (how
+database.py used to work) and once through the database.py helpers, against a temporary
+database. Prints ops/sec for both.
+
+usage: python benchmarks/database_benchmark.py [operations]
+"""
+
+from pathlib import Path
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+import pandas as pd
+
+import database as db
+import globals
+
+
+def legacy_insert(game_id, user_id):
+    with sqlite3.connect(globals.DB_FILE_LOCATION) as connection:
+        connection.execute('INSERT INTO game_player (game_id, discord_user_id) VALUES (?,?);',
+                           (str(game_id), str(user_id)))
+
+
+def legacy_update(game_id, user_id):
+    with sqlite3.connect(globals.DB_FILE_LOCATION) as connection:
+        connection.execute('UPDATE game_player SET vitals = ? WHERE game_id = ? AND discord_user_id = ?;',
+                           ('alive', str(game_id), str(user_id)))
+
+
+def legacy_select(game_id):
+    with sqlite3.connect(globals.DB_FILE_LOCATION) as connection:
+        return pd.read_sql_query(f"SELECT * from game WHERE cast(game_id as text)='{game_id}';", connection)
+
+
+def pooled_insert(game_id, user_id):
+    db.insert_into_table('game_player', {'game_id': game_id, 'discord_user_id': user_id})
+
+
+def pooled_update(game_id, user_id):
+    db.update_table('game_player', {'vitals': 'alive'}, {'game_id': game_id, 'discord_user_id': user_id})
+
+
+def pooled_select(game_id):
+    return db.select_one('game', {'game_id': game_id})
+
+
+def run_workload(insert, update, select, operations):
+    start = time.perf_counter()
+    for i in range(operations // 3):
+        insert(1, i)
+        update(1, i)
+        select(1)
+    return (operations // 3 * 3) / (time.perf_counter() - start)
+
+
+def fresh_database(directory, name):
+    db.close_connections()
+    globals.DB_FILE_LOCATION = Path(directory) / name
+    db.create_database_tables()
+    db.insert_into_table('game', {'discord_category_id': 1, 'game_name': 'BENCH', 'status': 'recruiting'})
+    db.close_connections()
+
+
+def main(operations=3000):
+    with tempfile.TemporaryDirectory() as directory:
+        fresh_database(directory, 'legacy.db')
+        # the legacy helpers ran in the default rollback journal mode
+        with sqlite3.connect(globals.DB_FILE_LOCATION) as connection:
+            connection.execute('PRAGMA journal_mode=DELETE')
+        legacy = run_workload(legacy_insert, legacy_update, legacy_select, operations)
+
+        fresh_database(directory, 'pooled.db')
+        pooled = run_workload(pooled_insert, pooled_update, pooled_select, operations)
+        db.close_connections()
+
+    print(f'connection per call: {legacy:10.1f} ops/sec')
+    print(f'pooled WAL         : {pooled:10.1f} ops/sec')
+    print(f'speed up           : {pooled / legacy:10.2f}x')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,229 @@
+"""discord_stand_in.py is a local stand in for the parts of discord the bot talks to
+
+It implements just enough of discord.py's Guild, Member, Role, TextChannel and Message
+for the game code to run in process. Every API call it receives is counted and can be
+delayed by an injected latency to model real round trips. Like the bot's own requests each
+call first commits the unit of work it is made in, so the write lock is never held across one.
+"""
+
+import asyncio
+from collections import Counter
+import itertools
+
+import discord
+
+import database as db
+import globals
+
+_ids = itertools.count(10 ** 17)
+
+
+class DiscordStandIn:
+    """counts the API calls made through the fakes and delays each one by latency seconds"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def call(self, name: str):
+        # like the bot's http requests, see database.commits_first
+        await db.checkpoint()
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def total(self) -> int:
+        return sum(self.calls.values())
+
+
+class FakeResponse:
+    def __init__(self, status, reason, headers=None):
+        self.status = status
+        self.reason = reason
+        self.headers = headers or {}
+
+
+class FakeObject:
+    def __init__(self, api: DiscordStandIn, name: str):
+        self.api = api
+        self.id = next(_ids)
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, FakeObject) and other.id == self.id
+
+
+class FakeRole(FakeObject):
+    def __init__(self, api, name, guild):
+        super().__init__(api, name)
+        self.guild = guild
+
+    async def delete(self):
+        await self.api.call('role.delete')
+        self.guild.roles.remove(self)
+
+
+class FakeMember(FakeObject):
+    bot = False
+
+    def __init__(self, api, name, guild):
+        super().__init__(api, name)
+        self.guild = guild
+        self.discriminator = '0001'
+        self.display_name = name
+        self.mention = f'<@{self.id}>'
+        self.roles = []
+
+    def __str__(self):
+        return f'{self.name}#{self.discriminator}'
+
+    async def add_roles(self, *roles):
+        await self.api.call('member.add_roles')
+        self.roles += [role for role in roles if role not in self.roles]
+
+    async def remove_roles(self, *roles):
+        await self.api.call('member.remove_roles')
+        self.roles = [role for role in self.roles if role not in roles]
+
+    async def edit(self, roles=None, **options):
+        await self.api.call('member.edit')
+        if roles is not None:
+            self.roles = list(roles)
+
+
+class FakeMessage(FakeObject):
+    def __init__(self, api, content, channel):
+        super().__init__(api, 'message')
+        self.content = content
+        self.channel = channel
+
+    async def edit(self, content=None):
+        await self.api.call('message.edit')
+        self.content = content
+
+    async def add_reaction(self, emoji):
+        await self.api.call('message.add_reaction')
+
+    async def delete(self):
+        await self.api.call('message.delete')
+        self.channel.messages.pop(self.id, None)
+
+
+class FakeChannel(FakeObject):
+    def __init__(self, api, name, guild, category=None, overwrites=None):
+        super().__init__(api, name)
+        self.guild = guild
+        self.category = category
+        self.overwrites = dict(overwrites or {})
+        self.messages = {}
+        self.position = 0
+
+    @property
+    def channels(self):
+        return [channel for channel in self.guild.channels if channel.category is self]
+
+    async def send(self, content):
+        await self.api.call('channel.send')
+        message = FakeMessage(self.api, content, self)
+        self.messages[message.id] = message
+        return message
+
+    async def fetch_message(self, message_id):
+        await self.api.call('channel.fetch_message')
+        if message_id not in self.messages:
+            raise discord.NotFound(FakeResponse(404, 'Not Found'), 'Unknown Message')
+        return self.messages[message_id]
+
+    async def set_permissions(self, target, overwrite=None):
+        await self.api.call('channel.set_permissions')
+        if overwrite is None:
+            self.overwrites.pop(target, None)
+        else:
+            self.overwrites[target] = overwrite
+
+    async def delete(self):
+        await self.api.call('channel.delete')
+        self.guild.channels.remove(self)
+
+
+class FakeGuild(FakeObject):
+    def __init__(self, api, players):
+        super().__init__(api, 'guild')
+        self.roles = []
+        self.default_role = FakeRole(api, '@everyone', self)
+        self.members = [FakeMember(api, f'player{i}', self) for i in range(players)]
+        self._members = {member.id: member for member in self.members}
+        # the bot's own member, timers run their actions as it
+        self.me = FakeMember(api, 'bot', self)
+        self.announcements = FakeChannel(api, 'game-announcements', self)
+        self.channels = [self.announcements]
+
+    @property
+    def categories(self):
+        return [channel for channel in self.channels if channel.category is None and channel is not self.announcements]
+
+    async def create_category(self, name, overwrites=None):
+        await self.api.call('guild.create_category')
+        category = FakeChannel(self.api, name, self, overwrites=overwrites)
+        self.channels.append(category)
+        return category
+
+    async def create_role(self, name):
+        await self.api.call('guild.create_role')
+        role = FakeRole(self.api, name, self)
+        self.roles.append(role)
+        return role
+
+    async def create_text_channel(self, name, category=None, position=None, topic=None):
+        await self.api.call('guild.create_channel')
+        channel = FakeChannel(self.api, name, self, category)
+        self.channels.append(channel)
+        return channel
+
+    create_voice_channel = create_text_channel
+
+    def get_role(self, role_id):
+        return next((role for role in self.roles + [self.default_role] if role.id == role_id), None)
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    def get_channel(self, channel_id):
+        return next((channel for channel in self.channels if channel.id == channel_id), None)
+
+
+class FakeContext:
+    def __init__(self, guild, channel):
+        self.guild = guild
+        self.channel = channel
+        self.message = self
+        self.author = guild.members[0] if guild.members else None
+
+    async def send(self, content):
+        return await self.channel.send(content)
+
+
+class FakeReaction:
+    def __init__(self, message, member):
+        self.message_id = message.id
+        self.channel_id = message.channel.id
+        self.guild_id = member.guild.id
+        self.user_id = member.id
+        self.member = member
+        self.emoji = type('Emoji', (), {'name': globals.GAME_REACTION_EMOJI})()
+
+
+class QueryCounter:
+    """counts the statements sqlite runs, through database.statement_listeners"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement):
+        self.count += 1
@@ -0,0 +1,119 @@
+"""permission_benchmark.py times permission resolution for update_game_permissions
+
+Generates permission reference data and a game of each size, then resolves every
+channel's permissions once with the pandas merge / apply / iterrows code
+update_game_permissions used to run and once with permissions.resolve_permissions,
+checks both give the same result and prints the time each took.
+
+usage: python benchmarks/permission_benchmark.py [players ...]
+"""
+
+from collections import defaultdict
+from pathlib import Path
+import random
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+import pandas as pd
+
+from werewolf import permissions
+
+CHANNELS = 10
+CHARACTERS = 20
+ROLES = 4
+PHASES = [None, 'day', 'night']
+STATUSES = [None, 'active', 'recruiting']
+VITALS = [None, 'alive', 'deceased']
+PERMISSION_NAMES = ['read_messages', 'send_messages', 'add_reactions']
+
+
+def reference_data(seed=1):
+    rand = random.Random(seed)
+    character_permission = [{'character_permission_id': i, 'character_id': rand.randrange(CHARACTERS),
+                             'channel_id': rand.randrange(CHANNELS),
+                             'permission_name': rand.choice(PERMISSION_NAMES),
+                             'permission_value': str(rand.randrange(2)), 'game_status': rand.choice(STATUSES),
+                             'game_phase': rand.choice(PHASES), 'vitals_required': rand.choice(VITALS)}
+                            for i in range(CHARACTERS * CHANNELS)]
+    role_permission = [{'role_permission_id': i, 'channel_id': rand.choice([None] + list(range(CHANNELS))),
+                        'permission_name': rand.choice(PERMISSION_NAMES), 'permission_value': rand.randrange(2),
+                        'role_id': str(rand.randrange(ROLES)), 'game_status': rand.choice(STATUSES),
+                        'game_phase': rand.choice(PHASES)}
+                       for i in range(ROLES * CHANNELS)]
+    return character_permission, role_permission
+
+
+def game(players, seed=1):
+    rand = random.Random(seed)
+    game_players = [{'game_player_id': i, 'discord_user_id': 10_000 + i, 'character_id': rand.randrange(CHARACTERS),
+                     'vitals': rand.choice(['alive', 'deceased'])} for i in range(players)]
+    game_roles = [{'game_role_id': i, 'role_id': i, 'discord_role_id': 20_000 + i} for i in range(ROLES)]
+    return game_players, game_roles
+
+
+def group(rows, column):
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[row[column]].append(row)
+    return grouped
+
+
+def legacy_resolve(game_players, game_roles, character_permission, role_permission, phase, status):
+    # object columns keep None the way the pandas this code was written against did, newer string
+    # columns turn it into NaN which isin([None, ...]) no longer matches
+    character_permissions = pd.DataFrame(character_permission, dtype=object).merge(
+        pd.DataFrame(game_players, dtype=object), on='character_id', suffixes=('', '_game_player'))
+    character_permissions = character_permissions[
+        character_permissions['game_phase'].isin([None, phase]) & character_permissions['game_status'].isin(
+            [None, status])]
+    character_map = character_permissions.apply(lambda x: x['vitals_required'] in [None, x['vitals']], axis=1)
+    character_permissions = character_permissions[character_map]
+
+    role_permissions = pd.DataFrame(role_permission, dtype=object).astype({'role_id': int}).merge(
+        pd.DataFrame(game_roles, dtype=object), on='role_id', suffixes=('', '_game_role'))
+    role_permissions = role_permissions[
+        role_permissions['game_phase'].isin([None, phase]) & role_permissions['game_status'].isin([None, status])]
+
+    matrix = {}
+    for channel_id in range(CHANNELS):
+        channel_char_perms = character_permissions[character_permissions['channel_id'].isin([None, channel_id])]
+        role_char_perms = role_permissions[role_permissions['channel_id'].isin([None, channel_id])]
+
+        perms = defaultdict(dict)
+        for idx, row in channel_char_perms.iterrows():
+            perms[(permissions.MEMBER, row['discord_user_id'])][row['permission_name']] = bool(
+                int(row['permission_value']))
+        for idx, row in role_char_perms.iterrows():
+            perms[(permissions.ROLE, row['discord_role_id'])][row['permission_name']] = bool(
+                int(row['permission_value']))
+        matrix[channel_id] = dict(perms)
+    return matrix
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main(*sizes):
+    sizes = sizes or (10, 50, 100, 500)
+    character_permission, role_permission = reference_data()
+    character_groups = group(character_permission, 'character_id')
+    role_groups = group(role_permission, 'role_id')
+
+    print(f'{"players":>8} {"legacy ms":>10} {"resolve ms":>11} {"speedup":>8}')
+    for players in sizes:
+        game_players, game_roles = game(players)
+        expected, legacy_seconds = timed(legacy_resolve, game_players, game_roles, character_permission,
+                                         role_permission, 'night', 'active')
+        result, seconds = timed(permissions.resolve_permissions, game_players, game_roles, character_groups,
+                                role_groups, list(range(CHANNELS)), 'night', 'active')
+        assert result == expected, f'resolve_permissions disagrees with the legacy resolution at {players} players'
+        print(f'{players:>8} {legacy_seconds * 1000:>10.1f} {seconds * 1000:>11.2f} {legacy_seconds / seconds:>7.0f}x')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,114 @@
+"""startup_benchmark.py measures import time and peak RSS of the bot's startup imports
+
+Each sample runs in a fresh interpreter. The "eager pandas" run imports pandas up front the
+way main.py used to, the "lazy pandas" run only imports what main.py imports now.
+
+The restart runs follow main.py up to importing the bot against a new database, one that
+is already up to date and one made before schema versioning, and check that restarting
+kept every game.
+
+usage: python benchmarks/startup_benchmark.py [samples]
+"""
+
+from pathlib import Path
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+
+SRC_DIR = Path(__file__).resolve().parent.parent / 'src'
+
+PROBE = '''
+import resource, sys, time
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, 'pandas' in sys.modules)
+'''
+
+
+def sample(imports: str):
+    output = subprocess.run([sys.executable, '-c', PROBE.format(imports=imports)], cwd=SRC_DIR,
+                            capture_output=True, text=True, check=True).stdout.split()
+    return float(output[0]), int(output[1]), output[2] == 'True'
+
+
+def measure(name: str, imports: str, samples: int):
+    results = [sample(imports) for _ in range(samples)]
+    seconds = statistics.median(result[0] for result in results)
+    rss_mb = statistics.median(result[1] for result in results) / 1024
+    print(f'{name:<14} {seconds * 1000:8.1f} ms {rss_mb:8.1f} MB  pandas loaded: {results[0][2]}')
+    return seconds, rss_mb
+
+
+STARTUP_PROBE = '''
+import metrics
+from pathlib import Path
+import sys
+import database as db
+import globals
+globals.DB_FILE_LOCATION = Path(sys.argv[1])
+version = db.upgrade_database()
+schema = metrics.startup_stage('schema')
+import bot
+imports = metrics.startup_stage('imports')
+print(version, db.SCHEMA_VERSION, schema, imports, db.count_rows('game'))
+'''
+
+GAMES = 50
+
+
+def restart(db_file: Path):
+    output = subprocess.run([sys.executable, '-c', STARTUP_PROBE, str(db_file)], cwd=SRC_DIR,
+                            capture_output=True, text=True, check=True).stdout.split()
+    return int(output[0]), int(output[1]), float(output[2]), float(output[3]), int(output[4])
+
+
+def unversioned_database(db_file: Path):
+    """a database as the bot left it before schema versioning, games had no guild columns"""
+    connection = sqlite3.connect(db_file)
+    connection.execute('''CREATE TABLE game(game_id INTEGER PRIMARY KEY AUTOINCREMENT
+                                           ,discord_category_id INTEGER NOT NULL
+                                           ,discord_announce_message_id INTEGER
+                                           ,game_name TEXT, start_date DATE, end_date DATE
+                                           ,number_of_players INTEGER, status TEXT, phase TEXT
+                                           ,game_length INTEGER
+                                           ,created_datetime DATETIME, modified_datetime DATETIME)''')
+    connection.executemany('INSERT INTO game (discord_category_id, game_name) VALUES (?, ?)',
+                           [(index, f'game{index}') for index in range(GAMES)])
+    connection.commit()
+    connection.close()
+
+
+def measure_restarts(samples: int):
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        runs = [('new database', lambda index: directory / f'new{index}.db', lambda db_file: None, 0),
+                ('up to date', lambda index: directory / 'current.db', lambda db_file: None, GAMES),
+                ('unversioned', lambda index: directory / f'old{index}.db', unversioned_database, GAMES)]
+        current = directory / 'current.db'
+        unversioned_database(current)
+        restart(current)
+
+        for name, db_file, prepare, games in runs:
+            results = []
+            for index in range(samples):
+                prepare(db_file(index))
+                results.append(restart(db_file(index)))
+            version, schema_version, schema, imports, rows = results[-1]
+            assert rows == games, f'{name} has {rows} games after restarting, expected {games}'
+            print(f'{name:<14} schema {statistics.median(result[2] for result in results) * 1000:8.1f} ms '
+                  f'imports {statistics.median(result[3] for result in results) * 1000:8.1f} ms  '
+                  f'migrated from version {version} to {schema_version}')
+
+
+def main(samples=5):
+    eager = measure('eager pandas', 'import pandas\nimport database, bot', samples)
+    lazy = measure('lazy pandas', 'import database, bot', samples)
+    print(f'saved          {(eager[0] - lazy[0]) * 1000:8.1f} ms {eager[1] - lazy[1]:8.1f} MB')
+    measure_restarts(samples)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,66 @@
+"""test_announcement.py checks that the announcement updater merges a burst of sign ups into a few edits"""
+
+import asyncio
+
+import database as db
+from werewolf import announcement
+
+from discord_stand_in import FakeGuild
+
+SIGN_UPS = 40
+
+
+def recruiting_game(api):
+    guild = FakeGuild(api, SIGN_UPS)
+    game_id = db.insert_into_table('game', {'discord_guild_id': guild.id, 'discord_category_id': 1,
+                                            'game_name': 'BURST', 'status': 'recruiting', 'start_date': '2030-01-01'})
+    return guild, game_id
+
+
+def test_burst_is_debounced(database, api):
+    guild, game_id = recruiting_game(api)
+    updater = announcement.AnnouncementUpdater(interval=0.05)
+
+    async def burst():
+        message = await guild.announcements.send(await announcement.generate_message(game_id))
+        updater.remember(game_id, message)
+        for member in guild.members:
+            await db.insert_into_table_async('game_player', {'game_id': game_id, 'discord_user_id': member.id})
+            updater.request(game_id)
+            await asyncio.sleep(0.001)
+        await updater.flush()
+        return message
+
+    message = asyncio.run(burst())
+    # one edit straight away and one per interval after it, not one per sign up
+    assert updater.edits <= 4
+    assert api.calls['message.edit'] == updater.edits
+    assert message.content == asyncio.run(announcement.generate_message(game_id))
+    assert f'| {SIGN_UPS} ' in message.content
+
+
+def test_failed_edit_is_retried(database, api, monkeypatch):
+    guild, game_id = recruiting_game(api)
+    updater = announcement.AnnouncementUpdater(interval=0.01)
+    generate_message = announcement.generate_message
+    calls = []
+
+    async def failing_once(game_id):
+        calls.append(game_id)
+        if len(calls) == 1:
+            await asyncio.sleep(0.01)
+            raise RuntimeError('failed to draw the announcement')
+        return await generate_message(game_id)
+
+    async def request_during_failure():
+        updater.remember(game_id, await guild.announcements.send('old announcement'))
+        monkeypatch.setattr(announcement, 'generate_message', failing_once)
+        updater.request(game_id)
+        await asyncio.sleep(0.001)
+        # arrives while the first edit is failing, the updater carries on and sends it
+        updater.request(game_id)
+        await updater.flush()
+
+    asyncio.run(request_during_failure())
+    assert updater.edits == 1
+    assert not updater._tasks
@@ -0,0 +1,319 @@
+"""test_game_benchmarks.py benchmarks the game commands and registration at 10, 100 and 1000 players
+
+Every round runs inside a unit of work the way the cogs run commands. The discord API
+calls and SQL statements of the last round are saved in the benchmark's extra_info and
+checked against a budget, so a change that makes a command chattier fails here even
+when the wall time hides it.
+"""
+
+import asyncio
+from datetime import date, timedelta
+import itertools
+import json
+import time
+
+import discord
+import pytest
+
+import bot
+import database as db
+from globals import GameStatus
+import server
+from werewolf import announcement, event, game, registration, vote
+
+from discord_stand_in import DiscordStandIn, FakeContext, FakeGuild, FakeReaction, FakeResponse
+
+PLAYERS = [10, 100, 1000]
+# the players killed together by one death command in test_night_deaths
+NIGHT_DEATHS = 5
+
+# (discord API calls, SQL statements) a single round may use at the given number of players,
+# about 20% over what each command needed when the suite was written. start posts two tables
+# with a row per player, these go out as a message per page of about 11 players. SQLite traces
+# each row of an executemany, so start's batch of assign events counts once per player. Commands
+# commit before each discord request, so a command that writes between requests opens a
+# transaction, and traces its BEGIN, each time
+BUDGETS = {
+    'create': lambda players: (15, 70),
+    'start': lambda players: (int(1.4 * players) + 20, int(2.2 * players) + 75),
+    'phase': lambda players: (int(1.3 * players) + 15, 20),
+    'death': lambda players: (3, 15),
+    'night': lambda players: (NIGHT_DEATHS + 2, 20),
+    'registration': lambda players: (players + 5, players + 20),
+}
+
+_games = itertools.count()
+START_DATE = (date.today() + timedelta(days=7)).isoformat()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def in_unit_of_work(command, *args):
+    async with db.unit_of_work():
+        return await command(*args)
+
+
+async def settle():
+    """waits for the registration and announcement work left running in the background"""
+    await registration.queue.flush()
+    await announcement.updater.flush()
+
+
+def new_guild(api, players) -> FakeGuild:
+    guild = FakeGuild(api, players)
+    server.members.load(guild)
+    return guild
+
+
+async def recruiting_game(guild):
+    """creates a game and returns its moderator channel context and game row"""
+    name = f'game{next(_games)}'
+    await in_unit_of_work(game.create, FakeContext(guild, guild.announcements), name, START_DATE)
+    await settle()
+    category = next(channel for channel in guild.categories if channel.name.lower() == name)
+    moderator = next(channel for channel in category.channels if channel.name == 'moderator')
+    return FakeContext(guild, moderator), await db.select_one_async('game', {'discord_category_id': category.id})
+
+
+async def initialized_game(guild):
+    """a recruiting game every member of guild has joined, with a scenario of the right size"""
+    ctx, game_data = await recruiting_game(guild)
+    game_id = game_data['game_id']
+    await db.insert_many_async('game_player', [{'game_id': game_id, 'discord_user_id': member.id}
+                                               for member in guild.members])
+    scenario_id = await db.insert_into_table_async('scenario', {'game_id': game_id, 'scenario_name': 'primary',
+                                                                'scope': 'local'})
+    werewolves = max(1, len(guild.members) // 4)
+    characters = [2] * werewolves + [3] + [1] * (len(guild.members) - werewolves - 1)
+    await db.insert_many_async('scenario_character', [{'scenario_id': scenario_id, 'character_id': character_id}
+                                                      for character_id in characters])
+    return ctx, game_id
+
+
+async def active_game(guild):
+    ctx, game_id = await initialized_game(guild)
+    await in_unit_of_work(game.start, ctx, 'primary')
+    await settle()
+    return ctx, game_id
+
+
+def record(benchmark, name, players, api, queries):
+    api_calls, statements = api.total(), queries.count
+    benchmark.extra_info.update({'api_calls': api_calls, 'api_calls_by_route': dict(api.calls),
+                                 'queries': statements})
+    max_api_calls, max_statements = BUDGETS[name](players)
+    assert api_calls <= max_api_calls, f'{name} made {api_calls} API calls, budget is {max_api_calls}: {api.calls}'
+    assert statements <= max_statements, f'{name} ran {statements} statements, budget is {max_statements}'
+
+
+def reset(api, queries):
+    api.calls.clear()
+    queries.count = 0
+
+
+@pytest.mark.parametrize('players', PLAYERS)
+def test_create(benchmark, database, api, queries, players):
+    guild = new_guild(api, players)
+
+    def setup():
+        reset(api, queries)
+        return (FakeContext(guild, guild.announcements), f'game{next(_games)}', START_DATE), {}
+
+    created = []
+
+    def create(ctx, name, starting_date):
+        run(in_unit_of_work(game.create, ctx, name, starting_date))
+        created.append(name)
+
+    benchmark.pedantic(create, setup=setup, rounds=5)
+    # --benchmark-disable runs a single round, so count the games created rather than the rounds asked for
+    assert len(guild.categories) == len(created)
+    record(benchmark, 'create', players, api, queries)
+
+
+def test_failed_create_is_discarded(database, api):
+    """a create that fails part way removes the game, its category, roles and announcement rather than leave them"""
+    guild = new_guild(api, 10)
+
+    async def failing_channel(*args, **kwargs):
+        await api.call('guild.create_channel')
+        raise discord.HTTPException(FakeResponse(500, 'Internal Server Error'), 'failed')
+
+    guild.create_text_channel = guild.create_voice_channel = failing_channel
+    with pytest.raises(discord.HTTPException):
+        run(in_unit_of_work(game.create, FakeContext(guild, guild.announcements), 'broken', START_DATE))
+
+    assert db.select_one('game', {'game_name': 'BROKEN'})['status'] == GameStatus.REMOVED.value
+    assert not guild.categories and not guild.roles and not guild.announcements.messages
+
+
+@pytest.mark.parametrize('players', PLAYERS)
+def test_start(benchmark, database, api, queries, players):
+    guild = new_guild(api, players)
+
+    def setup():
+        ctx, game_id = run(initialized_game(guild))
+        reset(api, queries)
+        return (ctx,), {}
+
+    def start(ctx):
+        run(in_unit_of_work(game.start, ctx, 'primary'))
+
+    benchmark.pedantic(start, setup=setup, rounds=3)
+    record(benchmark, 'start', players, api, queries)
+
+
+def test_start_snapshots_each_change(database, api):
+    """every status and phase change start makes is snapshotted, not only the first one in its unit of work"""
+    guild = new_guild(api, 10)
+    ctx, game_id = run(active_game(guild))
+    snapshots = db.select_rows('game_snapshot', {'game_id': game_id}, order_by='game_snapshot_id')
+    assert [json.loads(row['state'])['status'] for row in snapshots][-2:] == ['initializing', 'active']
+
+
+@pytest.mark.parametrize('players', PLAYERS)
+def test_update_game_permissions(benchmark, database, api, queries, players):
+    guild = new_guild(api, players)
+    ctx, game_id = run(active_game(guild))
+    phases = itertools.cycle(['night', 'day'])
+
+    def setup():
+        reset(api, queries)
+        return (next(phases),), {}
+
+    def phase_set(phase):
+        run(in_unit_of_work(game.phase_set, ctx, phase))
+
+    benchmark.pedantic(phase_set, setup=setup, rounds=6)
+    record(benchmark, 'phase', players, api, queries)
+
+
+def test_write_wait_during_create(benchmark, database):
+    """another command's write shouldn't wait on create's discord requests, only on its short transactions"""
+    guild = new_guild(DiscordStandIn(0.02), 50)
+    waits = []
+
+    async def write_while_creating():
+        creating = asyncio.get_running_loop().create_task(recruiting_game(guild))
+        while not creating.done():
+            started = time.perf_counter()
+            await db.insert_into_table_async('game_vote', {'game_id': 0, 'voter': 1, 'nominee': 2})
+            waits.append(time.perf_counter() - started)
+            await asyncio.sleep(0.005)
+        await creating
+
+    benchmark.pedantic(lambda: run(write_while_creating()), rounds=1)
+    benchmark.extra_info['longest_write_wait'] = max(waits)
+    # a single request takes 20ms, holding the writer across them would take the whole create
+    assert max(waits) < 0.02
+
+
+@pytest.mark.parametrize('players', PLAYERS)
+def test_death(benchmark, database, api, queries, players):
+    guild = new_guild(api, players)
+    ctx, game_id = run(active_game(guild))
+    victims = iter(guild.members[1:])
+
+    def setup():
+        reset(api, queries)
+        return (str(next(victims)),), {}
+
+    def death(player):
+        run(in_unit_of_work(event.death, ctx, player))
+
+    benchmark.pedantic(death, setup=setup, rounds=min(5, players - 1))
+    record(benchmark, 'death', players, api, queries)
+
+
+def test_death_withdraws_votes(database, api, monkeypatch):
+    """the votes of and for a player who dies are withdrawn without waiting on the death command's transaction"""
+    monkeypatch.setattr(vote, 'book', vote.VoteBook(interval=0))
+    guild = new_guild(api, 10)
+    ctx, game_id = run(active_game(guild))
+
+    async def kill_voted_player():
+        game_data = await db.select_one_async('game', {'game_id': game_id})
+        victim, voter = (await db.select_rows_async('game_player', {'game_id': game_id}, order_by='game_player_id'))[:2]
+        tally = await vote.book.tally(game_id, game_data['round'])
+        vote.book.cast(tally, voter['game_player_id'], victim['game_player_id'])
+        vote.book.cast(tally, victim['game_player_id'], voter['game_player_id'])
+        await vote.book.flush()
+
+        started = time.perf_counter()
+        await in_unit_of_work(event.death, ctx, str(guild.get_member(victim['discord_user_id'])))
+        await vote.book.flush()
+        return tally, victim, voter, time.perf_counter() - started
+
+    tally, victim, voter, seconds = run(kill_voted_player())
+    assert not tally.choices and not tally.counts
+    retracted = db.select_rows('game_vote', {'game_id': game_id, 'nominee': None})
+    assert sorted(row['voter'] for row in retracted) == sorted([victim['game_player_id'], voter['game_player_id']])
+    # well under the busy timeout a write from the command's transaction would wait out
+    assert seconds < 1
+
+
+@pytest.mark.parametrize('players', PLAYERS)
+def test_night_deaths(benchmark, database, api, queries, players):
+    guild = new_guild(api, players)
+    ctx, game_id = run(active_game(guild))
+    victims = iter(guild.members[1:])
+
+    def setup():
+        reset(api, queries)
+        return tuple(str(next(victims)) for _ in range(min(NIGHT_DEATHS, players - 1))), {}
+
+    killed = []
+
+    def night(*players):
+        run(in_unit_of_work(event.death, ctx, *players))
+        killed.extend(players)
+
+    benchmark.pedantic(night, setup=setup, rounds=min(3, (players - 1) // NIGHT_DEATHS))
+    record(benchmark, 'night', players, api, queries)
+    assert db.count_rows('game_player', {'game_id': game_id, 'vitals': 'deceased'}) == len(killed)
+
+
+def test_registration_after_start_is_dropped(database, api):
+    """reactions still queued when the game stops recruiting don't add players to it"""
+    guild = new_guild(api, 10)
+
+    async def react_then_start():
+        ctx, game_data = await recruiting_game(guild)
+        async with db.unit_of_work():
+            await game.set_status(game_data['game_id'], GameStatus.INITIALIZING)
+            # queued while the start holds the write lock, so the batch is applied once it has committed
+            for member in guild.members:
+                registration.queue.submit(game_data['game_id'], member, True, None, guild.announcements)
+            await asyncio.sleep(0.01)
+        await settle()
+        return game_data['game_id']
+
+    game_id = run(react_then_start())
+    assert db.count_rows('game_player', {'game_id': game_id}) == 0
+
+
+@pytest.mark.parametrize('players', PLAYERS)
+def test_registration(benchmark, database, api, queries, players, monkeypatch):
+    guild = new_guild(api, players)
+    monkeypatch.setattr(bot.bot, 'get_channel', lambda channel_id: guild.announcements)
+    monkeypatch.setattr(bot.bot, 'get_guild', lambda guild_id: guild)
+
+    def setup():
+        ctx, game_data = run(recruiting_game(guild))
+        run(announcement.index.load([guild.id]))
+        message = guild.announcements.messages[game_data['discord_announce_message_id']]
+        reset(api, queries)
+        return (message,), {}
+
+    async def react(message):
+        # every member reacts at once, the way a popular game fills up
+        await asyncio.gather(*[bot.on_raw_reaction_add(FakeReaction(message, member)) for member in guild.members])
+        await settle()
+
+    def register(message):
+        run(react(message))
+
+    benchmark.pedantic(register, setup=setup, rounds=3)
+    record(benchmark, 'registration', players, api, queries)
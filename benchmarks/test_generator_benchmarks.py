@@ -0,0 +1,39 @@
+"""test_generator_benchmarks.py benchmarks the scenario generator on a large character catalogue
+
+The catalogue is random but seeded: a villager and a werewolf that can be taken any number
+of times and specials of weighting -9 to 9 that are allowed at most once to three times.
+"""
+
+import random
+
+import pytest
+
+from werewolf import generator
+
+PLAYERS = [10, 40, 100]
+CATALOGUE_SIZE = 100
+MAX_MILLISECONDS = 250
+
+
+def catalogue(size) -> list:
+    rand = random.Random(0)
+    characters = [{'character_name': 'villager', 'weighting': 1, 'max_duplicates': 1000},
+                  {'character_name': 'werewolf', 'weighting': -6, 'max_duplicates': 1000}]
+    characters += [{'character_name': f'special{index}', 'weighting': rand.randint(-9, 9),
+                    'max_duplicates': rand.choice([1, 1, 2, 3])} for index in range(size - 2)]
+    return characters
+
+
+@pytest.mark.parametrize('players', PLAYERS)
+def test_generate(benchmark, players):
+    characters = catalogue(CATALOGUE_SIZE)
+    weightings = {character['character_name']: character['weighting'] for character in characters}
+
+    builds = benchmark(generator.generate, characters, players, 0, 3)
+
+    assert len(builds) == 3
+    for build in builds:
+        assert sum(build.counts.values()) == players
+        assert sum(weightings[name] * count for name, count in build.counts.items()) == build.weighting == 0
+    if benchmark.stats is not None:
+        assert benchmark.stats.stats.max * 1000 < MAX_MILLISECONDS
@@ -0,0 +1,59 @@
+"""test_guilds.py checks the backfill of games from before guild scoping and the shard settings"""
+
+import asyncio
+
+import discord
+import pytest
+
+import bot
+import database as db
+from werewolf import game
+
+from discord_stand_in import FakeGuild, FakeResponse
+
+
+def test_games_are_backfilled_once(database, api):
+    served, elsewhere = FakeGuild(api, 0), FakeGuild(api, 0)
+    categories = {}
+
+    async def make_categories():
+        categories['served'] = await served.create_category('SERVED')
+        categories['elsewhere'] = await elsewhere.create_category('ELSEWHERE')
+
+    async def fetch_channel(channel_id):
+        channel = elsewhere.get_channel(channel_id)
+        if channel is None:
+            raise discord.NotFound(FakeResponse(404, 'Not Found'), 'Unknown Channel')
+        return channel
+
+    asyncio.run(make_categories())
+    db.insert_many('game', [{'discord_category_id': categories['served'].id, 'game_name': 'SERVED'},
+                            {'discord_category_id': categories['elsewhere'].id, 'game_name': 'ELSEWHERE'},
+                            {'discord_category_id': 1, 'game_name': 'DELETED'}])
+
+    async def backfill():
+        await game.backfill_guild(served)
+        await game.backfill_unresolved(fetch_channel)
+
+    asyncio.run(backfill())
+    guilds = {row['game_name']: row['discord_guild_id'] for row in db.select_rows('game')}
+    assert guilds == {'SERVED': served.id, 'ELSEWHERE': elsewhere.id, 'DELETED': game.UNKNOWN_GUILD}
+    # so the next start doesn't scan the guilds again
+    assert db.count_rows('game', {'discord_guild_id': None}) == 0
+
+
+@pytest.mark.parametrize('count, ids', [(None, '0,1'), ('2', '1,2')])
+def test_shard_ids_are_checked_against_shard_count(monkeypatch, count, ids):
+    if count is None:
+        monkeypatch.delenv('SHARD_COUNT', raising=False)
+    else:
+        monkeypatch.setenv('SHARD_COUNT', count)
+    monkeypatch.setenv('SHARD_IDS', ids)
+    with pytest.raises(ValueError, match='SHARD_COUNT'):
+        bot.shard_options()
+
+
+def test_shard_options(monkeypatch):
+    monkeypatch.setenv('SHARD_COUNT', '4')
+    monkeypatch.setenv('SHARD_IDS', '2,3')
+    assert bot.shard_options() == {'shard_count': 4, 'shard_ids': [2, 3]}
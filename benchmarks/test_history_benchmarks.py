@@ -0,0 +1,55 @@
+"""test_history_benchmarks.py benchmarks rebuilding a game's state from its event log
+
+The log holds a game of 1000 players through 50 rounds, about 5000 events. Rebuilding
+from the latest phase snapshot only replays the events after it, the full replay from
+the first event is there for comparison.
+"""
+
+import asyncio
+import random
+
+import pytest
+
+import database as db
+from werewolf import history
+
+PLAYERS = 1000
+ROUNDS = 50
+GAME_ID = 1
+
+
+def play(snapshots: bool):
+    """logs a game where a random player dies or comes back between phases"""
+    rand = random.Random(0)
+
+    async def run():
+        await history.log.record(history.event(GAME_ID, history.CREATE, 0, status='recruiting'))
+        await history.log.record(*[history.event(GAME_ID, history.ASSIGN, 0, player_affected_id=player,
+                                                 character_id=1, position=player, affiliation='village')
+                                   for player in range(1, PLAYERS + 1)])
+        for round in range(1, ROUNDS + 1):
+            for phase in ('day', 'night'):
+                await history.log.record(history.event(GAME_ID, history.PHASE, round, phase, status='active'))
+                await history.log.record(*[history.event(GAME_ID, rand.choice([history.DEATH, history.RESURRECT]),
+                                                         round, phase, player_affected_id=rand.randint(1, PLAYERS))
+                                           for _ in range(50)])
+                if snapshots:
+                    await history.log.snapshot(GAME_ID)
+        # the tail of events since the last phase change
+        await history.log.record(*[history.event(GAME_ID, history.DEATH, ROUNDS, 'night', player_affected_id=player)
+                                   for player in range(1, 11)])
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize('snapshots', [True, False], ids=['from snapshot', 'full replay'])
+def test_rebuild(benchmark, database, snapshots):
+    play(snapshots)
+    events = db.count_rows('game_event', {'game_id': GAME_ID})
+
+    state, replayed = benchmark(lambda: asyncio.run(history.log.rebuild(GAME_ID)))
+
+    benchmark.extra_info.update({'events': events, 'replayed': replayed})
+    assert len(state.players) == PLAYERS
+    assert state.round == ROUNDS and state.phase == 'night'
+    assert replayed == (10 if snapshots else events)
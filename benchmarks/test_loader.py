@@ -0,0 +1,46 @@
+"""test_loader.py checks that loading a reference data snapshot skips, upserts and removes the right rows"""
+
+import pytest
+
+import database as db
+import loader
+
+ROLES = [{'role_id': 1, 'role_name': 'alive', 'default_value': 'alive'},
+         {'role_id': 2, 'role_name': 'deceased', 'default_value': 'deceased'},
+         {'role_id': 3, 'role_name': 'everyone', 'default_value': 'everyone'},
+         {'role_id': 4, 'role_name': 'spectator', 'default_value': 'spectator'}]
+
+
+def load(rows, table='role'):
+    result, = loader.load_tables({table: ('test', rows)})
+    return result
+
+
+def test_unchanged_snapshot_is_skipped(database):
+    assert not load(ROLES).skipped
+    assert load([dict(reversed(list(row.items()))) for row in ROLES]).skipped
+
+
+def test_changed_rows_are_upserted(database):
+    load(ROLES)
+    result = load([dict(row, role_name='ghost') if row['role_id'] == 4 else row for row in ROLES])
+    assert (result.changed, result.removed) == (1, 0)
+    assert db.select_one('role', {'role_id': 4})['role_name'] == 'ghost'
+
+
+def test_rows_missing_from_the_snapshot_are_removed(database):
+    load(ROLES)
+    result = load(ROLES[:3])
+    assert result.removed == 1
+    assert [row['role_id'] for row in db.select_rows('role', order_by='role_id')] == [1, 2, 3]
+    # the smaller snapshot is now the one that matches
+    assert load(ROLES[:3]).skipped
+
+
+def test_rows_still_referred_to_are_not_removed(database):
+    load(ROLES)
+    # role_permission still has permissions for the deceased role, so the load is rolled back whole
+    with pytest.raises(ValueError, match='role_permission'):
+        load([row for row in ROLES if row['role_id'] != 2])
+    assert db.count_rows('role') == 4
+    assert load(ROLES).skipped
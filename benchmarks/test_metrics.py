@@ -0,0 +1,59 @@
+"""test_metrics.py checks that database calls are timed and the Prometheus text file parses"""
+
+import re
+
+import database as db
+import metrics
+
+SAMPLE = re.compile(r'^([a-z_]+)\{((?:[a-z_]+="(?:[^"\\]|\\.)*",?)*)\} (\S+)$')
+LABEL = re.compile(r'([a-z_]+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse(text: str) -> dict:
+    """maps (sample name, labels) to value, failing on any line that isn't a comment or a sample"""
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('# HELP ') or line.startswith('# TYPE '):
+            continue
+        match = SAMPLE.match(line)
+        assert match, f'malformed line {line!r}'
+        name, labels, value = match.groups()
+        samples[name, tuple(LABEL.findall(labels))] = float(value)
+    return samples
+
+
+def test_database_calls_are_recorded(database):
+    metrics.registry.clear()
+    for _ in range(3):
+        db.select_rows('game', {'game_id': 1})
+    db.insert_into_table('game', {'discord_guild_id': 1, 'discord_category_id': 1, 'game_name': 'TIMED',
+                                  'status': 'recruiting', 'start_date': '2030-01-01'})
+
+    histograms = metrics.registry.histograms(metrics.DATABASE)
+    select = histograms[metrics.DATABASE, (('operation', 'select_rows'), ('table', 'game'))]
+    insert = histograms[metrics.DATABASE, (('operation', 'insert_into_table'), ('table', 'game'))]
+    assert select.count == 3 and sum(select.counts) == 3 and select.total > 0
+    assert insert.count == 1
+
+
+def test_render_is_well_formed(tmp_path):
+    metrics.registry.clear()
+    for seconds in (0.0005, 0.003, 0.003, 0.2, 30):
+        metrics.registry.observe(metrics.COMMAND, seconds, command='vote')
+    metrics.registry.observe(metrics.DISCORD_API, 0.1, route='GET /channels/{channel_id}/"quoted"')
+
+    path = tmp_path / 'werewolf.prom'
+    metrics.registry.write_textfile(path)
+    text = path.read_text()
+    assert text.endswith('\n')
+    assert f'# TYPE {metrics.COMMAND} histogram' in text
+    samples = parse(text)
+
+    labels = (('command', 'vote'),)
+    buckets = [samples[f'{metrics.COMMAND}_bucket', labels + (('le', str(bound)),)]
+               for bound in metrics.BUCKETS + ('+Inf',)]
+    assert buckets == sorted(buckets)
+    assert buckets[0] == 1 and buckets[-2] == 4 and buckets[-1] == 5
+    assert samples[f'{metrics.COMMAND}_count', labels] == 5
+    assert abs(samples[f'{metrics.COMMAND}_sum', labels] - 30.2065) < 1e-9
+    assert samples[f'{metrics.DISCORD_API}_count', (('route', 'GET /channels/{channel_id}/\\"quoted\\"'),)] == 1
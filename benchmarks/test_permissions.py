@@ -0,0 +1,23 @@
+"""test_permissions.py checks how resolve_permissions treats permission rows that match no character or role"""
+
+from werewolf import permissions
+
+
+def permission(channel_id, name, value, **columns):
+    return dict({'channel_id': channel_id, 'permission_name': name, 'permission_value': value,
+                 'game_status': None, 'game_phase': None, 'vitals_required': None}, **columns)
+
+
+def test_rows_without_a_role_or_character_are_skipped():
+    players = [{'discord_user_id': 10, 'character_id': 1, 'vitals': 'alive'},
+               {'discord_user_id': 11, 'character_id': None, 'vitals': 'alive'}]
+    roles = [{'role_id': 1, 'discord_role_id': 20}]
+    character_permissions = {1: [permission(1, 'send_messages', 1)],
+                             None: [permission(1, 'read_messages', 1)]}
+    role_permissions = {'1': [permission(1, 'read_messages', 1)],
+                        None: [permission(None, 'send_messages', 0)]}
+
+    matrix = permissions.resolve_permissions(players, roles, character_permissions, role_permissions, [1],
+                                             'day', 'active')
+    assert matrix == {1: {(permissions.MEMBER, 10): {'send_messages': True},
+                          (permissions.ROLE, 20): {'read_messages': True}}}
@@ -0,0 +1,50 @@
+"""test_query_plans.py checks that the hot lookups the bot runs are index seeks
+
+Runs EXPLAIN QUERY PLAN over the exact queries select_rows compiles for each lookup
+against the benchmark database and fails if any of them has to scan the table it is
+looking up.
+"""
+
+import pytest
+
+import database as db
+
+# (table, indicators, joins, table that must be searched by index)
+LOOKUPS = [('game', {'discord_guild_id': [1, 2], 'status': 'recruiting'}, None, 'game'),
+           ('game', {'discord_guild_id': 1, 'discord_category_id': 1}, None, 'game'),
+           ('game', {'discord_category_id': 1}, None, 'game'),
+           ('game', {'discord_announce_message_id': 1}, None, 'game'),
+           ('game', {'game_id': 1}, None, 'game'),
+           ('game_player', {'game_id': 1}, None, 'game_player'),
+           ('game_player', {'game_id': 1, 'discord_user_id': 1}, None, 'game_player'),
+           ('game_role', {'game_id': 1}, None, 'game_role'),
+           ('game_role', {'game_id': 1, 'default_value': 'alive'}, {'role': 'role_id'}, 'game_role'),
+           ('game_channel', {'game_id': 1}, None, 'game_channel'),
+           ('game_event', {'game_id': 1, 'game_event_id': db.After(1)}, None, 'game_event'),
+           ('game_snapshot', {'game_id': 1}, None, 'game_snapshot'),
+           ('game_vote', {'game_id': 1, 'round': 1, 'vote_type': 'lynch'}, None, 'game_vote'),
+           ('game_timer', {'fired_datetime': None}, None, 'game_timer'),
+           ('game_timer', {'game_id': 1, 'fired_datetime': None}, None, 'game_timer'),
+           ('scenario', {'discord_guild_id': 1}, None, 'scenario'),
+           ('scenario_character', {'scenario_id': 1}, None, 'scenario_character'),
+           ('scenario_character', {'scenario_id': 1}, {'character': 'character_id'}, 'scenario_character'),
+           ('character_permission', {'game_id': 1}, {'game_player': 'character_id'}, 'game_player'),
+           ('character_permission', {'game_id': 1}, {'game_player': 'character_id'}, 'character_permission'),
+           ('role_permission', {'game_id': 1}, {'game_role': 'role_id'}, 'game_role'),
+           ('role_permission', {'role_id': 1}, None, 'role_permission')]
+
+
+def is_index_seek(plan: list, table: str) -> bool:
+    for detail in plan:
+        words = detail.split()
+        if table in words and words[0] == 'SEARCH' and ('INDEX' in words or 'PRIMARY' in words):
+            return True
+    return False
+
+
+@pytest.mark.parametrize('table, indicators, joins, searched', LOOKUPS,
+                         ids=[f'{lookup[0]}-{"-".join(lookup[1])}-{lookup[3]}' for lookup in LOOKUPS])
+def test_lookup_is_index_seek(database, table, indicators, joins, searched):
+    plan = db.explain_query_plan(table, indicators, joins)
+    assert is_index_seek(plan, searched), \
+        f'{db.build_select(table, indicators, joins)[0]!r} scans {searched}:\n' + '\n'.join(plan)
@@ -0,0 +1,48 @@
+"""test_ratelimit.py checks that a busy or rate limited route doesn't hold up the scheduler's other routes"""
+
+import asyncio
+
+import discord
+
+import ratelimit
+
+from discord_stand_in import FakeResponse
+
+
+def test_saturated_route_doesnt_starve_others():
+    scheduler = ratelimit.ApiScheduler(max_concurrency=3, max_per_route=1)
+
+    async def play():
+        release = asyncio.Event()
+        busy = [asyncio.create_task(scheduler.run('busy', release.wait)) for _ in range(10)]
+        await asyncio.sleep(0.01)
+        # the queued busy calls hold no scheduler slot, so another route gets one straight away
+        result = await asyncio.wait_for(scheduler.run('other', asyncio.sleep, 0, 'done'), 1)
+        release.set()
+        await asyncio.gather(*busy)
+        return result
+
+    assert asyncio.run(play()) == 'done'
+
+
+def test_retry_after_is_waited_out_without_a_slot():
+    scheduler = ratelimit.ApiScheduler(max_concurrency=1)
+    attempts = []
+
+    async def limited():
+        attempts.append(asyncio.get_running_loop().time())
+        if len(attempts) == 1:
+            raise discord.HTTPException(FakeResponse(429, 'Too Many Requests', {'Retry-After': '0.2'}),
+                                        'rate limited')
+        return 'limited'
+
+    async def play():
+        first = asyncio.create_task(scheduler.run('limited', limited))
+        await asyncio.sleep(0.01)
+        # the only slot is free while the limited route waits for its retry after
+        other = await asyncio.wait_for(scheduler.run('other', asyncio.sleep, 0, 'other'), 0.1)
+        return other, await first
+
+    assert asyncio.run(play()) == ('other', 'limited')
+    assert scheduler.rate_limited == 1
+    assert attempts[1] - attempts[0] >= 0.2
@@ -0,0 +1,58 @@
+"""test_render.py checks that long tables are split into code block pages discord accepts"""
+
+import asyncio
+
+import render
+
+from discord_stand_in import FakeChannel
+
+HEADER = ['+------+---------+', '| name | status  |', '+======+=========+']
+
+
+def table(rows: int, width: int = 10) -> str:
+    return '\n'.join(HEADER + [f'| {index:04} | {"x" * width} |' for index in range(rows)])
+
+
+def body_of(page: str, prefix: str = '') -> list:
+    assert page.startswith(prefix + render.FENCE) and page.endswith(render.FENCE)
+    lines = page[len(prefix) + len(render.FENCE):-len(render.FENCE)].split('\n')
+    assert lines[:len(HEADER)] == HEADER
+    return lines[len(HEADER):]
+
+
+def test_short_table_is_one_page():
+    text = table(5)
+    assert render.paginate(text, 'Players:\n') == [f'Players:\n{render.FENCE}{text}{render.FENCE}']
+
+
+def test_long_table_is_split_at_the_limit():
+    text = table(300)
+    pages = render.paginate(text, 'Players:\n')
+    assert len(pages) > 1
+    assert all(len(page) <= render.MESSAGE_LIMIT for page in pages)
+    # only the first page has the prefix, every page repeats the header and no row is lost or reordered
+    rows = body_of(pages[0], 'Players:\n')
+    for page in pages[1:]:
+        rows += body_of(page)
+    assert rows == text.splitlines()[len(HEADER):]
+    # a page is only closed when the next row wouldn't fit
+    row_size = len(rows[0]) + 1
+    assert all(len(page) + row_size > render.MESSAGE_LIMIT for page in pages[:-1])
+
+
+def test_over_long_row_is_truncated():
+    text = table(3, width=5000)
+    pages = render.paginate(text)
+    assert all(len(page) <= render.MESSAGE_LIMIT for page in pages)
+    rows = [row for page in pages for row in body_of(page)]
+    assert len(rows) == 3
+    assert all(row.startswith(original[:100]) and len(row) < len(original)
+               for row, original in zip(rows, text.splitlines()[len(HEADER):]))
+
+
+def test_pages_are_sent_in_order(api):
+    channel = FakeChannel(api, 'tables', None)
+    text = table(300)
+    messages = asyncio.run(render.send_pages(channel, text, 'Players:\n'))
+    assert [message.content for message in messages] == render.paginate(text, 'Players:\n')
+    assert api.calls['channel.send'] == len(messages)
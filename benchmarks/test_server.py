@@ -0,0 +1,71 @@
+"""test_server.py checks the member name index commands look players up by"""
+
+import server
+
+from discord_stand_in import DiscordStandIn, FakeGuild, FakeMember
+
+
+def guild_with(*names):
+    guild = FakeGuild(DiscordStandIn(), 0)
+    for name in names:
+        member = FakeMember(guild.api, name, guild)
+        guild.members.append(member)
+    return guild
+
+
+def test_lookup_by_name_tag_and_nickname():
+    guild = guild_with('Alice', 'bob')
+    alice, bob = guild.members
+    bob.display_name = 'Robert'
+    index = server.MemberIndex()
+
+    assert index.lookup(guild, 'alice') == {alice.id}
+    assert index.lookup(guild, ' ALICE#0001 ') == {alice.id}
+    assert index.lookup(guild, 'robert') == index.lookup(guild, 'bob') == {bob.id}
+    assert index.lookup(guild, 'carol') == set()
+
+
+def test_shared_names_are_ambiguous():
+    guild = guild_with('alice', 'bob')
+    alice, bob = guild.members
+    bob.display_name = 'Alice'
+    assert server.MemberIndex().lookup(guild, 'alice') == {alice.id, bob.id}
+
+
+def test_index_follows_member_events():
+    guild = guild_with('alice')
+    alice, = guild.members
+    index = server.MemberIndex()
+    index.load(guild)
+
+    carol = FakeMember(guild.api, 'carol', guild)
+    index.add(carol)
+    assert index.lookup(guild, 'carol') == {carol.id}
+
+    before = FakeMember(guild.api, 'alice', guild)
+    before.id = alice.id
+    alice.display_name = 'Al'
+    index.update(before, alice)
+    assert index.lookup(guild, 'al') == {alice.id}
+    # a new nickname is added to the username, which still finds the member
+    assert index.lookup(guild, 'alice') == {alice.id}
+    alice.name, alice.display_name = 'alicia', 'alicia'
+    index.update(before, alice)
+    assert index.lookup(guild, 'al') == index.lookup(guild, 'alice') == set()
+
+    index.remove(carol)
+    assert index.lookup(guild, 'carol') == set()
+
+
+def test_members_of_an_unloaded_guild_wait_for_the_full_load():
+    guild = guild_with('alice')
+    index = server.MemberIndex()
+    # an event for a guild nobody has looked a name up in yet is picked up by the load
+    index.add(guild.members[0])
+    assert index.lookup(guild, 'alice') == {guild.members[0].id}
+
+
+def test_parse_member_id():
+    assert server.parse_member_id('<@!123456789012345678>') == 123456789012345678
+    assert server.parse_member_id(' 123456789012345678 ') == 123456789012345678
+    assert server.parse_member_id('alice') is None
@@ -0,0 +1,112 @@
+"""test_timer_benchmarks.py benchmarks the timer scheduler running the due timers of many games
+
+200 games have 5 timers each that are all due, as they would be after the bot was down for a
+while. One scheduler task dispatches all 1000 of them, each game's in order, each in its own
+unit of work, and every game_timer row has to end up marked as fired.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+import json
+
+import pytest
+
+import database as db
+from werewolf import timer
+
+from discord_stand_in import FakeGuild
+
+GAMES = 200
+TIMERS_PER_GAME = 5
+
+
+@pytest.fixture
+def counting_action():
+    ran = []
+
+    async def count(ctx, game_id, index):
+        ran.append({'game_id': game_id, 'index': index})
+
+    timer.timers.actions['count'] = count
+    yield ran
+    del timer.timers.actions['count']
+
+
+def test_due_timers(benchmark, database, api, counting_action):
+    guild = FakeGuild(api, 0)
+    channel = guild.announcements
+    db.insert_many('game_channel', [{'game_id': game_id, 'channel_id': 1, 'discord_channel_id': channel.id,
+                                     'name': 'moderator'} for game_id in range(1, GAMES + 1)])
+    now = datetime.now()
+
+    def run():
+        scheduler = timer.TimerScheduler()
+        scheduler.actions = timer.timers.actions
+
+        async def drain():
+            db.delete_from_table('game_timer')
+            # each game's timers come due one after another, and the games' timers interleave
+            await db.insert_many_async('game_timer', [
+                {'game_id': game_id, 'action': 'count', 'data': f'{{"game_id": {game_id}, "index": {index}}}',
+                 'due_datetime': (now - timedelta(minutes=TIMERS_PER_GAME - index, seconds=game_id)).replace(microsecond=0)}
+                for game_id in range(1, GAMES + 1) for index in range(TIMERS_PER_GAME)])
+            await scheduler.load()
+            task = scheduler.start(lambda channel_id: channel if channel_id == channel.id else None)
+            while scheduler.fired < GAMES * TIMERS_PER_GAME:
+                await asyncio.sleep(0.001)
+            task.cancel()
+
+        counting_action.clear()
+        asyncio.run(drain())
+
+    benchmark.pedantic(run, rounds=3)
+
+    assert len(counting_action) == GAMES * TIMERS_PER_GAME
+    assert db.count_rows('game_timer', {'outcome': timer.FIRED}) == GAMES * TIMERS_PER_GAME
+    # each game's timers run in the order they came due, not the order they were stored in
+    rows = sorted(db.select_rows('game_timer'), key=lambda row: (row['due_datetime'], row['game_timer_id']))
+    for game_id in range(1, GAMES + 1):
+        ran = [data['index'] for data in counting_action if data['game_id'] == game_id]
+        assert ran == [json.loads(row['data'])['index'] for row in rows if row['game_id'] == game_id]
+
+
+def test_slow_action_doesnt_hold_up_other_games(database, api):
+    """a timer action that takes a long time only delays the later timers of its own game"""
+    guild = FakeGuild(api, 0)
+    channel = guild.announcements
+    db.insert_many('game_channel', [{'game_id': game_id, 'channel_id': 1, 'discord_channel_id': channel.id,
+                                     'name': 'moderator'} for game_id in (1, 2)])
+    ran = []
+    release = None
+
+    async def slow(ctx, game_id, index):
+        if game_id == 1 and index == 0:
+            # waits like an action held up by the rate limit, its requests commit first
+            await db.checkpoint()
+            await release.wait()
+        ran.append((game_id, index))
+
+    async def play():
+        nonlocal release
+        release = asyncio.Event()
+        scheduler = timer.TimerScheduler()
+        scheduler.actions = {'slow': slow}
+        now = datetime.now()
+        await db.insert_many_async('game_timer', [
+            {'game_id': game_id, 'action': 'slow', 'data': f'{{"game_id": {game_id}, "index": {index}}}',
+             'due_datetime': (now - timedelta(minutes=10 - index)).replace(microsecond=0)}
+            for game_id in (1, 2) for index in range(3)])
+        await scheduler.load()
+        task = scheduler.start(lambda channel_id: channel)
+        while scheduler.fired < 3:
+            await asyncio.sleep(0.001)
+        # game 2 ran while game 1's first action was still going, and game 1 waits for it
+        assert ran == [(2, 0), (2, 1), (2, 2)]
+        release.set()
+        while scheduler.fired < 6:
+            await asyncio.sleep(0.001)
+        task.cancel()
+
+    # with the actions run one at a time game 2 would never get a turn
+    asyncio.run(asyncio.wait_for(play(), 5))
+    assert ran[3:] == [(1, 0), (1, 1), (1, 2)]
@@ -0,0 +1,64 @@
+"""test_vote_benchmarks.py benchmarks a 50 player lynch vote where players keep changing their minds
+
+Every player casts, changes or withdraws their vote 20 times, 1000 changes in all. The
+tally is updated in memory as each change arrives and the changes are written to game_vote
+in batches, so a round costs a handful of inserts rather than one per vote. Replaying
+game_vote afterwards has to give the same standings the counters did, less the votes of
+and for a player who has died since.
+"""
+
+import asyncio
+import random
+
+import database as db
+from werewolf import vote
+
+PLAYERS = 50
+CHANGES = 1000
+GAME_ID = 1
+
+
+def test_vote_changes(benchmark, database, queries):
+    db.insert_many('game_player', [{'game_player_id': player, 'game_id': GAME_ID, 'discord_user_id': player,
+                                    'vitals': 'alive'} for player in range(1, PLAYERS + 1)])
+    rand = random.Random(0)
+    changes = [(rand.randint(1, PLAYERS), rand.choice([None] + list(range(1, PLAYERS + 1)))) for _ in range(CHANGES)]
+    rounds = iter(range(1, 1000))
+    state = {}
+
+    def run():
+        book = vote.VoteBook(interval=0.01)
+
+        async def play():
+            tally = await book.tally(GAME_ID, next(rounds))
+            for voter, nominee in changes:
+                if nominee is None:
+                    book.retract(tally, voter)
+                else:
+                    book.cast(tally, voter, nominee)
+                # a vote arriving from discord gives the loop a turn between changes
+                await asyncio.sleep(0)
+            standings = tally.standings()
+            await book.flush()
+            return tally, standings
+
+        queries.count = 0
+        state['tally'], state['standings'] = asyncio.run(play())
+        state['statements'] = queries.count
+        state['batches'] = book.batches
+
+    benchmark.pedantic(run, rounds=5)
+
+    tally = state['tally']
+    replayed = asyncio.run(vote.VoteBook().tally(GAME_ID, tally.round))
+    assert replayed.standings() == state['standings']
+    assert sum(tally.counts.values()) == len(tally.choices) <= PLAYERS
+    # written in batches, not once per change
+    assert state['batches'] < CHANGES / 10
+    benchmark.extra_info.update({'batches': state['batches'], 'statements': state['statements']})
+
+    # a player who died while the tally wasn't loaded neither votes nor is voted for once it is
+    assert 1 in tally.choices or 1 in tally.counts
+    db.update_table('game_player', {'vitals': 'deceased'}, {'game_player_id': 1})
+    replayed = asyncio.run(vote.VoteBook().tally(GAME_ID, tally.round))
+    assert 1 not in replayed.choices and 1 not in replayed.counts
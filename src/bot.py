@@ -5,30 +5,144 @@ not much work is done in this file, it is mostly designed as a switching board
 to point events and commands to certain logic
 """
 
-from datetime import date, timedelta
-import logging
+import asyncio
+from datetime import date, datetime, timedelta
+import os
+import time
 
 import discord
 from discord.ext import commands
+from texttable import Texttable
 
 import database as db
 import globals
-from globals import GameStatus
-from werewolf import game, event, scenario
-
-bot = commands.Bot(command_prefix='!')
+import loader
+import metrics
+import render
+import server
+from werewolf import announcement, game, event, registration, scenario, timer, vote
+
+
+def shard_options() -> dict:
+    """the shards this process runs, from SHARD_COUNT and a comma separated SHARD_IDS
+
+    leaving both unset lets discord pick the shard count and runs every shard in this process,
+    several processes can share one database by each running a different set of SHARD_IDS
+    """
+    options = {}
+    if os.getenv('SHARD_COUNT'):
+        options['shard_count'] = int(os.getenv('SHARD_COUNT'))
+    if os.getenv('SHARD_IDS'):
+        options['shard_ids'] = [int(shard_id) for shard_id in os.getenv('SHARD_IDS').split(',')]
+        # AutoShardedBot only fails on these once it connects
+        if 'shard_count' not in options:
+            raise ValueError('SHARD_IDS needs SHARD_COUNT to be set too')
+        invalid = [shard_id for shard_id in options['shard_ids'] if not 0 <= shard_id < options['shard_count']]
+        if invalid:
+            raise ValueError(f'SHARD_IDS {invalid} are not shards of the {options["shard_count"]} in SHARD_COUNT')
+    return options
+
+
+intents = discord.Intents.default()
+# member events keep server.members up to date
+intents.members = True
+bot = commands.AutoShardedBot(command_prefix='!', intents=intents, **shard_options())
+# every discord API request is timed by its route, and the command's writes so far are committed
+# before it is sent so the write lock is never held while a request waits on discord
+bot.http.request = db.commits_first(metrics.timed_discord_request(bot.http.request))
+# the cache warm up, metrics export and timer scheduler started on the first on_ready
+background_tasks = []
+# games still creating from before this are left over from a create the last run didn't finish
+started = datetime.now().replace(microsecond=0)
 
 def setup(bot):
     bot.add_cog(Game(bot))
     bot.add_cog(Scenario(bot))
     bot.add_cog(Event(bot))
+    bot.add_cog(Vote(bot))
+    bot.add_cog(Stats(bot))
+    bot.add_cog(Admin(bot))
+
+async def warm_caches(guilds):
+    """loads the reference data and member names commands would otherwise load on first use"""
+    await db.reference_data.warm_async()
+    for guild in guilds:
+        server.members.load(guild)
+        # a guild with many members shouldn't hold up the event loop for the whole load
+        await asyncio.sleep(0)
+    metrics.startup_stage('caches_warm')
+
 
 @bot.event
 async def on_ready():
-    print(f'{bot.user} has connected to Discord!')
+    """runs on every reconnect too, the startup work is only done the first time"""
+    global background_tasks
+    if background_tasks:
+        return
+    guilds = list(bot.guilds)
+    # only games created before games were scoped to a guild need backfilling, and only once
+    if await db.count_rows_async('game', {'discord_guild_id': None}):
+        for guild in guilds:
+            await game.backfill_guild(guild)
+        await game.backfill_unresolved(bot.fetch_channel)
+    await game.discard_unfinished_games(guilds, started)
+    # reactions are ignored until their announcement is indexed so this is loaded before ready
+    await announcement.index.load([guild.id for guild in guilds])
+    # timers that came due while the bot was down run as soon as the scheduler starts
+    await timer.timers.load()
+
+    loop = asyncio.get_running_loop()
+    background_tasks = [loop.create_task(warm_caches(guilds)),
+                        loop.create_task(metrics.export_periodically(globals.METRICS_FILE_LOCATION)),
+                        timer.timers.start(bot.get_channel)]
+    seconds = metrics.startup_stage('ready')
+    print(f'{bot.user} has connected to Discord! ready {seconds:.1f}s after start')
+
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started = time.perf_counter()
+
+
+@bot.after_invoke
+async def record_command_time(ctx):
+    metrics.registry.observe(metrics.COMMAND, time.perf_counter() - ctx.started, command=ctx.command.qualified_name,
+                             outcome='failed' if ctx.command_failed else 'ok')
+
+
+@bot.event
+async def on_member_join(member):
+    server.members.add(member)
+
+
+@bot.event
+async def on_member_update(before, after):
+    server.members.update(before, after)
+    if str(before) != str(after) or before.display_name != after.display_name:
+        render.cache.changed(render.MEMBERS)
 
 
-class Game(commands.Cog):
+@bot.event
+async def on_member_remove(member):
+    server.members.remove(member)
+    render.cache.changed(render.MEMBERS)
+
+
+class UnitOfWorkCog(commands.Cog):
+    """runs each command of the cog in one database unit of work
+
+    a command's writes are committed once it returns, or rolled back if it fails, and before each discord
+    request it makes, so a failure only undoes what it wrote since its last request
+    """
+
+    async def cog_before_invoke(self, ctx):
+        ctx.unit_of_work = db.unit_of_work().start()
+
+    async def cog_after_invoke(self, ctx):
+        await ctx.unit_of_work.finish(commit=not ctx.command_failed)
+
+
+class Game(UnitOfWorkCog):
     def __init__(self, bot):
         self.bot = bot
 
@@ -74,8 +188,24 @@ class Game(commands.Cog):
     async def game_status_set(self, ctx, status):
         return await game.status_set(ctx, status)
 
+    @commands.command(name='game-timer-set',
+                      help='Runs start, phase or complete at a set time, given as a duration like "12h" or "YYYY-MM-DD HH:MM". phase takes day or night, start a scenario name')
+    @commands.has_role('Admin')
+    async def game_timer_set(self, ctx, action, when, value=None):
+        return await game.timer_set(ctx, action, when, value)
+
+    @commands.command(name='game-timer-list', help="lists the game's timers that are still to run")
+    @commands.has_role('Admin')
+    async def game_timer_list(self, ctx):
+        return await game.timer_list(ctx)
 
-class Scenario(commands.Cog):
+    @commands.command(name='game-timer-cancel', help='cancels a timer by its id from game-timer-list')
+    @commands.has_role('Admin')
+    async def game_timer_cancel(self, ctx, timer_id: int):
+        return await game.timer_cancel(ctx, timer_id)
+
+
+class Scenario(UnitOfWorkCog):
     def __init__(self, bot):
         self.bot = bot
 
@@ -90,6 +220,12 @@ class Scenario(commands.Cog):
     async def scenario_list(self, ctx):
         return await scenario.list(ctx)
 
+    @commands.command(name='scenario-generate',
+                      help='Suggests builds for a number of players whose weightings add up as close to the target as possible, optionally leaving out characters harder than max_difficulty')
+    @commands.has_role('Admin')
+    async def scenario_generate(self, ctx, players: int, target_weighting: int = 0, max_difficulty: int = None):
+        return await scenario.generate(ctx, players, target_weighting, max_difficulty)
+
     @commands.command(name='scenario-character-add',
                       help='Add a character to scenario, lower case comma seperated list of characters to add. Pass quantities after name seperated by pipe "|". NO SPACES. e.g. "werewolf|2,villager|4,seer"')
     @commands.has_role('Admin')
@@ -113,77 +249,111 @@ class Scenario(commands.Cog):
         return await scenario.purge(ctx, scenario_name)
 
 
-class Event(commands.Cog):
+class Event(UnitOfWorkCog):
     def __init__(self, bot):
         self.bot = bot
 
-    @commands.command(name='death', help='provide a characters name and tag to kill in the form of "player#0000"')
+    @commands.command(name='death',
+                      help='provide the names and tags of the characters to kill in the form of "player#0000", separated by spaces')
     @commands.has_role('Admin')
-    async def death(self, ctx, player):
-        return await event.death(ctx, player)
+    async def death(self, ctx, *players):
+        return await event.death(ctx, *players)
 
     @commands.command(name='resurrect',
-                      help='provide a characters name and tag to resurrect in the form of "player#0000"')
+                      help='provide the names and tags of the characters to resurrect in the form of "player#0000", separated by spaces')
     @commands.has_role('Admin')
-    async def resurrect(self, ctx, player):
-        return await event.resurrect(ctx, player)
+    async def resurrect(self, ctx, *players):
+        return await event.resurrect(ctx, *players)
 
 
-#todo make these into one function
-@bot.event
-async def on_raw_reaction_add(payload):
-    if payload.member.bot == True:
-        return
-    channel = bot.get_channel(payload.channel_id)
-    if str(channel) == 'game-announcements':
-        game_table = db.select_table('game', {'status': GameStatus.RECRUITING.value})
-        # game_table = game_table[game_table['status'].str.lower() == ]
+class Vote(commands.Cog):
+    """votes are tallied in memory and written in batches by vote.book, not in a unit of work"""
 
-        guild = bot.get_guild(payload.guild_id)
+    def __init__(self, bot):
+        self.bot = bot
 
-        for idx, row in game_table.iterrows():
-            if payload.message_id == row[
-                'discord_announce_message_id'] and payload.emoji.name == globals.GAME_REACTION_EMOJI:
-                role_id = db.select_table('game_role', {'game_id': row['game_id'], 'default_value': 'alive'},
-                                          joins={'role': 'role_id'}).iloc[0]['discord_role_id']
-                role = guild.get_role(role_id)
+    @commands.command(name='vote', help='Vote to lynch a player during the day, voting again changes your vote')
+    async def vote(self, ctx, player):
+        return await vote.cast(ctx, player)
 
-                member = guild.get_member(payload.user_id)
-                await member.add_roles(role)
+    @commands.command(name='unvote', help='Withdraw your vote')
+    async def unvote(self, ctx):
+        return await vote.retract(ctx)
 
-                # add member to database
-                game_player_data = {'game_id': row['game_id'],
-                                    'discord_user_id': member.id}
-                db.insert_into_table('game_player', game_player_data)
+    @commands.command(name='votes', help="Shows who has voted for who in today's vote")
+    async def votes(self, ctx):
+        return await vote.standings(ctx)
 
-                await game.update_announcement_message(channel, row['game_id'])
 
-                return
+class Stats(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
 
+    @commands.command(name='bot-stats', help='Shows where the bot has spent its time since it started')
+    @commands.has_role('Admin')
+    async def stats(self, ctx):
+        sections = [('Commands', metrics.COMMAND, ('command', 'outcome')),
+                    ('Database', metrics.DATABASE, ('operation', 'table')),
+                    ('Discord API', metrics.DISCORD_API, ('route',))]
+        for title, metric, labels in sections:
+            table = Texttable(max_width=0)
+            table.set_deco(Texttable.HEADER)
+            table.header([title, 'Count', 'Mean ms', 'p95 ms', 'Total ms'])
+            table.add_rows(metrics.summary(metric, labels), header=False)
+            await render.send_pages(ctx.channel, table.draw(), header_lines=2)
+
+        cache = db.reference_data.stats()
+        rendered = render.cache.stats()
+        await ctx.send(f"reference cache: {cache['hits']} hits, {cache['misses']} misses, "
+                       f"tables loaded: {', '.join(cache['tables_loaded'])}\n"
+                       f"render cache: {rendered['hits']} hits, {rendered['misses']} misses, "
+                       f"{rendered['entries']} entries")
+
+
+class Admin(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
 
-@bot.event
-async def on_raw_reaction_remove(payload):
-    game_table = db.select_table('game', {'status': GameStatus.RECRUITING.value})
+    @commands.command(name='reference-reload',
+                      help='Reloads the reference data from the snapshot in data/reference, games in progress are kept')
+    @commands.has_role('Admin')
+    async def reference_reload(self, ctx):
+        try:
+            results = await loader.load_snapshot_async()
+        except (ImportError, OSError, ValueError) as error:
+            await ctx.send(f'reference data was not reloaded: {error}')
+            return
+        await ctx.send('reference data reloaded\n' + '\n'.join(str(result) for result in results))
 
-    channel = bot.get_channel(payload.channel_id)
-    if str(channel) == 'game-announcements':
 
-        guild = bot.get_guild(payload.guild_id)
-        for idx, row in game_table.iterrows():
-            if payload.message_id == row[
-                'discord_announce_message_id'] and payload.emoji.name == globals.GAME_REACTION_EMOJI:
-                role_id = db.select_table('game_role', {'game_id': row['game_id'], 'default_value': 'alive'},
-                                          joins={'role': 'role_id'}).iloc[0]['discord_role_id']
-                role = guild.get_role(role_id)
+#todo make these into one function
+@bot.event
+async def on_raw_reaction_add(payload):
+    entry = announcement.index.get(payload.message_id)
+    if entry is None or entry.guild_id != payload.guild_id or payload.emoji.name != globals.GAME_REACTION_EMOJI:
+        return
+    if payload.member.bot == True:
+        return
+    channel = bot.get_channel(payload.channel_id)
+    guild = bot.get_guild(payload.guild_id)
 
-                member = guild.get_member(payload.user_id)
-                await member.remove_roles(role)
+    role = guild.get_role(entry.alive_role_id)
+    registration.queue.submit(entry.game_id, payload.member, True, role, channel)
 
-                db.delete_from_table('game_player', {'game_id': row['game_id'], 'discord_user_id': member.id})
 
-                await game.update_announcement_message(channel, row['game_id'])
+@bot.event
+async def on_raw_reaction_remove(payload):
+    entry = announcement.index.get(payload.message_id)
+    if entry is None or entry.guild_id != payload.guild_id or payload.emoji.name != globals.GAME_REACTION_EMOJI:
+        return
+    channel = bot.get_channel(payload.channel_id)
+    guild = bot.get_guild(payload.guild_id)
 
-                return
+    role = guild.get_role(entry.alive_role_id)
+    member = guild.get_member(payload.user_id)
+    if member is None:
+        return
+    registration.queue.submit(entry.game_id, member, False, role, channel)
 
 
 @bot.event
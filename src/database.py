@@ -1,352 +1,1333 @@
 from __future__ import print_function
-from datetime import datetime
+import asyncio
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+import contextvars
+from datetime import date, datetime
+from enum import Enum
+import functools
 import logging
 import os
+import queue
+import re
 import sqlite3
+import threading
+import weakref
 
-from dotenv import load_dotenv
-from gsheets import Sheets
 import os.path
-import pandas as pd
+import sys
 
 import globals
+import metrics
 
+# applied to every connection the ConnectionManager opens
+CONNECTION_PRAGMAS = ['PRAGMA journal_mode=WAL',
+                      'PRAGMA synchronous=NORMAL',
+                      'PRAGMA temp_store=MEMORY',
+                      'PRAGMA cache_size=-16000',
+                      'PRAGMA mmap_size=134217728',
+                      'PRAGMA busy_timeout=5000']
 
-def create_database_tables():
-    with sqlite3.connect(globals.DB_FILE_LOCATION) as db:
+# callbacks given the text of every statement any connection runs, for benchmarks and instrumentation
+statement_listeners = []
+
+
+def trace_statement(statement: str):
+    for listener in statement_listeners:
+        listener(statement)
+
+
+# callbacks given (table, game_ids) when a write helper changes a table, game_ids is None unless the
+# write was narrowed to particular games. they are called as the write happens and again once it commits
+change_listeners = []
+
+
+def changed_game_ids(rows):
+    """the game_ids a write touches, None when a row or condition doesn't say which game it belongs to"""
+    game_ids = set()
+    for row in rows:
+        if not isinstance(row, dict) or row.get('game_id') is None:
+            return None
+        value = row['game_id']
+        game_ids.update(value if isinstance(value, (list, tuple, set)) else [value])
+    return game_ids
+
+
+def notify_change(table: str, rows):
+    if not change_listeners or not rows:
+        return
+    game_ids = changed_game_ids(rows)
+
+    def notify():
+        for listener in change_listeners:
+            listener(table, game_ids)
+
+    notify()
+    unit = _unit_of_work.get()
+    if unit is not None and not unit.closed:
+        unit.callbacks.append(notify)
+
+
+class ConnectionManager:
+    """Keeps SQLite connections open for the life of the process
+
+    A single writer connection is shared behind a lock and a small pool of reader
+    connections is handed out for selects. Every connection runs in WAL mode so
+    readers never wait on the writer and commits don't pay a full fsync.
+    """
+
+    def __init__(self, db_file, max_readers=4):
+        self.db_file = db_file
+        self.max_readers = max_readers
+        self._writer = None
+        self._writer_owner = None
+        self._write_lock = threading.RLock()
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._pool_lock = threading.Lock()
+        self._connections = []
+        self._transaction = None
+
+    def connect(self):
+        connection = sqlite3.connect(str(self.db_file), isolation_level=None, check_same_thread=False,
+                                     cached_statements=256)
+        for pragma in CONNECTION_PRAGMAS:
+            connection.execute(pragma)
+        connection.set_trace_callback(trace_statement)
+        self._connections.append(connection)
+        return connection
+
+    @contextmanager
+    def writer(self):
+        """yields the writer connection inside a transaction that commits on exit
+
+        nested calls from the same thread join the transaction that is already open
+        """
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self.connect()
+            if self._writer_owner == threading.get_ident():
+                yield self._writer
+                return
+
+            self._writer_owner = threading.get_ident()
+            try:
+                self._writer.execute('BEGIN IMMEDIATE')
+                yield self._writer
+                self._writer.commit()
+            except BaseException:
+                self._writer.rollback()
+                raise
+            finally:
+                self._writer_owner = None
+
+    @contextmanager
+    def reader(self):
+        """yields a pooled reader connection, or the writer if this thread has a write open"""
+        if self._writer_owner == threading.get_ident():
+            yield self._writer
+            return
+
+        connection = None
         try:
-            cursor = db.cursor()
-
-            # create table GAME
-            cursor.execute('''CREATE TABLE IF NOT EXISTS game(
-                                    game_id INTEGER PRIMARY KEY AUTOINCREMENT
-                                    ,discord_category_id INTEGER NOT NULL
-                                    ,discord_announce_message_id INTEGER
-                                    ,game_name TEXT
-                                    ,start_date DATE
-                                    ,end_date DATE
-                                    ,number_of_players INTEGER
-                                    ,status TEXT
-                                    ,phase TEXT
-                                    ,game_length INTEGER
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                               )''')
-            # create table CHANNEL
-            cursor.execute('''CREATE TABLE IF NOT EXISTS channel(
-                                    channel_id INTEGER PRIMARY KEY
-                                    ,channel_name TEXT
-                                    ,channel_order INTEGER
-                                    ,channel_topic TEXT
-                                    ,channel_type TEXT
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                               )''')
-            # create table CHARACTER
-            cursor.execute('''CREATE TABLE IF NOT EXISTS character(
-                                    character_id INTEGER PRIMARY KEY
-                                    ,character_display_name TEXT
-                                    ,character_name TEXT
-                                    ,weighting INTEGER
-                                    ,max_duplicates INTEGER
-                                    ,difficulty INTEGER
-                                    ,starting_affiliation TEXT
-                                    ,seen_affiliation TEXT
-                                    ,char_short_description TEXT
-                                    ,char_card_description TEXT
-                                    ,char_full_description TEXT
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                )''')
-            # create table EVENT
-            cursor.execute('''CREATE TABLE IF NOT EXISTS event(
-                                    event_id INTEGER PRIMARY KEY
-                                    ,event_name TEXT
-                                    ,event_description TEXT
-                                    ,character_acting_id INTEGER
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,FOREIGN KEY(character_acting_id) REFERENCES character(character_id)
-                                )''')
-            # create table ROLE
-            cursor.execute('''CREATE TABLE IF NOT EXISTS role(
-                                    role_id INTEGER PRIMARY KEY
-                                    ,role_name TEXT
-                                    ,role_description TEXT
-                                    ,default_value TEXT
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                )''')
-            # create table SCENARIO
-            cursor.execute('''CREATE TABLE IF NOT EXISTS scenario(
-                                    scenario_id INTEGER PRIMARY KEY AUTOINCREMENT
-                                    ,game_id INTEGER
-                                    ,scenario_name TEXT
-                                    ,scope TEXT
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,FOREIGN KEY(game_id) REFERENCES game(game_id)
-                                )''')
-            # create table ROLE_PERMISSION
-            cursor.execute('''CREATE TABLE IF NOT EXISTS role_permission (
-                                   role_permission_id INTEGER PRIMARY KEY AUTOINCREMENT
-                                   ,channel_id INTEGER
-                                   ,permission_name INTEGER
-                                   ,permission_value INTEGER
-                                   ,role_id TEXT
-                                   ,game_status TEXT
-                                   ,game_phase TEXT
-                                   ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                   ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                   ,FOREIGN KEY(channel_id) REFERENCES channel(channel_id)
-                                   ,FOREIGN KEY(role_id) REFERENCES role(role_id)
-                               )''')
-            # create table GAME_PLAYER
-            cursor.execute('''CREATE TABLE IF NOT EXISTS game_player(
-                                    game_player_id INTEGER PRIMARY KEY AUTOINCREMENT
-                                    ,game_id INTEGER NOT NULL
-                                    ,character_id INTEGER
-                                    ,starting_character_id INTEGER
-                                    ,discord_user_id INTEGER NOT NULL
-                                    ,current_affiliation TEXT
-                                    ,position INTEGER
-                                    ,vitals BOOLEAN DEFAULT True
-                                    ,rounds_survived INTEGER
-                                    ,result TEXT
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,FOREIGN KEY(game_id) REFERENCES game(game_id)
-                                    ,FOREIGN KEY(character_id) REFERENCES character(character_id)
-                                    ,FOREIGN KEY(starting_character_id) REFERENCES character(character_id)
-                                )''')
-            # create table GAME_PLAYER_CONDITION
-            cursor.execute('''CREATE TABLE IF NOT EXISTS game_player_condition (
-                                    game_player_condition_id INTEGER PRIMARY KEY AUTOINCREMENT
-                                    ,game_player_id INTEGER NOT NULL
-                                    ,condition TEXT
-                                    ,round_received INTEGER
-                                    ,active BOOLEAN DEFAULT True
-                                    ,duration INTEGER
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,FOREIGN KEY(game_player_id) REFERENCES game_player(game_player_id)
-                                )''')
-            # create table SCENARIO_CHARACTER
-            cursor.execute('''CREATE TABLE IF NOT EXISTS scenario_character (
-                                   scenario_character_id INTEGER PRIMARY KEY AUTOINCREMENT
-                                   ,scenario_id INTEGER NOT NULL
-                                   ,character_id INTEGER NOT NULL
-                                   ,requirement BOOLEAN DEFAULT True
-                                   ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                   ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                   ,FOREIGN KEY(scenario_id) REFERENCES scenario(scenario_id)
-                                   ,FOREIGN KEY(character_id) REFERENCES character(character_id)
-                               )''')
-            # create table GAME_EVENT
-            cursor.execute('''CREATE TABLE IF NOT EXISTS game_event(
-                                    game_event_id INTEGER PRIMARY KEY AUTOINCREMENT
-                                    ,game_id INTEGER NOT NULL
-                                    ,event_id INTEGER NOT NULL
-                                    ,event_taken TEXT
-                                    ,player_acting_id INTEGER
-                                    ,player_affected_id INTEGER
-                                    ,round INTEGER
-                                    ,datetime DATETIME DEFAULT (datetime('now'))
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,FOREIGN KEY(game_id) REFERENCES game(game_id)
-                                    ,FOREIGN KEY(event_id) REFERENCES event(event_id)
-                                    ,FOREIGN KEY(player_acting_id) REFERENCES game_player(game_player_id)
-                                    ,FOREIGN KEY(player_affected_id) REFERENCES game_player(game_player_id)
-                                )''')
-            # create table GAME_CHANNEL
-            cursor.execute('''CREATE TABLE IF NOT EXISTS game_channel(
-                                    game_channel_id INTEGER PRIMARY KEY AUTOINCREMENT
-                                    ,game_id INTEGER NOT NULL
-                                    ,channel_id INTEGER NOT NULL
-                                    ,discord_channel_id INTEGER NOT NULL
-                                    ,name TEXT
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,FOREIGN KEY(game_id) REFERENCES game(game_id)
-                                    ,FOREIGN KEY(channel_id) REFERENCES channel(channel_id)
-                                )''')
-            # create table GAME_ROLE
-            cursor.execute('''CREATE TABLE IF NOT EXISTS game_role(
-                                    game_role_id INTEGER PRIMARY KEY AUTOINCREMENT
-                                    ,game_id INTEGER NOT NULL
-                                    ,role_id INTEGER NOT NULL
-                                    ,discord_role_id INTEGER NOT NULL
-                                    ,game_role_name TEXT
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,FOREIGN KEY(game_id) REFERENCES game(game_id)
-                                    ,FOREIGN KEY(role_id) REFERENCES role(role_id)
-                                )''')
-            # create table CHARACTER_PERMISSION
-            cursor.execute('''CREATE TABLE IF NOT EXISTS character_permission(
-                                    character_permission_id INTEGER PRIMARY KEY AUTOINCREMENT
-                                    ,character_id INTEGER NOT NULL
-                                    ,channel_id INTEGER NOT NULL
-                                    ,permission_name TEXT 
-                                    ,permission_value TEXT
-                                    ,game_status TEXT
-                                    ,game_phase TEXT
-                                    ,vitals_required TEXT
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,FOREIGN KEY(character_id) REFERENCES character(character_id)
-                                    ,FOREIGN KEY(channel_id) REFERENCES channel(channel_id)
-                                )''')
-            # create table GAME_VOTES
-            cursor.execute('''CREATE TABLE IF NOT EXISTS game_vote(
-                                    game_vote_id INTEGER PRIMARY KEY AUTOINCREMENT
-                                    ,game_id INTEGER NOT NULL
-                                    ,voter INTEGER 
-                                    ,nominee INTEGER
-                                    ,vote_type TEXT
-                                    ,round INTEGER
-                                    ,datetime DATETIME DEFAULT (datetime('now'))
-                                    ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
-                                    ,FOREIGN KEY(game_id) REFERENCES game(game_id)
-                                    ,FOREIGN KEY(voter) REFERENCES game_player(game_player_id)
-                                    ,FOREIGN KEY(nominee) REFERENCES game_player(game_player_id)
-                                )''')
-
-            db.commit()
-        except Exception as e:
-            db.rollback()
-            raise e
+            connection = self._readers.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                if self._reader_count < self.max_readers:
+                    self._reader_count += 1
+                    connection = self.connect()
+        if connection is None:
+            connection = self._readers.get()
 
+        try:
+            yield connection
+        finally:
+            self._readers.put(connection)
 
-def insert_into_table(table:str, data):
-    columns = ''
-    values  = []
-    num_values = 0
+    def transaction_connection(self):
+        """the connection a UnitOfWork runs its transaction on, only one unit holds it at a time"""
+        with self._pool_lock:
+            if self._transaction is None:
+                self._transaction = self.connect()
+            return self._transaction
+
+    def close(self):
+        with self._write_lock, self._pool_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+            self._writer = None
+            self._transaction = None
+            self._readers = queue.LifoQueue()
+            self._reader_count = 0
+
+
+_connection_manager = None
+_connection_manager_lock = threading.Lock()
+
+
+def get_connection_manager() -> ConnectionManager:
+    """returns the process wide ConnectionManager, reopening it if DB_FILE_LOCATION has changed"""
+    global _connection_manager
+    with _connection_manager_lock:
+        if _connection_manager is None or _connection_manager.db_file != globals.DB_FILE_LOCATION:
+            if _connection_manager is not None:
+                _connection_manager.close()
+            _connection_manager = ConnectionManager(globals.DB_FILE_LOCATION)
+        return _connection_manager
+
+
+def close_connections():
+    global _connection_manager
+    with _connection_manager_lock:
+        if _connection_manager is not None:
+            _connection_manager.close()
+            _connection_manager = None
+
+
+_pandas = None
+
+
+def pandas():
+    """imports pandas on first use
+
+    only reading a Parquet reference snapshot needs it, see loader.read_parquet
+    """
+    global _pandas
+    if _pandas is None:
+        import pandas as pd
+        pd.set_option('display.max_rows', 500)
+        pd.set_option('display.max_columns', 500)
+        pd.set_option('display.width', 1000)
+        _pandas = pd
+    return _pandas
+
+
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        # one thread per pooled reader plus one for the writer
+        _executor = ThreadPoolExecutor(max_workers=5, thread_name_prefix='database')
+    return _executor
+
+
+async def run_in_executor(func, *args, **kwargs):
+    """runs a blocking database call on the database thread pool so the event loop is never stalled"""
+    loop = asyncio.get_event_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+
+_unit_of_work = contextvars.ContextVar('unit_of_work', default=None)
+_async_write_locks = weakref.WeakKeyDictionary()
+
+
+def get_async_write_lock() -> asyncio.Lock:
+    """the lock async writers queue on, held by a UnitOfWork from its first write until it finishes"""
+    loop = asyncio.get_event_loop()
+    if loop not in _async_write_locks:
+        _async_write_locks[loop] = asyncio.Lock()
+    return _async_write_locks[loop]
+
+
+class UnitOfWork:
+    """groups every write made while it is active into a single transaction
+
+    The transaction is only opened at the first write so commands that only read never hold
+    the write lock. From then on reads use the same connection so they see the pending writes.
+    Each helper call runs inside a savepoint so a failed statement doesn't undo earlier ones.
+
+    A checkpoint commits what has been written so far and gives the write lock back until the
+    next write, the bot takes one before every discord request so no other command, and no other
+    process sharing the database, waits on a command's API calls. A failure after a checkpoint
+    only rolls back the writes made since it, a command that makes discord objects and records
+    them as it goes, like game.create, has to clean up after itself if it fails part way.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.lock = threading.Lock()
+        self.closed = False
+        self.callbacks = []
+        self.before_commit_callbacks = []
+        self._joined = False
+        self._token = None
+        self._begin_lock = None
+        # writes running on the connection, a checkpoint waits for them before it commits
+        self._writers = 0
+        self._idle = None
+
+    @property
+    def active(self) -> bool:
+        return not self.closed and self.connection is not None
+
+    def start(self):
+        if _unit_of_work.get() is not None:
+            # nested units join the transaction of the outer one
+            self._joined = True
+            return self
+        self._token = _unit_of_work.set(self)
+        self._begin_lock = asyncio.Lock()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        return self
+
+    @asynccontextmanager
+    async def writing(self):
+        """opens the transaction if it isn't yet and keeps it open until the write inside finishes"""
+        async with self._begin_lock:
+            await self._open_transaction()
+            self._writers += 1
+            self._idle.clear()
+        try:
+            yield
+        finally:
+            self._writers -= 1
+            if not self._writers:
+                self._idle.set()
+
+    async def _open_transaction(self):
+        if self.connection is not None:
+            return
+        write_lock = get_async_write_lock()
+        await write_lock.acquire()
+        try:
+            self.connection = await run_in_executor(self._begin)
+        except BaseException:
+            write_lock.release()
+            raise
+
+    async def checkpoint(self):
+        """commits what has been written so far and releases the write lock until the next write"""
+        if self._joined or self.closed:
+            return
+        # callbacks write their batches into the transaction they are committed with
+        while self.before_commit_callbacks:
+            await self.before_commit_callbacks.pop(0)()
+        async with self._begin_lock:
+            await self._idle.wait()
+            if self.connection is None:
+                return
+            try:
+                await run_in_executor(self._end, True)
+            finally:
+                self.connection = None
+                get_async_write_lock().release()
+        callbacks, self.callbacks = self.callbacks, []
+        # the command carries on in this unit, but anything the callbacks start, like a background
+        # flush, outlives it and mustn't read or write through its transaction
+        token = _unit_of_work.set(None)
+        try:
+            for callback in callbacks:
+                callback()
+        finally:
+            _unit_of_work.reset(token)
+
+    def _begin(self):
+        connection = get_connection_manager().transaction_connection()
+        connection.execute('BEGIN IMMEDIATE')
+        return connection
+
+    def _end(self, commit: bool):
+        with self.lock:
+            if commit:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+
+    async def finish(self, commit: bool = True):
+        if self._joined or self.closed:
+            return
+        if commit:
+            try:
+                # callbacks may add more callbacks, or write and so open the transaction
+                while self.before_commit_callbacks:
+                    await self.before_commit_callbacks.pop(0)()
+            except BaseException:
+                await self.finish(commit=False)
+                raise
+        self.closed = True
+        _unit_of_work.reset(self._token)
+        if self.connection is not None:
+            try:
+                await run_in_executor(self._end, commit)
+            finally:
+                self.connection = None
+                get_async_write_lock().release()
+
+        if commit:
+            for callback in self.callbacks:
+                callback()
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.finish(commit=exc_type is None)
+
+
+async def checkpoint():
+    """commits the active unit of work's writes so far, nothing to do outside of one or before it has written"""
+    unit = _unit_of_work.get()
+    if unit is not None and unit.active:
+        await unit.checkpoint()
+
+
+def commits_first(request):
+    """wraps a discord request so the unit of work it is made in commits before it is sent
+
+    a request can wait on the rate limit for seconds, the write lock shouldn't be held meanwhile
+    """
+    @functools.wraps(request)
+    async def wrapper(*args, **kwargs):
+        await checkpoint()
+        return await request(*args, **kwargs)
+
+    return wrapper
+
+
+def in_write_transaction() -> bool:
+    """True inside a unit of work that has written, whose reads can see rows that aren't committed yet"""
+    unit = _unit_of_work.get()
+    return unit is not None and unit.active
+
+
+def current_unit_of_work():
+    """the unit of work the current task is in, None outside of one"""
+    unit = _unit_of_work.get()
+    return unit if unit is not None and not unit.closed else None
+
+
+def before_commit(callback) -> bool:
+    """awaits callback() as the active unit of work finishes, its writes are committed with the rest
+
+    lets writes made across a command be gathered up and made as one batch, returns False outside
+    of a unit of work where the caller has to write straight away
+    """
+    unit = current_unit_of_work()
+    if unit is None:
+        return False
+    unit.before_commit_callbacks.append(callback)
+    return True
+
+
+def after_commit(callback):
+    """runs callback once the active unit of work commits, or straight away outside of one
+
+    in memory state that mirrors the database should be updated this way so a rollback can't leave it ahead
+    """
+    unit = _unit_of_work.get()
+    if unit is not None and not unit.closed:
+        unit.callbacks.append(callback)
+    else:
+        callback()
+
+
+def unit_of_work() -> UnitOfWork:
+    """use as "async with db.unit_of_work():" to commit every write in the block together"""
+    return UnitOfWork()
+
+
+@contextmanager
+def write_connection():
+    """yields the connection a write should use, the active unit of work's or the shared writer"""
+    unit = _unit_of_work.get()
+    if unit is None or not unit.active:
+        with get_connection_manager().writer() as db:
+            yield db
+        return
+
+    with unit.lock:
+        unit.connection.execute('SAVEPOINT unit_write')
+        try:
+            yield unit.connection
+        except BaseException:
+            unit.connection.execute('ROLLBACK TO unit_write')
+            raise
+        finally:
+            unit.connection.execute('RELEASE unit_write')
+
+
+@contextmanager
+def read_connection():
+    """yields the connection a read should use, the active unit of work's or a pooled reader"""
+    unit = _unit_of_work.get()
+    if unit is None or not unit.active:
+        with get_connection_manager().reader() as db:
+            yield db
+        return
+
+    with unit.lock:
+        yield unit.connection
+
+
+def awaitable(func, write: bool = False):
+    """builds the awaitable version of a blocking database helper
+
+    writes queue on the async write lock, inside a unit of work the first write opens its transaction
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if not write:
+            return await run_in_executor(func, *args, **kwargs)
+
+        unit = _unit_of_work.get()
+        if unit is not None and not unit.closed:
+            async with unit.writing():
+                return await run_in_executor(func, *args, **kwargs)
+
+        async with get_async_write_lock():
+            return await run_in_executor(func, *args, **kwargs)
+
+    wrapper.__name__ = wrapper.__qualname__ = f'{func.__name__}_async'
+    return wrapper
+
+
+def create_database_tables():
+    """creates the tables of a new database, or brings an existing one up to date"""
+    upgrade_database()
+
+
+def create_indexes(db, indexes: dict):
+    for name, columns in indexes.items():
+        db.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {columns}')
+
+
+def create_base_tables(db):
+    """the tables as they were at schema version 2, later changes to them are migrations of their own"""
+    cursor = db.cursor()
+
+    # create table GAME
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game(
+                            game_id INTEGER PRIMARY KEY AUTOINCREMENT
+                            ,discord_guild_id INTEGER
+                            ,discord_category_id INTEGER NOT NULL
+                            ,discord_announce_channel_id INTEGER
+                            ,discord_announce_message_id INTEGER
+                            ,game_name TEXT
+                            ,start_date DATE
+                            ,end_date DATE
+                            ,number_of_players INTEGER
+                            ,status TEXT
+                            ,phase TEXT
+                            ,game_length INTEGER
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                       )''')
+    # create table CHANNEL
+    cursor.execute('''CREATE TABLE IF NOT EXISTS channel(
+                            channel_id INTEGER PRIMARY KEY
+                            ,channel_name TEXT
+                            ,channel_order INTEGER
+                            ,channel_topic TEXT
+                            ,channel_type TEXT
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                       )''')
+    # create table CHARACTER
+    cursor.execute('''CREATE TABLE IF NOT EXISTS character(
+                            character_id INTEGER PRIMARY KEY
+                            ,character_display_name TEXT
+                            ,character_name TEXT
+                            ,weighting INTEGER
+                            ,max_duplicates INTEGER
+                            ,difficulty INTEGER
+                            ,starting_affiliation TEXT
+                            ,seen_affiliation TEXT
+                            ,char_short_description TEXT
+                            ,char_card_description TEXT
+                            ,char_full_description TEXT
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                        )''')
+    # create table EVENT
+    cursor.execute('''CREATE TABLE IF NOT EXISTS event(
+                            event_id INTEGER PRIMARY KEY
+                            ,event_name TEXT
+                            ,event_description TEXT
+                            ,character_acting_id INTEGER
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,FOREIGN KEY(character_acting_id) REFERENCES character(character_id)
+                        )''')
+    # create table ROLE
+    cursor.execute('''CREATE TABLE IF NOT EXISTS role(
+                            role_id INTEGER PRIMARY KEY
+                            ,role_name TEXT
+                            ,role_description TEXT
+                            ,default_value TEXT
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                        )''')
+    # create table SCENARIO
+    cursor.execute('''CREATE TABLE IF NOT EXISTS scenario(
+                            scenario_id INTEGER PRIMARY KEY AUTOINCREMENT
+                            ,discord_guild_id INTEGER
+                            ,game_id INTEGER
+                            ,scenario_name TEXT
+                            ,scope TEXT
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,FOREIGN KEY(game_id) REFERENCES game(game_id)
+                        )''')
+    # create table ROLE_PERMISSION
+    cursor.execute('''CREATE TABLE IF NOT EXISTS role_permission (
+                           role_permission_id INTEGER PRIMARY KEY AUTOINCREMENT
+                           ,channel_id INTEGER
+                           ,permission_name INTEGER
+                           ,permission_value INTEGER
+                           ,role_id TEXT
+                           ,game_status TEXT
+                           ,game_phase TEXT
+                           ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                           ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                           ,FOREIGN KEY(channel_id) REFERENCES channel(channel_id)
+                           ,FOREIGN KEY(role_id) REFERENCES role(role_id)
+                       )''')
+    # create table GAME_PLAYER
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game_player(
+                            game_player_id INTEGER PRIMARY KEY AUTOINCREMENT
+                            ,game_id INTEGER NOT NULL
+                            ,character_id INTEGER
+                            ,starting_character_id INTEGER
+                            ,discord_user_id INTEGER NOT NULL
+                            ,current_affiliation TEXT
+                            ,position INTEGER
+                            ,vitals BOOLEAN DEFAULT True
+                            ,rounds_survived INTEGER
+                            ,result TEXT
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,FOREIGN KEY(game_id) REFERENCES game(game_id)
+                            ,FOREIGN KEY(character_id) REFERENCES character(character_id)
+                            ,FOREIGN KEY(starting_character_id) REFERENCES character(character_id)
+                        )''')
+    # create table GAME_PLAYER_CONDITION
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game_player_condition (
+                            game_player_condition_id INTEGER PRIMARY KEY AUTOINCREMENT
+                            ,game_player_id INTEGER NOT NULL
+                            ,condition TEXT
+                            ,round_received INTEGER
+                            ,active BOOLEAN DEFAULT True
+                            ,duration INTEGER
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,FOREIGN KEY(game_player_id) REFERENCES game_player(game_player_id)
+                        )''')
+    # create table SCENARIO_CHARACTER
+    cursor.execute('''CREATE TABLE IF NOT EXISTS scenario_character (
+                           scenario_character_id INTEGER PRIMARY KEY AUTOINCREMENT
+                           ,scenario_id INTEGER NOT NULL
+                           ,character_id INTEGER NOT NULL
+                           ,requirement BOOLEAN DEFAULT True
+                           ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                           ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                           ,FOREIGN KEY(scenario_id) REFERENCES scenario(scenario_id)
+                           ,FOREIGN KEY(character_id) REFERENCES character(character_id)
+                       )''')
+    # create table GAME_EVENT
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game_event(
+                            game_event_id INTEGER PRIMARY KEY AUTOINCREMENT
+                            ,game_id INTEGER NOT NULL
+                            ,event_id INTEGER NOT NULL
+                            ,event_taken TEXT
+                            ,player_acting_id INTEGER
+                            ,player_affected_id INTEGER
+                            ,round INTEGER
+                            ,datetime DATETIME DEFAULT (datetime('now'))
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,FOREIGN KEY(game_id) REFERENCES game(game_id)
+                            ,FOREIGN KEY(event_id) REFERENCES event(event_id)
+                            ,FOREIGN KEY(player_acting_id) REFERENCES game_player(game_player_id)
+                            ,FOREIGN KEY(player_affected_id) REFERENCES game_player(game_player_id)
+                        )''')
+    # create table GAME_CHANNEL
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game_channel(
+                            game_channel_id INTEGER PRIMARY KEY AUTOINCREMENT
+                            ,game_id INTEGER NOT NULL
+                            ,channel_id INTEGER NOT NULL
+                            ,discord_channel_id INTEGER NOT NULL
+                            ,name TEXT
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,FOREIGN KEY(game_id) REFERENCES game(game_id)
+                            ,FOREIGN KEY(channel_id) REFERENCES channel(channel_id)
+                        )''')
+    # create table GAME_ROLE
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game_role(
+                            game_role_id INTEGER PRIMARY KEY AUTOINCREMENT
+                            ,game_id INTEGER NOT NULL
+                            ,role_id INTEGER NOT NULL
+                            ,discord_role_id INTEGER NOT NULL
+                            ,game_role_name TEXT
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,FOREIGN KEY(game_id) REFERENCES game(game_id)
+                            ,FOREIGN KEY(role_id) REFERENCES role(role_id)
+                        )''')
+    # create table CHARACTER_PERMISSION
+    cursor.execute('''CREATE TABLE IF NOT EXISTS character_permission(
+                            character_permission_id INTEGER PRIMARY KEY AUTOINCREMENT
+                            ,character_id INTEGER NOT NULL
+                            ,channel_id INTEGER NOT NULL
+                            ,permission_name TEXT 
+                            ,permission_value TEXT
+                            ,game_status TEXT
+                            ,game_phase TEXT
+                            ,vitals_required TEXT
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,FOREIGN KEY(character_id) REFERENCES character(character_id)
+                            ,FOREIGN KEY(channel_id) REFERENCES channel(channel_id)
+                        )''')
+    # create table GAME_VOTES
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game_vote(
+                            game_vote_id INTEGER PRIMARY KEY AUTOINCREMENT
+                            ,game_id INTEGER NOT NULL
+                            ,voter INTEGER 
+                            ,nominee INTEGER
+                            ,vote_type TEXT
+                            ,round INTEGER
+                            ,datetime DATETIME DEFAULT (datetime('now'))
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,FOREIGN KEY(game_id) REFERENCES game(game_id)
+                            ,FOREIGN KEY(voter) REFERENCES game_player(game_player_id)
+                            ,FOREIGN KEY(nominee) REFERENCES game_player(game_player_id)
+                        )''')
+
+    # secondary indexes for the lookups the bot runs on every command and reaction
+    create_indexes(db, {'game_discord_guild_id_status_idx': 'game(discord_guild_id, status)',
+                        'game_discord_category_id_idx': 'game(discord_category_id)',
+                        'game_discord_announce_message_id_idx': 'game(discord_announce_message_id)',
+                        'game_player_game_id_discord_user_id_idx': 'game_player(game_id, discord_user_id)',
+                        'game_role_game_id_idx': 'game_role(game_id)',
+                        'game_channel_game_id_idx': 'game_channel(game_id)',
+                        'scenario_discord_guild_id_idx': 'scenario(discord_guild_id)',
+                        'scenario_character_scenario_id_idx': 'scenario_character(scenario_id)',
+                        'character_permission_character_id_idx': 'character_permission(character_id)',
+                        'role_permission_role_id_idx': 'role_permission(role_id)'})
+
+
+def create_reference_load_table(db):
+    # the content hash of the snapshot each reference table was last loaded from, see loader.py
+    db.execute('''CREATE TABLE IF NOT EXISTS reference_load(
+                      table_name TEXT PRIMARY KEY
+                      ,content_hash TEXT NOT NULL
+                      ,row_count INTEGER
+                      ,source TEXT
+                      ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                      ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                  )''')
+
+
+def add_column(db, table: str, column: str, column_type: str):
+    """adds column to table unless it already has it, a table that doesn't exist yet is left to be created whole"""
+    existing = {row[1] for row in db.execute(f'PRAGMA table_info({identifier(table)})')}
+    if existing and column not in existing:
+        db.execute(f'ALTER TABLE {identifier(table)} ADD COLUMN {identifier(column)} {column_type}')
+
+
+def add_guild_columns(db):
+    add_column(db, 'game', 'discord_guild_id', 'INTEGER')
+    add_column(db, 'game', 'discord_announce_channel_id', 'INTEGER')
+    add_column(db, 'scenario', 'discord_guild_id', 'INTEGER')
+
+
+def add_event_log_columns(db):
+    add_column(db, 'game', 'round', 'INTEGER DEFAULT 0')
+    add_column(db, 'game_event', 'phase', 'TEXT')
+    add_column(db, 'game_event', 'data', 'TEXT')
+    cursor = db.cursor()
 
-    with sqlite3.connect(globals.DB_FILE_LOCATION) as db:
-        if type(data) == pd.DataFrame:
+    # create table GAME_SNAPSHOT
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game_snapshot(
+                            game_snapshot_id INTEGER PRIMARY KEY AUTOINCREMENT
+                            ,game_id INTEGER NOT NULL
+                            ,last_game_event_id INTEGER NOT NULL
+                            ,round INTEGER
+                            ,phase TEXT
+                            ,state TEXT NOT NULL
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,FOREIGN KEY(game_id) REFERENCES game(game_id)
+                            ,FOREIGN KEY(last_game_event_id) REFERENCES game_event(game_event_id)
+                        )''')
+
+    create_indexes(db, {'game_event_game_id_idx': 'game_event(game_id, game_event_id)',
+                        'game_snapshot_game_id_idx': 'game_snapshot(game_id, game_snapshot_id)'})
+
+
+def add_vote_index(db):
+    create_indexes(db, {'game_vote_game_id_round_idx': 'game_vote(game_id, round, game_vote_id)'})
+
+
+def create_timer_table(db):
+    cursor = db.cursor()
+
+    # create table GAME_TIMER, the timed actions timer.timers runs, see werewolf/timer.py
+    cursor.execute('''CREATE TABLE IF NOT EXISTS game_timer(
+                            game_timer_id INTEGER PRIMARY KEY AUTOINCREMENT
+                            ,game_id INTEGER NOT NULL
+                            ,action TEXT NOT NULL
+                            ,due_datetime DATETIME NOT NULL
+                            ,data TEXT
+                            ,fired_datetime DATETIME
+                            ,outcome TEXT
+                            ,created_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,modified_datetime DATETIME DEFAULT (datetime('now', 'localtime'))
+                            ,FOREIGN KEY(game_id) REFERENCES game(game_id)
+                        )''')
+
+    create_indexes(db, {'game_timer_fired_datetime_idx': 'game_timer(fired_datetime, due_datetime)',
+                        'game_timer_game_id_idx': 'game_timer(game_id, fired_datetime)'})
+
+
+# PRAGMA user_version holds how many of these have been applied. Each one is passed the writer
+# connection and must be safe on a database that already has its change, as databases made
+# before versioning start at 0. Every step spells out its own DDL rather than calling into the
+# current schema, add new steps to the end and never edit a released one.
+MIGRATIONS = [add_guild_columns,
+              create_base_tables,
+              create_reference_load_table,
+              add_event_log_columns,
+              add_vote_index,
+              create_timer_table]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(db) -> int:
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+
+def upgrade_database() -> int:
+    """applies the migrations the database hasn't had yet in place, returns the version it was at
+
+    an up to date database costs a single PRAGMA read, pending migrations run in one transaction
+    """
+    with get_connection_manager().reader() as db:
+        version = schema_version(db)
+    if version < SCHEMA_VERSION:
+        with get_connection_manager().writer() as db:
+            # another process sharing the database may have migrated it in the meantime
+            version = schema_version(db)
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                logging.info(f'migrating database to version {number}: {migration.__name__}')
+                migration(db)
+                db.execute(f'PRAGMA user_version = {number}')
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f'database is at schema version {version}, this code only knows up to {SCHEMA_VERSION}')
+    return version
+
+
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def identifier(name: str) -> str:
+    """validates a table or column name before it is formatted into a query"""
+    if not isinstance(name, str) or IDENTIFIER.match(name) is None:
+        raise ValueError(f'"{name}" is not a valid table or column name')
+    return name
+
+
+def sql_value(value):
+    """converts enums, numpy scalars and dates into a value sqlite3 can bind"""
+    if isinstance(value, Enum):
+        value = value.value
+    if hasattr(value, 'item'):  # numpy and pandas scalars
+        value = value.item()
+    if isinstance(value, (date, datetime)):
+        value = str(value)
+    return value
+
+
+class After:
+    """an indicator value matching the rows whose column is greater than value, e.g. {'game_event_id': After(10)}"""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+
+def predicate_shape(indicators: dict = None) -> tuple:
+    """describes the shape of a WHERE clause so the compiled query can be reused
+
+    a value of None compiles to IS NULL, a list, tuple or set to IN (...), an After to > and anything else to =
+    """
+    if not indicators:
+        return ()
+    shape = []
+    for column, value in indicators.items():
+        if value is None:
+            shape.append((column, 'null', 0))
+        elif isinstance(value, After):
+            shape.append((column, 'gt', 1))
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            shape.append((column, 'in', len(value)))
+        else:
+            shape.append((column, 'eq', 1))
+    return tuple(shape)
+
+
+def predicate_params(indicators: dict = None) -> tuple:
+    if not indicators:
+        return ()
+    params = []
+    for value in indicators.values():
+        if value is None:
+            continue
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            params.extend(sql_value(item) for item in value)
+        elif isinstance(value, After):
+            params.append(sql_value(value.value))
+        else:
+            params.append(sql_value(value))
+    return tuple(params)
+
+
+@functools.lru_cache(maxsize=512)
+def compile_where(shape: tuple) -> str:
+    clauses = []
+    for column, kind, size in shape:
+        column = identifier(column)
+        if kind == 'null':
+            clauses.append(f'{column} IS NULL')
+        elif kind == 'in':
+            # an empty IN () is valid sqlite and matches nothing
+            clauses.append(f"{column} IN ({','.join('?' * size)})")
+        elif kind == 'gt':
+            clauses.append(f'{column} > ?')
+        else:
+            clauses.append(f'{column} = ?')
+    return '\nWHERE ' + '\nAND '.join(clauses) if clauses else ''
+
+
+@functools.lru_cache(maxsize=256)
+def compile_select(table: str, joins: tuple, shape: tuple, limit: int = None, order_by: str = None,
+                   descending: bool = False) -> str:
+    query = f'SELECT * FROM {identifier(table)}'
+    for join_table, column in joins:
+        query += f'\nLEFT OUTER JOIN {identifier(join_table)} USING ({identifier(column)})'
+    query += compile_where(shape)
+    if order_by is not None:
+        query += f"\nORDER BY {identifier(order_by)}{' DESC' if descending else ''}"
+    if limit is not None:
+        query += f'\nLIMIT {int(limit)}'
+    return query + ';'
+
+
+@functools.lru_cache(maxsize=256)
+def compile_count(table: str, shape: tuple) -> str:
+    return f'SELECT count(*) FROM {identifier(table)}' + compile_where(shape) + ';'
+
+
+@functools.lru_cache(maxsize=256)
+def compile_insert(table: str, columns: tuple) -> str:
+    qmarks = ','.join('?' * len(columns))
+    return f"INSERT INTO {identifier(table)} ({', '.join(identifier(column) for column in columns)}) VALUES ({qmarks});"
+
+
+@functools.lru_cache(maxsize=256)
+def compile_insert_missing(table: str, columns: tuple, key_columns: tuple) -> str:
+    qmarks = ','.join('?' * len(columns))
+    matches = ' AND '.join(f'{identifier(column)} = ?' for column in key_columns)
+    return f"INSERT INTO {identifier(table)} ({', '.join(identifier(column) for column in columns)})\n" \
+           f"SELECT {qmarks}\nWHERE NOT EXISTS (SELECT 1 FROM {identifier(table)} WHERE {matches});"
+
+
+@functools.lru_cache(maxsize=256)
+def compile_upsert(table: str, columns: tuple, key_columns: tuple) -> str:
+    """inserts a row or updates the one matching key_columns, a row whose values haven't changed isn't written"""
+    qmarks = ','.join('?' * len(columns))
+    updated = tuple(column for column in columns if column not in key_columns)
+    assignments = ', '.join(f'{identifier(column)} = excluded.{identifier(column)}' for column in updated)
+    current = ', '.join(identifier(column) for column in updated)
+    excluded = ', '.join(f'excluded.{identifier(column)}' for column in updated)
+    upsert = f"INSERT INTO {identifier(table)} ({', '.join(identifier(column) for column in columns)}) " \
+             f"VALUES ({qmarks})\nON CONFLICT({', '.join(identifier(column) for column in key_columns)}) "
+    if not updated:
+        return upsert + 'DO NOTHING;'
+    return upsert + f"DO UPDATE SET {assignments}, modified_datetime = datetime('now', 'localtime')\n" \
+                    f"WHERE ({current}) IS NOT ({excluded});"
+
+
+@functools.lru_cache(maxsize=256)
+def compile_update(table: str, columns: tuple, shape: tuple) -> str:
+    assignments = ', '.join(f'{identifier(column)} = ?' for column in columns)
+    return f'UPDATE {identifier(table)}\nSET {assignments}' + compile_where(shape) + ';'
+
+
+@functools.lru_cache(maxsize=256)
+def compile_delete(table: str, shape: tuple) -> str:
+    return f'DELETE FROM {identifier(table)}' + compile_where(shape) + ';'
+
+
+def build_select(table: str, indicators: dict = None, joins: dict = None, limit: int = None, order_by: str = None,
+                 descending: bool = False):
+    """returns the compiled query and its parameters for a select_rows or select_one call"""
+    joins = tuple(joins.items()) if joins else ()
+    return compile_select(table, joins, predicate_shape(indicators), limit, order_by, descending), \
+        predicate_params(indicators)
+
+
+class Row:
+    """a compact read only row returned by select_rows and select_one
+
+    columns are read by name like a pandas Series (row['game_id']) or by position,
+    the column to position map is shared between every row of the same query shape
+    """
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index: dict, values: tuple):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._values[key]
+        return self._values[self._index[key]]
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        return isinstance(other, Row) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return f'Row({self.as_dict()!r})'
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        return default if index is None else self._values[index]
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self) -> tuple:
+        return self._values
+
+    def as_dict(self) -> dict:
+        return {key: self._values[index] for key, index in self._index.items()}
+
+
+@functools.lru_cache(maxsize=256)
+def row_index(columns: tuple) -> dict:
+    # joined tables repeat columns such as created_datetime, the first table's value wins
+    index = {}
+    for position, column in enumerate(columns):
+        index.setdefault(column, position)
+    return index
+
+
+def fetch_rows(db, query: str, params: tuple = ()) -> list:
+    cursor = db.execute(query, params)
+    index = row_index(tuple(description[0] for description in cursor.description))
+    return [Row(index, values) for values in cursor.fetchall()]
+
+
+@metrics.timed_database
+def insert_into_table(table:str, data):
+    """inserts a dict as a single row and returns its rowid, a DataFrame is appended whole"""
+    notify_change(table, [data])
+    with write_connection() as db:
+        if not isinstance(data, dict):
             data.to_sql(table, db, if_exists='append', index=False)
             return None
-        elif type(data) == dict:
-            for key, value in data.items():
-                if value is None:
-                    continue
-                columns += f'{key}, '
-                values.append(str(value)) # todo sort out how this works with boolean values
-            values = tuple(values)
-            num_values = len(values)
 
-        try:
-            cursor = db.cursor()
-            qmarks = '?,' * num_values
-            query = f"INSERT INTO {table} ({columns[:-2]}) VALUES ({qmarks[:-1]});"
+        data = {key: value for key, value in data.items() if value is not None}
+        query = compile_insert(table, tuple(data.keys()))
+
+        cursor = db.cursor()
+        cursor.execute(query, tuple(sql_value(value) for value in data.values()))
+        return cursor.lastrowid
+
+
+@metrics.timed_database
+def insert_many(table: str, rows: list):
+    """inserts a list of dicts using executemany inside a single transaction
 
-            cursor.execute(query, values)
-        except Exception as e:
-            db.rollback()
-            raise e
+    rows are grouped by the columns they set so each distinct shape is one executemany
+    """
+    groups = defaultdict(list)
+    for row in rows:
+        row = {key: value for key, value in row.items() if value is not None}
+        groups[tuple(row.keys())].append(tuple(sql_value(value) for value in row.values()))
 
+    notify_change(table, rows)
+    with write_connection() as db:
+        for columns, values in groups.items():
+            db.executemany(compile_insert(table, columns), values)
 
-def game_insert(discord_category_id, game_name, start_date=None, end_date=None, number_of_players=None, status=None, game_length=None):
-    insert_into_table('game', locals())
 
+@metrics.timed_database
+def insert_missing(table: str, rows: list, key_columns: tuple) -> int:
+    """inserts the rows that no existing row matches on key_columns, returns how many were inserted
 
-def select_table(table: str, indicators: dict = None, joins: dict = None):
-    query = f'SELECT * from {table}'
-    if joins is not None:
-        for key, value in joins.items():
-            query += f'\nLEFT OUTER JOIN {key} USING ({value})'
-    if indicators is not None:
-        query += "\nWHERE "
-        cnt = 0
-        for key, value in indicators.items():
-            if cnt > 0:
-                query += '\nAND '
-            query += f"cast({key} as text)='{value}'"
-            cnt += 1
-    query += ';'
-    with sqlite3.connect(globals.DB_FILE_LOCATION) as db:
-        return pd.read_sql_query(query, db)
+    safe to repeat, a row that is already there is left alone
+    """
+    groups = defaultdict(list)
+    for row in rows:
+        row = {key: value for key, value in row.items() if value is not None}
+        groups[tuple(row.keys())].append(tuple(sql_value(value) for value in row.values()) +
+                                         tuple(sql_value(row[column]) for column in key_columns))
 
+    inserted = 0
+    notify_change(table, rows)
+    with write_connection() as db:
+        for columns, values in groups.items():
+            inserted += db.executemany(compile_insert_missing(table, columns, key_columns), values).rowcount
+    return inserted
 
-def get_table_schema(table: str):
-    with sqlite3.connect(globals.DB_FILE_LOCATION) as db:
-        return pd.read_sql_query(f"pragma table_info('{table}')", db)
 
+@metrics.timed_database
+def upsert_many(table: str, rows: list, key_columns: tuple) -> int:
+    """inserts rows or updates the existing row with the same key_columns, returns how many rows changed
 
+    key_columns must be the table's primary key or have a unique index
+    """
+    groups = defaultdict(list)
+    for row in rows:
+        groups[tuple(row.keys())].append(tuple(sql_value(value) for value in row.values()))
+
+    changed = 0
+    notify_change(table, rows)
+    with write_connection() as db:
+        for columns, values in groups.items():
+            changed += db.executemany(compile_upsert(table, columns, key_columns), values).rowcount
+    return changed
+
+
+@metrics.timed_database
+def select_rows(table: str, indicators: dict = None, joins: dict = None, order_by: str = None,
+                descending: bool = False) -> list:
+    """returns the matching rows as a list of Row, in order_by order when it is given"""
+    query, params = build_select(table, indicators, joins, order_by=order_by, descending=descending)
+    with read_connection() as db:
+        return fetch_rows(db, query, params)
+
+
+@metrics.timed_database
+def select_one(table: str, indicators: dict = None, joins: dict = None, order_by: str = None,
+               descending: bool = False):
+    """returns the first matching Row, in order_by order when it is given, or None"""
+    query, params = build_select(table, indicators, joins, limit=1, order_by=order_by, descending=descending)
+    with read_connection() as db:
+        rows = fetch_rows(db, query, params)
+    return rows[0] if rows else None
+
+
+@metrics.timed_database
+def count_rows(table: str, indicators: dict = None) -> int:
+    query = compile_count(table, predicate_shape(indicators))
+    with read_connection() as db:
+        return db.execute(query, predicate_params(indicators)).fetchone()[0]
+
+
+def explain_query_plan(table: str, indicators: dict = None, joins: dict = None) -> list:
+    """returns the detail lines of EXPLAIN QUERY PLAN for the query select_rows would run"""
+    query, params = build_select(table, indicators, joins)
+    with read_connection() as db:
+        return [row[-1] for row in db.execute(f'EXPLAIN QUERY PLAN {query}', params)]
+
+
+@metrics.timed_database
 def delete_from_table(table: str, indicators=None):
-    query = f"DELETE FROM {table} "
-    if indicators is not None:
-        query += "WHERE "
-        cnt = 0
-        for key, value in indicators.items():
-            if cnt > 0:
-                query += ' AND '
-            query += f"{key}='{value}'"
-            cnt += 1
-    query += ';'
-
-    with sqlite3.connect(globals.DB_FILE_LOCATION) as db:
-        try:
-            cursor = db.cursor()
+    query = compile_delete(table, predicate_shape(indicators))
+
+    notify_change(table, [indicators])
+    with write_connection() as db:
+        cursor = db.cursor()
 
-            cursor.execute(query)
-        except Exception as e:
-            db.rollback()
-            raise e
+        cursor.execute(query, predicate_params(indicators))
 
+@metrics.timed_database
 def update_table(table: str, data_to_update: dict, update_conditions: dict):
-    values = []
-    num = 0
-    with sqlite3.connect(globals.DB_FILE_LOCATION) as db:
+    data_to_update['modified_datetime'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        try:
-            cursor = db.cursor()
+    query = compile_update(table, tuple(data_to_update.keys()), predicate_shape(update_conditions))
+    values = tuple(sql_value(value) for value in data_to_update.values()) + predicate_params(update_conditions)
 
-            data_to_update['modified_datetime'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    notify_change(table, [update_conditions])
+    with write_connection() as db:
+        cursor = db.cursor()
 
-            query = f"UPDATE {table}"
-            for key, value in data_to_update.items():
-                query += ", " if num else '\nSET '
-                query += f"{key} = ?"
-                values.append(str(value))
-                num += 1
-            num = 0
-            for key, value in update_conditions.items():
-                query += " AND " if num else '\nWHERE '
-                query += f"{key} = ?"
-                values.append(str(value))
-                num += 1
+        cursor.execute(query, values)
 
-            query += f";"
-            values = tuple(values)
 
-            cursor.execute(query, values)
-        except Exception as e:
-            db.rollback()
-            raise e
+@metrics.timed_database
+def update_many(table: str, rows: list, key_columns: tuple):
+    """updates many rows using executemany inside a single transaction
 
+    each dict in rows holds the key_columns that select the row to update alongside the new values
+    """
+    modified_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    groups = defaultdict(list)
+    for row in rows:
+        data_to_update = {key: value for key, value in row.items() if key not in key_columns}
+        data_to_update['modified_datetime'] = modified_datetime
+        update_conditions = {key: row[key] for key in key_columns}
+
+        query = compile_update(table, tuple(data_to_update.keys()), predicate_shape(update_conditions))
+        groups[query].append(tuple(sql_value(value) for value in data_to_update.values())
+                             + predicate_params(update_conditions))
+
+    notify_change(table, rows)
+    with write_connection() as db:
+        for query, values in groups.items():
+            db.executemany(query, values)
+
+
+# awaitable versions of the helpers above, these are what the cogs and werewolf modules should use
+select_rows_async = awaitable(select_rows)
+select_one_async = awaitable(select_one)
+count_rows_async = awaitable(count_rows)
+insert_into_table_async = awaitable(insert_into_table, write=True)
+insert_many_async = awaitable(insert_many, write=True)
+insert_missing_async = awaitable(insert_missing, write=True)
+upsert_many_async = awaitable(upsert_many, write=True)
+update_table_async = awaitable(update_table, write=True)
+update_many_async = awaitable(update_many, write=True)
+delete_from_table_async = awaitable(delete_from_table, write=True)
+
+
+# tables that only change when insert_default_data runs
+REFERENCE_TABLES = ['character', 'event', 'channel', 'character_permission', 'role_permission', 'role']
+
+
+class ReferenceCache:
+    """in process read through cache of the static reference tables
+
+    Each table is read from disk once and served from memory until invalidate is called,
+    which insert_default_data does whenever reference data is reloaded.
+    """
+
+    def __init__(self, tables=REFERENCE_TABLES):
+        self.tables = tables
+        self.hits = 0
+        self.misses = 0
+        self._rows = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def _load(self, table: str) -> list:
+        if table not in self.tables:
+            raise ValueError(f'{table} is not a reference table')
+        query, params = build_select(table)
+        with read_connection() as db:
+            cursor = db.execute(query, params)
+            columns = tuple(description[0] for description in cursor.description)
+            index = row_index(columns)
+            rows = [Row(index, values) for values in cursor.fetchall()]
+        self._rows[table] = rows
+        return rows
+
+    def rows(self, table: str) -> list:
+        rows = self._rows.get(table)
+        if rows is not None:
+            self.hits += 1
+            return rows
+
+        with self._lock:
+            rows = self._rows.get(table)
+            if rows is None:
+                self.misses += 1
+                return self._load(table)
+        self.hits += 1
+        return rows
+
+    def group(self, table: str, column: str) -> dict:
+        """returns the table's rows grouped into lists by the value of column"""
+        rows = self.rows(table)
+        index = self._indexes.get((table, column))
+        if index is None:
+            index = defaultdict(list)
+            for row in rows:
+                index[row[column]].append(row)
+            index = self._indexes[(table, column)] = dict(index)
+        return index
+
+    def by(self, table: str, column: str) -> dict:
+        """returns the first row for each value of column, for lookups on a unique column"""
+        return {value: rows[0] for value, rows in self.group(table, column).items()}
+
+    async def _call_async(self, cached: dict, func, table: str, *args):
+        # hits are answered on the event loop, only a load from disk goes to the executor
+        if table in cached:
+            return func(table, *args)
+        return await run_in_executor(func, table, *args)
+
+    async def rows_async(self, table: str) -> list:
+        return await self._call_async(self._rows, self.rows, table)
+
+    async def group_async(self, table: str, column: str) -> dict:
+        return await self._call_async(self._rows, self.group, table, column)
+
+    async def by_async(self, table: str, column: str) -> dict:
+        return await self._call_async(self._rows, self.by, table, column)
+
+    def warm(self):
+        for table in self.tables:
+            self.rows(table)
+
+    async def warm_async(self):
+        await run_in_executor(self.warm)
+
+    def invalidate(self, table: str = None):
+        with self._lock:
+            if table is None:
+                self._rows.clear()
+            else:
+                self._rows.pop(table, None)
+            self._indexes = {key: index for key, index in self._indexes.items()
+                             if table is not None and key[0] != table}
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'tables_loaded': sorted(self._rows)}
+
+
+reference_data = ReferenceCache()
 
 
 def insert_default_data():
+    from gsheets import Sheets
+    import loader
+
     sheets = Sheets.from_files(globals.BASE_DIR / 'credentials.json', globals.BASE_DIR / 'storage.json')
     workbook = sheets[os.getenv('GOOGLE_SHEET_DEFAULT_DATA_FILE_ID')]
-    tables = ['character', 'event', 'channel', 'character_permission', 'role_permission', 'role']
-    for table in tables:
-        insert_into_table(table, workbook.find(table).to_frame())
+    loader.load_tables({table: ('google sheets', workbook.find(table).to_frame().to_dict('records'))
+                        for table in REFERENCE_TABLES})
 
 
 if __name__ == '__main__':
+    # usage: python database.py [--reset]
+    # migrates the database in place and loads the reference data snapshot in data/reference,
+    # or the Google Sheet into a new database when there is no snapshot.
+    # --reset deletes the database first and starts again from empty
+    from dotenv import load_dotenv
+
     globals.setup_logging(globals.BASE_DIR / 'logging_config.yaml', logging.DEBUG)
     load_dotenv()
-    try:
-        os.remove(globals.DB_FILE_LOCATION)
-    except FileNotFoundError:
-        pass
-    create_database_tables()
+    reset = '--reset' in sys.argv[1:]
+    if reset:
+        try:
+            os.remove(globals.DB_FILE_LOCATION)
+        except FileNotFoundError:
+            pass
+    upgrade_database()
 
-    insert_default_data()
+    import loader
+    if loader.read_snapshot(globals.REFERENCE_DATA_DIR):
+        # unchanged tables are skipped so this is cheap to repeat
+        loader.load_snapshot()
+    elif not count_rows('character'):
+        insert_default_data()
 
 
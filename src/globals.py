@@ -3,16 +3,17 @@ from enum import Enum
 import logging.config
 from pathlib import Path
 
-import yaml
-
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 DB_FILE_LOCATION = BASE_DIR / 'data' / 'uw.db'
+METRICS_FILE_LOCATION = BASE_DIR / 'data' / 'metrics.prom'
+REFERENCE_DATA_DIR = BASE_DIR / 'data' / 'reference'
 
 GAME_REACTION_EMOJI  = '🐺'
 
 moderator_channel_name = 'moderator'
+player_channel_name = 'player'
 
 class GameStatus(Enum):
     CREATING = 'creating'
@@ -30,6 +31,8 @@ def setup_logging(default_path, default_level=logging.WARNING):
     """
     path = default_path
     if path.exists():
+        # only needed here, so importing globals from tools and benchmarks stays cheap
+        import yaml
         with open(path, 'rt') as f:
             config = yaml.safe_load(f.read())
         logging.config.dictConfig(config)
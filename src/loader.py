@@ -0,0 +1,214 @@
+"""loader.py loads the reference tables from a local snapshot rather than from Google Sheets
+
+A snapshot is a directory holding a <table>.csv, <table>.json or <table>.parquet file for any
+of database.REFERENCE_TABLES, or a single .json file mapping table names to lists of rows.
+Each table's rows are normalised and hashed, a table whose hash matches the one reference_load
+recorded at its last load is skipped. The rest are upserted on their id in one transaction so
+the games in progress keep pointing at the same characters, channels and roles, and the rows
+whose ids the snapshot no longer has are deleted. A row that is removed while a game or another
+reference table still refers to it fails the whole load. A permission table whose snapshot has
+no ids is replaced whole instead, nothing refers to its rows.
+
+usage: python loader.py [snapshot]            loads a snapshot, data/reference by default
+       python loader.py --export [snapshot]   writes the database's reference tables out as json
+"""
+
+import csv
+import hashlib
+import json
+import logging
+import math
+from pathlib import Path
+import sys
+
+import database as db
+import globals
+
+# the id each reference table is upserted on
+KEY_COLUMNS = {'character': 'character_id', 'event': 'event_id', 'channel': 'channel_id', 'role': 'role_id',
+               'character_permission': 'character_permission_id', 'role_permission': 'role_permission_id'}
+# no other table has a foreign key to these, so they can be replaced when the snapshot has no ids
+REPLACEABLE_TABLES = {'character_permission', 'role_permission'}
+# columns the database fills in itself
+MAINTAINED_COLUMNS = {'created_datetime', 'modified_datetime'}
+# the (table, column) pairs that refer to each reference table's id, its rows can't be removed while they do
+REFERENCES = {'character': [('game_player', 'character_id'), ('game_player', 'starting_character_id'),
+                            ('scenario_character', 'character_id'), ('character_permission', 'character_id'),
+                            ('event', 'character_acting_id')],
+              'channel': [('game_channel', 'channel_id'), ('character_permission', 'channel_id'),
+                          ('role_permission', 'channel_id')],
+              'role': [('game_role', 'role_id'), ('role_permission', 'role_id')],
+              'event': [('game_event', 'event_id')]}
+
+
+class LoadResult:
+    __slots__ = ('table', 'rows', 'changed', 'removed', 'skipped')
+
+    def __init__(self, table: str, rows: int, changed: int = 0, removed: int = 0, skipped: bool = False):
+        self.table = table
+        self.rows = rows
+        self.changed = changed
+        self.removed = removed
+        self.skipped = skipped
+
+    def __str__(self):
+        if self.skipped:
+            return f'{self.table}: unchanged'
+        return f'{self.table}: {self.changed} of {self.rows} rows changed, {self.removed} removed'
+
+
+def normalise(value):
+    """blank cells ('' from CSV, NaN from Parquet) become None and whole floats become ints"""
+    if hasattr(value, 'item'):
+        # numpy scalars from Parquet
+        value = value.item()
+    if isinstance(value, float):
+        if math.isnan(value):
+            return None
+        if value.is_integer():
+            return int(value)
+    if isinstance(value, str) and not value.strip():
+        return None
+    return value
+
+
+def read_csv(path: Path) -> list:
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        return [dict(row) for row in csv.DictReader(file)]
+
+
+def read_json(path: Path) -> list:
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def read_parquet(path: Path) -> list:
+    # needs pyarrow or fastparquet alongside pandas
+    return db.pandas().read_parquet(path).to_dict('records')
+
+
+READERS = {'.csv': read_csv, '.json': read_json, '.parquet': read_parquet}
+
+
+def read_snapshot(path: Path) -> dict:
+    """returns {table: (file name, rows)} for each reference table the snapshot has"""
+    path = Path(path)
+    if path.is_file():
+        tables = read_json(path)
+        unknown = set(tables) - set(db.REFERENCE_TABLES)
+        if unknown:
+            raise ValueError(f'{path} has tables that are not reference tables: {", ".join(sorted(unknown))}')
+        return {table: (path.name, rows) for table, rows in tables.items()}
+
+    snapshot = {}
+    for table in db.REFERENCE_TABLES:
+        files = [path / f'{table}{suffix}' for suffix in READERS if (path / f'{table}{suffix}').exists()]
+        if len(files) > 1:
+            raise ValueError(f'{table} has more than one file in {path}: {", ".join(file.name for file in files)}')
+        if files:
+            snapshot[table] = (files[0].name, READERS[files[0].suffix](files[0]))
+    return snapshot
+
+
+def prepare(table: str, rows: list, columns: set) -> list:
+    """normalises the values of rows and checks every column they set exists in table"""
+    prepared = []
+    for row in rows:
+        row = {column: normalise(value) for column, value in row.items() if column not in MAINTAINED_COLUMNS}
+        unknown = set(row) - columns
+        if unknown:
+            raise ValueError(f'{table} has no column {", ".join(sorted(unknown))}')
+        prepared.append(row)
+    return prepared
+
+
+def content_hash(rows: list) -> str:
+    """a hash of the rows that doesn't depend on column order or whether a number was read as text"""
+    canonical = [sorted((column, None if value is None else str(value)) for column, value in row.items())
+                 for row in rows]
+    return hashlib.sha256(json.dumps(canonical, separators=(',', ':')).encode()).hexdigest()
+
+
+def load_tables(snapshot: dict) -> list:
+    """writes each table in {table: (source, rows)} whose content changed, all in one transaction
+
+    must not be called inside a unit of work, it takes the shared writer for itself
+    """
+    results = []
+    removed_ids = {}
+    with db.get_connection_manager().writer() as connection:
+        loaded = {row['table_name']: row['content_hash'] for row in db.select_rows('reference_load')}
+        for table, (source, rows) in snapshot.items():
+            columns = {row[1] for row in connection.execute(f'PRAGMA table_info({db.identifier(table)})')}
+            rows = prepare(table, rows, columns)
+            digest = content_hash(rows)
+            if loaded.get(table) == digest:
+                results.append(LoadResult(table, len(rows), skipped=True))
+                continue
+
+            key = KEY_COLUMNS[table]
+            removed = 0
+            if all(row.get(key) is not None for row in rows):
+                changed = db.upsert_many(table, rows, (key,))
+                ids = {row[key] for row in rows}
+                removed_ids[table] = sorted(row[key] for row in db.select_rows(table) if row[key] not in ids)
+                removed = len(removed_ids[table])
+                if removed:
+                    db.delete_from_table(table, {key: removed_ids[table]})
+            elif table in REPLACEABLE_TABLES:
+                db.delete_from_table(table)
+                db.insert_many(table, rows)
+                changed = len(rows)
+            else:
+                raise ValueError(f'every {table} row needs a {key}, games in progress refer to them by it')
+
+            db.upsert_many('reference_load', [{'table_name': table, 'content_hash': digest, 'row_count': len(rows),
+                                               'source': source}], ('table_name',))
+            results.append(LoadResult(table, len(rows), changed, removed))
+
+        # checked once every table is written, a snapshot may remove a row and what refers to it together
+        for table, ids in removed_ids.items():
+            for referring, column in REFERENCES.get(table, []):
+                if ids and db.count_rows(referring, {column: ids}):
+                    raise ValueError(f'{table} {", ".join(map(str, ids))} can not be removed, {referring} '
+                                     f'still refers to some of them by {column}')
+
+    for result in results:
+        if not result.skipped:
+            db.reference_data.invalidate(result.table)
+    logging.info(f'loaded reference data: {", ".join(str(result) for result in results)}')
+    return results
+
+
+def load_snapshot(path: Path = None) -> list:
+    """loads the snapshot at path, globals.REFERENCE_DATA_DIR by default, returns a LoadResult per table"""
+    path = Path(path or globals.REFERENCE_DATA_DIR)
+    snapshot = read_snapshot(path)
+    if not snapshot:
+        raise FileNotFoundError(f'no reference data snapshot found at {path}')
+    return load_tables(snapshot)
+
+
+def export_snapshot(path: Path = None):
+    """writes every reference table to a <table>.json file in path, the starting point for a snapshot"""
+    path = Path(path or globals.REFERENCE_DATA_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    for table in db.REFERENCE_TABLES:
+        rows = [{column: value for column, value in row.as_dict().items() if column not in MAINTAINED_COLUMNS}
+                for row in db.select_rows(table)]
+        with open(path / f'{table}.json', 'w', encoding='utf-8') as file:
+            json.dump(rows, file, indent=1)
+
+
+load_snapshot_async = db.awaitable(load_snapshot, write=True)
+
+
+if __name__ == '__main__':
+    globals.setup_logging(globals.BASE_DIR / 'logging_config.yaml', logging.INFO)
+    arguments = [argument for argument in sys.argv[1:] if argument != '--export']
+    db.upgrade_database()
+    if '--export' in sys.argv[1:]:
+        export_snapshot(*arguments)
+    else:
+        for result in load_snapshot(*arguments):
+            print(result)
@@ -1,21 +1,24 @@
+import metrics  # first, so startup is timed from process start
+
 import logging
 import os
 
 from dotenv import load_dotenv
-import pandas as pd
 
+import database as db
 import globals
-import bot
 
 if __name__ == '__main__':
     globals.setup_logging(globals.BASE_DIR / 'logging_config.yaml', logging.DEBUG)
 
-    pd.set_option('display.max_rows', 500)
-    pd.set_option('display.max_columns', 500)
-    pd.set_option('display.width', 1000)
-
     load_dotenv()
+    # migrates the existing database in place, it is never recreated on start up
+    db.upgrade_database()
+    metrics.startup_stage('schema')
     TOKEN = os.getenv('DISCORD_TOKEN')
 
+    # bot reads its shard settings from the environment as it is imported
+    import bot
+    metrics.startup_stage('imports')
     bot.setup(bot.bot)
     bot.bot.run(TOKEN)
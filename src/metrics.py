@@ -0,0 +1,184 @@
+"""metrics.py records how long commands, database calls and discord API calls take
+
+Durations are kept as histograms per metric and label set in process. They are written
+out as a Prometheus text file that node_exporter's textfile collector can pick up, and
+summarised for the !bot-stats command.
+"""
+
+import asyncio
+from contextlib import contextmanager
+import functools
+import logging
+import os
+from pathlib import Path
+import threading
+import time
+
+# upper bounds in seconds, the last bucket (+Inf) catches everything slower
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COMMAND = 'werewolf_command_duration_seconds'
+DATABASE = 'werewolf_database_duration_seconds'
+DISCORD_API = 'werewolf_discord_api_duration_seconds'
+STARTUP = 'werewolf_startup_seconds'
+
+DESCRIPTIONS = {COMMAND: 'Time taken to run a bot command',
+                DATABASE: 'Time taken by a database.py entry point',
+                DISCORD_API: 'Time taken by a discord API request',
+                STARTUP: 'Time from process start until each startup stage finished'}
+
+EXPORT_INTERVAL = 60
+
+# main.py imports this module before anything else so startup stages are timed from here
+process_started = time.perf_counter()
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'total')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                break
+        else:
+            index = len(BUCKETS)
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        """estimates the q quantile as the upper bound of the bucket it falls in"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return BUCKETS[index] if index < len(BUCKETS) else float('inf')
+        return float('inf')
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class Registry:
+    """histograms keyed by metric name and a tuple of (label, value) pairs"""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, metric: str, seconds: float, **labels):
+        key = (metric, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def histograms(self, metric: str = None) -> dict:
+        with self._lock:
+            return {key: histogram for key, histogram in self._histograms.items()
+                    if metric is None or key[0] == metric}
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self) -> str:
+        """the histograms in the Prometheus text exposition format"""
+        lines = []
+        histograms = self.histograms()
+        for metric in sorted({key[0] for key in histograms}):
+            lines.append(f'# HELP {metric} {DESCRIPTIONS.get(metric, metric)}')
+            lines.append(f'# TYPE {metric} histogram')
+            for (name, labels), histogram in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                label_text = ','.join(f'{label}="{escape(value)}"' for label, value in labels)
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    bucket_labels = ','.join(filter(None, [label_text, f'le="{bound}"']))
+                    lines.append(f'{metric}_bucket{{{bucket_labels}}} {cumulative}')
+                lines.append(f'{metric}_sum{{{label_text}}} {histogram.total}')
+                lines.append(f'{metric}_count{{{label_text}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path: Path):
+        """writes the histograms to path, through a temporary file so readers never see half of it"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_suffix(path.suffix + '.tmp')
+        temporary.write_text(self.render())
+        os.replace(temporary, path)
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+@contextmanager
+def timer(metric: str, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(metric, time.perf_counter() - start, **labels)
+
+
+def timed_database(func):
+    """times a database.py entry point, labelled with its name and the table it works on"""
+    @functools.wraps(func)
+    def wrapper(table=None, *args, **kwargs):
+        with timer(DATABASE, operation=func.__name__, table=table):
+            return func(table, *args, **kwargs)
+    return wrapper
+
+
+def timed_discord_request(request):
+    """wraps discord.py's HTTPClient.request to time every API call by method and route template"""
+    @functools.wraps(request)
+    async def wrapper(route, *args, **kwargs):
+        with timer(DISCORD_API, route=f'{route.method} {route.path}'):
+            return await request(route, *args, **kwargs)
+    return wrapper
+
+
+def startup_stage(stage: str) -> float:
+    """records how long after process start stage finished, returns the seconds"""
+    seconds = time.perf_counter() - process_started
+    registry.observe(STARTUP, seconds, stage=stage)
+    logging.info(f'startup stage {stage} finished after {seconds * 1000:.0f} ms')
+    return seconds
+
+
+def summary(metric: str, labels: tuple, limit: int = 10) -> list:
+    """rows of [label values, count, mean ms, p95 ms, total ms] for metric, most total time first"""
+    rows = []
+    for (name, label_values), histogram in registry.histograms(metric).items():
+        value = ' '.join(str(value) for label, value in label_values if label in labels)
+        rows.append([value, histogram.count, round(histogram.mean * 1000, 1),
+                     round(histogram.quantile(0.95) * 1000, 1), round(histogram.total * 1000, 1)])
+    rows.sort(key=lambda row: row[4], reverse=True)
+    return rows[:limit]
+
+
+async def export_periodically(path: Path, interval: float = EXPORT_INTERVAL):
+    """rewrites the Prometheus text file every interval seconds until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            registry.write_textfile(path)
+        except OSError:
+            logging.exception(f'failed to write metrics to {path}')
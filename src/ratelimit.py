@@ -0,0 +1,135 @@
+"""ratelimit.py fans discord API calls out concurrently without tripping the rate limits
+
+Calls are grouped into routes the same way discord buckets them (the endpoint plus
+its major parameter, e.g. creating roles in one guild). Each route allows a few calls
+in flight, the scheduler as a whole allows a few more, and a 429 response pauses
+the route (or every route, for the global limit) for the retry after discord asked
+for before the call is tried again.
+
+A call queues on its route first and only takes one of the scheduler's slots for the
+request itself, so calls queued behind a busy or rate limited route never keep the
+other routes waiting. discord.py already waits out the 429s it sees and retries, a
+429 that reaches the scheduler is one it gave up on.
+"""
+
+import asyncio
+import logging
+import time
+
+import discord
+
+MAX_CONCURRENCY = 10
+MAX_PER_ROUTE = 5
+MAX_RETRIES = 3
+DEFAULT_RETRY_AFTER = 1.0
+
+
+def retry_after(error: discord.HTTPException) -> float:
+    """seconds discord asked us to wait in a 429 response"""
+    headers = getattr(error.response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After', DEFAULT_RETRY_AFTER))
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+def is_global(error: discord.HTTPException) -> bool:
+    headers = getattr(error.response, 'headers', None) or {}
+    return str(headers.get('X-RateLimit-Global', '')).lower() == 'true'
+
+
+class RouteBucket:
+    __slots__ = ('semaphore', 'blocked_until')
+
+    def __init__(self, limit):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.blocked_until = 0.0
+
+
+class ApiScheduler:
+    """runs discord API calls with bounded concurrency and per route rate limit buckets"""
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, max_per_route=MAX_PER_ROUTE, max_retries=MAX_RETRIES):
+        self.max_concurrency = max_concurrency
+        self.max_per_route = max_per_route
+        self.max_retries = max_retries
+        self._loop = None
+        self._semaphore = None
+        self._buckets = {}
+        self._blocked_until = 0.0
+        self.rate_limited = 0
+
+    def bucket(self, route) -> RouteBucket:
+        if route not in self._buckets:
+            self._buckets[route] = RouteBucket(self.max_per_route)
+        return self._buckets[route]
+
+    def _delay(self, bucket: RouteBucket) -> float:
+        return max(self._blocked_until, bucket.blocked_until) - time.monotonic()
+
+    async def _wait_until_free(self, bucket: RouteBucket):
+        while True:
+            delay = self._delay(bucket)
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def run(self, route, call, *args, **kwargs):
+        """awaits call(*args, **kwargs) within the limits of route, retrying it after a 429"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # semaphores belong to the loop they are first used on
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._buckets = {}
+        bucket = self.bucket(route)
+        attempt = 0
+        while True:
+            # a rate limited route is waited out without holding any slot
+            await self._wait_until_free(bucket)
+            async with bucket.semaphore:
+                if self._delay(bucket) > 0:
+                    # rate limited again while this call queued for the route
+                    continue
+                try:
+                    async with self._semaphore:
+                        return await call(*args, **kwargs)
+                except discord.HTTPException as error:
+                    if error.status != 429 or attempt >= self.max_retries:
+                        raise
+                    wait = retry_after(error)
+                    if is_global(error):
+                        self._blocked_until = time.monotonic() + wait
+                    else:
+                        bucket.blocked_until = time.monotonic() + wait
+            attempt += 1
+            self.rate_limited += 1
+            logging.warning(f'rate limited on {route}, retrying in {wait:.2f}s (attempt {attempt})')
+
+    async def gather(self, route, calls, progress=None) -> list:
+        """runs every zero argument call (e.g. a functools.partial) on route concurrently
+
+        returns their results in order, progress is called with (done, total) each time a call finishes
+        """
+        total = len(calls)
+        done = 0
+
+        async def run_one(call):
+            nonlocal done
+            result = await self.run(route, call)
+            done += 1
+            if progress is not None:
+                progress(done, total)
+            return result
+
+        return await asyncio.gather(*[run_one(call) for call in calls])
+
+
+def log_progress(action: str):
+    """progress callback for gather that logs how far through action it is"""
+    def progress(done, total):
+        logging.info(f'{action}: {done}/{total}')
+    return progress
+
+
+scheduler = ApiScheduler()
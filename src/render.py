@@ -0,0 +1,126 @@
+"""render.py caches what the bot renders from the database and splits long tables into pages
+
+Status checks come in bursts while a phase is running, so the text of each view is kept
+in memory until a write to one of the tables it was built from is committed. database.py
+tells the cache about every write through change_listeners, narrowed to the games the
+write touched where it can tell. Renders made inside a unit of work that has written are
+never kept, they may show rows that are later rolled back. Each table also has a generation
+that every change bumps, a render whose tables changed while it was being built is not kept
+either, it may have read rows from before the change.
+
+Discord rejects messages over 2000 characters so tables are sent as a run of code block
+pages, each repeating the table header.
+"""
+
+from collections import defaultdict
+import threading
+
+import database as db
+import ratelimit
+
+MESSAGE_LIMIT = 2000
+FENCE = '```'
+# the border, titles and separator lines Texttable draws above the first row
+TABLE_HEADER_LINES = 3
+
+# a dependency for views that show member names, these change without a database write
+MEMBERS = 'member'
+
+
+class CacheEntry:
+    __slots__ = ('tables', 'game_id', 'value')
+
+    def __init__(self, tables, game_id, value):
+        self.tables = frozenset(tables)
+        self.game_id = game_id
+        self.value = value
+
+
+class RenderCache:
+    """rendered views keyed by a tuple naming the view and what it shows
+
+    each entry records the tables it was built from and the game it belongs to, None if it isn't one game's
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        # table to how many times it has changed
+        self._generations = defaultdict(int)
+        self._lock = threading.Lock()
+
+    async def get(self, key: tuple, tables: tuple, game_id, build):
+        """returns the cached value for key, otherwise awaits build() and keeps what it returns"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry.value
+
+        self.misses += 1
+        generations = self._generations_of(tables)
+        value = await build()
+        if not db.in_write_transaction():
+            with self._lock:
+                if self._generations_of(tables) == generations:
+                    self._entries[key] = CacheEntry(tables, game_id, value)
+        return value
+
+    def _generations_of(self, tables: tuple) -> tuple:
+        return tuple(self._generations[table] for table in tables)
+
+    def changed(self, table: str, game_ids=None):
+        """drops the entries built from table, only those of game_ids if the change was narrowed to them"""
+        with self._lock:
+            self._generations[table] += 1
+            self._entries = {key: entry for key, entry in self._entries.items()
+                             if table not in entry.tables
+                             or (game_ids is not None and entry.game_id is not None
+                                 and entry.game_id not in game_ids)}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+cache = RenderCache()
+db.change_listeners.append(cache.changed)
+
+
+def paginate(text: str, prefix: str = '', header_lines: int = TABLE_HEADER_LINES, limit: int = MESSAGE_LIMIT) -> list:
+    """splits a drawn table into code block messages of at most limit characters
+
+    prefix goes before the first page, the first header_lines lines are repeated at the top of every page
+    """
+    lines = text.splitlines()
+    header, body = lines[:header_lines], lines[header_lines:]
+    overhead = 2 * len(FENCE) + 1
+    header_size = sum(len(line) + 1 for line in header)
+
+    pages = []
+    page_prefix = prefix
+    current = []
+    size = len(page_prefix) + overhead + header_size
+    for line in body:
+        room = limit - len(page_prefix) - overhead - header_size
+        line = line[:max(room - 1, 0)]
+        if current and size + len(line) + 1 > limit:
+            pages.append(f'{page_prefix}{FENCE}' + '\n'.join(header + current) + FENCE)
+            page_prefix = ''
+            current = []
+            size = overhead + header_size
+        current.append(line)
+        size += len(line) + 1
+    pages.append(f'{page_prefix}{FENCE}' + '\n'.join(header + current) + FENCE)
+    return pages
+
+
+async def send_pages(channel, text: str, prefix: str = '', header_lines: int = TABLE_HEADER_LINES):
+    """sends a drawn table to channel as one message or, when it is too long, as several in order"""
+    messages = []
+    for page in paginate(text, prefix, header_lines):
+        messages.append(await ratelimit.scheduler.run(f'channel:{channel.id}:send', channel.send, page))
+    return messages
@@ -1,3 +1,74 @@
 """server.py manages things that are generic to the server and dont assist in game management
 
+MemberIndex keeps a name lookup of every guild member in memory so commands that take
+a player name don't have to scan the whole member list, the bot keeps it up to date from
+the member join, update and remove events
 """
+
+from collections import defaultdict
+import re
+
+MENTION = re.compile(r'<@!?(\d+)>')
+MEMBER_ID = re.compile(r'\d{15,21}')
+
+
+def parse_member_id(text: str):
+    """returns the user id in a mention or raw id, None if text is a name"""
+    text = text.strip()
+    match = MENTION.fullmatch(text)
+    if match is not None:
+        return int(match.group(1))
+    if MEMBER_ID.fullmatch(text):
+        return int(text)
+    return None
+
+
+def member_keys(member) -> set:
+    """the case insensitive names a member can be looked up by: name#0000, username and nickname"""
+    return {str(member).casefold(), member.name.casefold(), member.display_name.casefold()}
+
+
+class MemberIndex:
+    """maps each guild's member names to the ids of the members that go by them"""
+
+    def __init__(self):
+        self._names = {}
+        self._keys = {}
+
+    def load(self, guild):
+        self._names[guild.id] = defaultdict(set)
+        self._keys[guild.id] = {}
+        for member in guild.members:
+            self.add(member)
+
+    def add(self, member):
+        guild_id = member.guild.id
+        if guild_id not in self._names:
+            # the guild is indexed in full the first time it is needed
+            return
+        self.remove(member)
+        keys = member_keys(member)
+        self._keys[guild_id][member.id] = keys
+        for key in keys:
+            self._names[guild_id][key].add(member.id)
+
+    def update(self, before, after):
+        self.add(after)
+
+    def remove(self, member):
+        guild_id = member.guild.id
+        keys = self._keys.get(guild_id, {}).pop(member.id, ())
+        for key in keys:
+            ids = self._names[guild_id][key]
+            ids.discard(member.id)
+            if not ids:
+                del self._names[guild_id][key]
+
+    def lookup(self, guild, name: str) -> set:
+        """returns the ids of the guild's members that go by name"""
+        if guild.id not in self._names:
+            self.load(guild)
+        return set(self._names[guild.id].get(name.strip().casefold(), ()))
+
+
+members = MemberIndex()
@@ -0,0 +1,187 @@
+""" announcement.py keeps track of the game announcement messages players react to
+
+Every reaction in the guild is delivered to the bot, so the registration handlers
+look the message up in an in memory index of recruiting games first and ignore
+anything that isn't an announcement without touching the database.
+
+Announcement edits go through a debounced updater, a burst of sign ups turns into
+at most one edit of the cached message per interval showing the latest player count
+"""
+
+import asyncio
+import logging
+
+import discord
+from texttable import Texttable
+
+import database as db
+import globals
+from globals import GameStatus
+
+UPDATE_INTERVAL = 2.0
+
+
+async def generate_message(game_id):
+    game_table = await db.select_one_async('game', {'game_id': game_id})
+    number_of_players = await db.count_rows_async('game_player', indicators={'game_id': game_id})
+
+    announcement_table = Texttable()
+    announcement_table.header(['Codename', 'Starting Date', 'Emoji', 'Status', 'Current Players'])
+    announcement_table.add_row(
+        [game_table['game_name'], game_table['start_date'], globals.GAME_REACTION_EMOJI, game_table['status'],
+         number_of_players])
+
+    if GameStatus(game_table['status']) in [GameStatus.ACTIVE, GameStatus.COMPLETED]:
+        message = f'This game has now closed' \
+                  f"```{announcement_table.draw()}```"
+    else:
+        message = f"New game called {game_table['game_name']} will be starting on {game_table['start_date']}. " \
+                  f"If you would like to register for this game, react to this post with a {globals.GAME_REACTION_EMOJI} " \
+                  f"Registrations will close at 5pm on {game_table['start_date']}. Roles will be assigned and more instructions will follow.\n" \
+                  f"```{announcement_table.draw()}```"
+
+    return message
+
+
+class AnnouncementEntry:
+    __slots__ = ('guild_id', 'game_id', 'alive_role_id')
+
+    def __init__(self, guild_id, game_id, alive_role_id):
+        self.guild_id = guild_id
+        self.game_id = game_id
+        self.alive_role_id = alive_role_id
+
+
+class AnnouncementIndex:
+    """maps discord_announce_message_id to the recruiting game it announces and the game's alive role
+
+    only the games of the guilds this process serves are loaded, so every shard keeps its own index
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, message_id) -> AnnouncementEntry:
+        return self._entries.get(message_id)
+
+    def add(self, message_id, guild_id, game_id, alive_role_id):
+        self.discard(game_id)
+        self._entries[message_id] = AnnouncementEntry(guild_id, game_id, alive_role_id)
+
+    def discard(self, game_id):
+        self._entries = {message_id: entry for message_id, entry in self._entries.items()
+                         if entry.game_id != game_id}
+
+    async def load(self, guild_ids):
+        """rebuilds the index from every recruiting game in the guilds guild_ids"""
+        games = await db.select_rows_async('game', {'discord_guild_id': list(guild_ids),
+                                                    'status': GameStatus.RECRUITING.value})
+        alive_roles = await db.select_rows_async('game_role', {'game_id': [row['game_id'] for row in games],
+                                                               'default_value': 'alive'},
+                                                 joins={'role': 'role_id'})
+        alive_role_ids = {row['game_id']: row['discord_role_id'] for row in alive_roles}
+
+        self._entries = {row['discord_announce_message_id']: AnnouncementEntry(row['discord_guild_id'], row['game_id'],
+                                                                               alive_role_ids.get(row['game_id']))
+                         for row in games if row['discord_announce_message_id'] is not None}
+        logging.info(f'announcement index loaded {len(self._entries)} recruiting games')
+
+    async def sync_game(self, game_id, status: GameStatus):
+        """updates the entry for a game whose status has changed, once the change is committed"""
+        if status != GameStatus.RECRUITING:
+            db.after_commit(lambda: self.discard(game_id))
+            return
+
+        game_data = await db.select_one_async('game', {'game_id': game_id})
+        alive_role = await db.select_one_async('game_role', {'game_id': game_id, 'default_value': 'alive'},
+                                               joins={'role': 'role_id'})
+        if game_data is None or game_data['discord_announce_message_id'] is None:
+            return
+        alive_role_id = alive_role['discord_role_id'] if alive_role is not None else None
+        db.after_commit(lambda: self.add(game_data['discord_announce_message_id'], game_data['discord_guild_id'],
+                                         game_id, alive_role_id))
+
+
+index = AnnouncementIndex()
+
+
+class AnnouncementUpdater:
+    """edits announcement messages, merging the requests for a game into at most one edit per interval
+
+    the first request edits straight away, requests that arrive while an edit is in flight or within
+    interval of it are folded into a single follow up edit, so the message always ends up showing
+    the state of the database after the last request
+    """
+
+    def __init__(self, interval=UPDATE_INTERVAL):
+        self.interval = interval
+        self.edits = 0
+        self._messages = {}
+        self._texts = {}
+        self._stale = set()
+        self._tasks = {}
+
+    def remember(self, game_id, message: discord.Message):
+        """caches the announcement message of a game so edits don't have to fetch it"""
+        self._messages[game_id] = message
+        self._texts[game_id] = message.content
+
+    def forget(self, game_id):
+        self._messages.pop(game_id, None)
+        self._texts.pop(game_id, None)
+        self._stale.discard(game_id)
+
+    def request(self, game_id, channel=None):
+        """marks the game's announcement as out of date, channel is only needed if the message isn't cached"""
+        self._stale.add(game_id)
+        if game_id not in self._tasks:
+            self._tasks[game_id] = asyncio.get_running_loop().create_task(self._run(game_id, channel))
+
+    async def flush(self):
+        """waits for every queued edit to be sent"""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def _run(self, game_id, channel):
+        try:
+            while game_id in self._stale:
+                self._stale.discard(game_id)
+                try:
+                    await self._edit(game_id, channel)
+                except Exception:
+                    # the requests made meanwhile are still stale and get the next edit
+                    logging.exception(f'failed to update the announcement for game {game_id}')
+                await asyncio.sleep(self.interval)
+        finally:
+            self._tasks.pop(game_id, None)
+
+    async def _message(self, game_id, channel):
+        message = self._messages.get(game_id)
+        if message is None:
+            game_data = await db.select_one_async('game', {'game_id': game_id})
+            if game_data is None or game_data['discord_announce_message_id'] is None or channel is None:
+                return None
+            message = await channel.fetch_message(game_data['discord_announce_message_id'])
+            self.remember(game_id, message)
+        return message
+
+    async def _edit(self, game_id, channel):
+        message = await self._message(game_id, channel)
+        if message is None:
+            return
+        text = await generate_message(game_id)
+        if text == self._texts.get(game_id):
+            return
+        try:
+            await message.edit(content=text)
+        except discord.NotFound:
+            self.forget(game_id)
+            return
+        self._texts[game_id] = text
+        self.edits += 1
+
+
+updater = AnnouncementUpdater()
@@ -3,67 +3,101 @@
 This file sets the logic for how abilities interact and events that happen in the game
 """
 
+import functools
+
 import database as db
 import globals
 from globals import GameStatus
-from werewolf import game
+import ratelimit
+import render
+import server
+from werewolf import game, history, vote
+
+async def find_players(ctx, game_id, players) -> list:
+    """finds the game_player rows for mentions, user ids, name#0000s, usernames or nicknames among the game's players
+
+    every player is looked up in one query, if any of them can't be found nothing is returned
+    """
+    candidates = {}
+    for player in players:
+        member_id = server.parse_member_id(player)
+        candidates[player] = {member_id} if member_id is not None else server.members.lookup(ctx.guild, player)
 
-async def find_player(ctx, game_id, player):
-    found_member = None
-    for member in ctx.guild.members:
-        if str(member) == player:
-            found_member = member
-            break
+    user_ids = set().union(*candidates.values())
+    game_players = await db.select_rows_async('game_player', {'game_id': game_id, 'discord_user_id': list(user_ids)}) \
+        if user_ids else []
+    by_user = {row['discord_user_id']: row for row in game_players}
 
-    if found_member is None:
-        await ctx.channel.send(f'There is no member called "{player}"')
-        return
+    found, problems = {}, []
+    for player, ids in candidates.items():
+        matches = [by_user[user_id] for user_id in ids if user_id in by_user]
+        if not ids:
+            problems.append(f'There is no member called "{player}"')
+        elif not matches:
+            problems.append(f'"{player}" is not a part of this game')
+        elif len(matches) > 1:
+            problems.append(f'"{player}" matches more than one player, use their mention or name#0000')
+        else:
+            found[matches[0]['game_player_id']] = matches[0]
 
-    member_data = db.select_table("game_player",
-                                  indicators={'game_id': game_id, 'discord_user_id': found_member.id})
-    if member_data.empty:
-        await ctx.channel.send(f'"{player}" is not a part of this game')
-        return
+    if problems:
+        await ctx.channel.send('\n'.join(problems))
+        return None
+    return list(found.values())
 
-    return member_data.iloc[0]
+async def game_roles(game_id) -> dict:
+    """the game's discord role ids by their default_value, cached as they don't change once the game is created"""
+    async def load():
+        role_data = await db.select_rows_async('game_role', joins={'role': 'role_id'}, indicators={'game_id': game_id})
+        return {row['default_value']: row['discord_role_id'] for row in role_data}
 
-async def death(ctx, player):
+    return await render.cache.get(('game_roles', game_id), ('game_role',), game_id, load)
+
+async def set_vitals(ctx, players, vitals: str, event_taken: str):
+    """moves players to vitals, their vitals are written in one update and each member's roles in one edit"""
     game_data = await game.get_game(ctx.channel, GameStatus.ACTIVE)
     if game_data is not None and str(ctx.channel).lower() == globals.moderator_channel_name:
         game_id = game_data['game_id']
+        if not players:
+            await ctx.channel.send(f'provide at least one player')
+            return
 
-        member_data = await find_player(ctx, game_id, player)
-        if member_data.empty:
+        member_data = await find_players(ctx, game_id, players)
+        if member_data is None:
             return
-        found_member = ctx.guild.get_member(member_data['discord_user_id'])
+        player_ids = [row['game_player_id'] for row in member_data]
 
-        db.update_table("game_player", data_to_update={'vitals': 'deceased'},
-                        update_conditions={'game_id': game_id, 'discord_user_id': found_member.id})
+        await db.update_table_async("game_player", data_to_update={'vitals': vitals},
+                                    update_conditions={'game_id': game_id, 'game_player_id': player_ids})
+        await history.log.record(*[history.event(game_id, event_taken, game_data['round'], game_data['phase'],
+                                                 player_affected_id=player_id) for player_id in player_ids])
+        if vitals == 'deceased':
+            # the dead can't vote or be voted for, their votes are withdrawn once the deaths are committed
+            def withdraw_votes():
+                for player_id in player_ids:
+                    vote.book.remove_player(game_id, player_id)
+            db.after_commit(withdraw_votes)
 
-        role_data = db.select_table('game_role', joins={'role': 'role_id'}, indicators={'game_id': game_id})
-        deceased_role_id = ctx.guild.get_role(
-            role_data[role_data['default_value'] == 'deceased'].iloc[0]['discord_role_id'])
-        alive_role_id = ctx.guild.get_role(role_data[role_data['default_value'] == 'alive'].iloc[0]['discord_role_id'])
-        await found_member.add_roles(deceased_role_id)
-        await found_member.remove_roles(alive_role_id)
+        role_ids = await game_roles(game_id)
+        added = ctx.guild.get_role(role_ids[vitals])
+        removed = ctx.guild.get_role(role_ids['alive' if vitals == 'deceased' else 'deceased'])
+        edits = []
+        for row in member_data:
+            member = ctx.guild.get_member(row['discord_user_id'])
+            if member is None:
+                continue
+            # @everyone can't be set on a member, every other role they have is kept
+            roles = [role for role in member.roles if role not in (removed, added, ctx.guild.default_role)]
+            edits.append(functools.partial(member.edit, roles=roles + [added]))
+        await ratelimit.scheduler.gather(f'guild:{ctx.guild.id}:member_roles', edits)
 
+        names = ', '.join(str(ctx.guild.get_member(row['discord_user_id'])) for row in member_data)
+        await ctx.channel.send(f'{"killed" if vitals == "deceased" else "resurrected"} {names}')
 
-async def resurrect(ctx, player):
-    game_data = await game.get_game(ctx.channel, GameStatus.ACTIVE)
-    if game_data is not None and str(ctx.channel).lower() == globals.moderator_channel_name:
-        game_id = game_data['game_id']
 
-        member_data = await find_player(ctx, game_id, player)
-        if member_data.empty:
-            return
-        found_member = ctx.guild.get_member(member_data['discord_user_id'])
+async def death(ctx, *players):
+    await set_vitals(ctx, players, 'deceased', history.DEATH)
 
-        db.update_table("game_player", data_to_update={'vitals': 'alive'},
-                        update_conditions={'game_id': game_id, 'discord_user_id': found_member.id})
 
-        role_data = db.select_table('game_role', joins={'role': 'role_id'}, indicators={'game_id': game_id})
-        deceased_role_id = ctx.guild.get_role(
-            role_data[role_data['default_value'] == 'deceased'].iloc[0]['discord_role_id'])
-        alive_role_id = ctx.guild.get_role(role_data[role_data['default_value'] == 'alive'].iloc[0]['discord_role_id'])
-        await found_member.remove_roles(deceased_role_id)
-        await found_member.add_roles(alive_role_id)
+async def resurrect(ctx, *players):
+    await set_vitals(ctx, players, 'alive', history.RESURRECT)
@@ -4,9 +4,9 @@ The file contains the main high level functions to run a game
 including create, remove, start, complete, phase
 """
 
-from collections import defaultdict
-from datetime import date, timedelta
-from dateutil.parser import parse
+import asyncio
+from datetime import date, datetime, time, timedelta
+import functools
 import logging
 import random
 
@@ -16,14 +16,25 @@ from texttable import Texttable
 import database as db
 import globals
 from globals import GameStatus
-from werewolf import scenario
+import ratelimit
+import render
+from werewolf import announcement, history, permissions, scenario, timer
 
+# the announcement promises registrations close at 5pm on the start date, a timer starts the game then
+REGISTRATION_CLOSE = time(17)
+# the guild recorded against games from before guild scoping whose category was deleted, no guild has id 0
+UNKNOWN_GUILD = 0
+# the argument each timer action takes from !game-timer-set, if any, and its default like the command's
+TIMER_ARGUMENTS = {'start': ('scenario_name', 'primary'), 'phase': ('phase', None), 'complete': (None, None)}
 
-async def get_game(channel, check_status: GameStatus = None):
-    game_data = db.select_table('game', {'discord_category_id': channel.category.id})
-    if not game_data.empty:
-        game_data = game_data.iloc[0]
 
+async def get_game(channel, check_status: GameStatus = None):
+    guild_id = channel.guild.id
+    category_id = channel.category.id
+    game_data = await render.cache.get(('game', guild_id, category_id), ('game',), None,
+                                       lambda: db.select_one_async('game', {'discord_guild_id': guild_id,
+                                                                            'discord_category_id': category_id}))
+    if game_data is not None:
         if check_status is not None and game_data['status'].lower() != check_status.value:
             await channel.send(
                 f'{game_data["game_name"]} is not in the {check_status.value} stage, this will have no affect')
@@ -32,39 +43,59 @@ async def get_game(channel, check_status: GameStatus = None):
     return None
 
 
-def generate_announcement_message(game_id):
-    game_table = db.select_table('game', {'game_id': game_id}).iloc[0]
-    game_player_table = db.select_table('game_player', indicators={'game_id': game_id})
-
-    announcement_table = Texttable()
-    announcement_table.header(['Codename', 'Starting Date', 'Emoji', 'Status', 'Current Players'])
-    announcement_table.add_row(
-        [game_table['game_name'], game_table['start_date'], globals.GAME_REACTION_EMOJI, game_table['status'],
-         game_player_table.shape[0]])
-
-    if GameStatus(game_table['status']) in [GameStatus.ACTIVE, GameStatus.COMPLETED]:
-        message = f'This game has now closed' \
-                  f"```{announcement_table.draw()}```"
-    else:
-        message = f"New game called {game_table['game_name']} will be starting on {game_table['start_date']}. " \
-                  f"If you would like to register for this game, react to this post with a {globals.GAME_REACTION_EMOJI} " \
-                  f"Registrations will close at 5pm on {game_table['start_date']}. Roles will be assigned and more instructions will follow.\n" \
-                  f"```{announcement_table.draw()}```"
-
-    return message
+async def set_status(game_id, status: GameStatus, data: dict = None):
+    """changes a game's status, every status change should go through here to keep the announcement index in sync"""
+    data_to_update = {'status': status.value}
+    data_to_update.update(data or {})
+    game_data = await db.select_one_async('game', {'game_id': game_id})
+    await db.update_table_async('game', data_to_update, {'game_id': game_id})
+    await history.log.record(history.event(game_id, history.STATUS, game_data['round'], game_data['phase'],
+                                           status=status.value))
+    await history.log.request_snapshot(game_id)
+    await announcement.index.sync_game(game_id, status)
+    if status in (GameStatus.COMPLETED, GameStatus.REMOVED):
+        await timer.timers.cancel(game_id)
+
+
+async def backfill_guild(guild):
+    """records guild against the games and local scenarios created in it before games were scoped to a guild"""
+    category_ids = [category.id for category in guild.categories]
+    if category_ids:
+        await db.update_table_async('game', {'discord_guild_id': guild.id},
+                                    {'discord_guild_id': None, 'discord_category_id': category_ids})
+    games = await db.select_rows_async('game', {'discord_guild_id': guild.id})
+    if games:
+        await db.update_table_async('scenario', {'discord_guild_id': guild.id},
+                                    {'discord_guild_id': None, 'game_id': [row['game_id'] for row in games]})
+
+
+async def backfill_unresolved(fetch_channel):
+    """places the games backfill_guild couldn't, because another process serves their guild or their category is gone
+
+    fetch_channel asks discord for a category by id, a game whose category no longer exists is given
+    UNKNOWN_GUILD so no guild is searched for it again
+    """
+    for row in await db.select_rows_async('game', {'discord_guild_id': None}):
+        try:
+            category = await fetch_channel(row['discord_category_id'])
+        except (discord.NotFound, discord.Forbidden):
+            await db.update_table_async('game', {'discord_guild_id': UNKNOWN_GUILD}, {'game_id': row['game_id']})
+            continue
+        await db.update_table_async('game', {'discord_guild_id': category.guild.id}, {'game_id': row['game_id']})
+        await db.update_table_async('scenario', {'discord_guild_id': category.guild.id},
+                                    {'discord_guild_id': None, 'game_id': row['game_id']})
 
 
 async def update_announcement_message(game_id, ctx=None, channel=None):
+    """queues an edit of the game's announcement, it is sent once the current command's writes are committed"""
     if ctx is not None:
-        for cur_channel in ctx.guild.channels:
-            if cur_channel.name == 'game-announcements':
-                channel = cur_channel
-
-    game_table = db.select_table('game', {'game_id': game_id}).iloc[0]
+        game_data = await db.select_one_async('game', {'game_id': game_id})
+        channel = ctx.guild.get_channel(game_data['discord_announce_channel_id'])
+        if channel is None:
+            # games created before the announcement channel was recorded
+            channel = discord.utils.get(ctx.guild.channels, name='game-announcements')
 
-    message = await channel.fetch_message(game_table['discord_announce_message_id'])
-    text = generate_announcement_message(game_id)
-    await message.edit(content=text)
+    db.after_commit(lambda: announcement.updater.request(game_id, channel))
 
 
 async def create(ctx, game_name, starting_date):
@@ -74,6 +105,7 @@ async def create(ctx, game_name, starting_date):
     ### CHECKS      #####
     #####################
     # check that the inputs are valid
+    from dateutil.parser import parse  # only games being created need the date parser
     try:
         starting_date = parse(starting_date, yearfirst=True).date()
     except ValueError:
@@ -113,71 +145,132 @@ async def create(ctx, game_name, starting_date):
 
     default_permissions = {guild.default_role: discord.PermissionOverwrite(read_messages=False)}
     game_category = await guild.create_category(game_name, overwrites=default_permissions)
+    try:
+        await build(ctx, game_category, announcement_channel, game_name, starting_date)
+    except Exception:
+        logging.exception(f'failed to create {game_name}, removing what was made of it')
+        game_data = await db.select_one_async('game', {'discord_category_id': game_category.id})
+        if game_data is None:
+            await game_category.delete()
+        else:
+            await discard_unfinished(guild, game_data)
+        # the command's unit of work rolls back as it fails, the game's removal has to be committed first
+        await db.checkpoint()
+        raise
+
+
+async def build(ctx, game_category, announcement_channel, game_name, starting_date):
+    """records a new game and makes its announcement, roles, channels and permissions"""
+    guild = ctx.guild
 
     # add game data to database
-    game_data = {'discord_category_id': game_category.id,
+    game_data = {'discord_guild_id': guild.id,
+                 'discord_category_id': game_category.id,
+                 'discord_announce_channel_id': announcement_channel.id,
                  'game_name': game_name,
                  'status': GameStatus.CREATING.value,
                  'start_date': starting_date}
-    db.insert_into_table('game', game_data)
-
-    game_table = db.select_table('game', {'discord_category_id': game_category.id})
-    game_id = game_table['game_id'].iloc[0]
+    game_id = await db.insert_into_table_async('game', game_data)
+    await history.log.record(history.event(game_id, history.CREATE, 0, status=GameStatus.CREATING.value,
+                                           game_name=game_name, start_date=starting_date))
 
     #######################
     ### ANNOUNCE GAME #####
     #######################
 
     # send an announcemnt for the game
-    message = generate_announcement_message(game_id)
+    message = await announcement.generate_message(game_id)
     announcement_message = await announcement_channel.send(message)
+    announcement.updater.remember(game_id, announcement_message)
     await announcement_message.add_reaction(globals.GAME_REACTION_EMOJI)
-    db.update_table('game', {'discord_announce_message_id': announcement_message.id}, {'game_id': game_id})
+    await db.update_table_async('game', {'discord_announce_message_id': announcement_message.id}, {'game_id': game_id})
 
     #####################
     ### CREATE ROLE #####
     #####################
-    role = db.select_table('role')
-    roles_created = {}
-    for idx, row in role.iterrows():
-        if row['default_value'] == 'everyone':
-            continue
-        created_role = await guild.create_role(name=f'{game_name}-{row["role_name"]}')
-        roles_created[row['role_id']] = created_role
-
-        print(f'role created named {created_role.name}')
+    role = [row for row in await db.reference_data.rows_async('role') if row['default_value'] != 'everyone']
+    created_roles = await ratelimit.scheduler.gather(
+        f'guild:{guild.id}:create_role',
+        [functools.partial(guild.create_role, name=f'{game_name}-{row["role_name"]}') for row in role],
+        progress=ratelimit.log_progress(f'{game_name} creating roles'))
+    roles_created = {row['role_id']: created_role for row, created_role in zip(role, created_roles)}
 
     # add role data to db
-    for idx, role in roles_created.items():
-        game_role_data = {'game_id': int(game_id),
-                          'role_id': idx,
-                          'discord_role_id': role.id,
-                          'game_role_name': role.name}
-        db.insert_into_table('game_role', game_role_data)
+    game_role_data = [{'game_id': game_id,
+                       'role_id': idx,
+                       'discord_role_id': role.id,
+                       'game_role_name': role.name} for idx, role in roles_created.items()]
+    await db.insert_many_async('game_role', game_role_data)
 
     ########################
     ### CREATE CHANNEL #####
     ########################
-    channels = db.select_table('channel')
-    for idx, channel in channels.iterrows():
+    channels = await db.reference_data.rows_async('channel')
+    channel_calls = []
+    for channel in channels:
         channel_options = {'name': channel['channel_name'],
                            'category': game_category,
                            'position': channel['channel_order'],
                            'topic': channel['channel_topic']}
         if channel['channel_type'] == 'voice':
-            new_channel = await guild.create_voice_channel(**channel_options)
+            channel_calls.append(functools.partial(guild.create_voice_channel, **channel_options))
         else:
-            new_channel = await guild.create_text_channel(**channel_options)
-        channel_data = {'game_id': int(game_id), 'channel_id': channel['channel_id'],
-                        'discord_channel_id': new_channel.id, 'name': channel['channel_name']}
-        db.insert_into_table('game_channel', channel_data)
-        print(f'creating channel {new_channel.name}')
+            channel_calls.append(functools.partial(guild.create_text_channel, **channel_options))
+    new_channels = await ratelimit.scheduler.gather(f'guild:{guild.id}:create_channel', channel_calls,
+                                                    progress=ratelimit.log_progress(f'{game_name} creating channels'))
+    channel_data = [{'game_id': game_id, 'channel_id': channel['channel_id'],
+                     'discord_channel_id': new_channel.id, 'name': channel['channel_name']}
+                    for channel, new_channel in zip(channels, new_channels)]
+    await db.insert_many_async('game_channel', channel_data)
 
     #########################
     ### SET PERMISSIONS #####
     #########################
-    db.update_table('game', {'status': GameStatus.RECRUITING.value}, {'game_id': game_id})
+    await set_status(game_id, GameStatus.RECRUITING)
     await update_game_permissions(ctx, game_id, 'day', GameStatus.RECRUITING)
+    await timer.timers.add(game_id, 'start', datetime.combine(starting_date, REGISTRATION_CLOSE),
+                           scenario_name='primary')
+
+
+async def discard_unfinished(guild, game_data):
+    """undoes a create that didn't finish, deleting what it made on discord and marking the game removed
+
+    create commits the game row before its first discord request, see db.commits_first, so a create
+    that fails or is cut short by a restart leaves a game that is still creating behind
+    """
+    game_id = game_data['game_id']
+    category = guild.get_channel(game_data['discord_category_id'])
+    if category is not None:
+        await ratelimit.scheduler.gather(f'guild:{guild.id}:delete_channel', [ch.delete for ch in category.channels])
+        await ratelimit.scheduler.run(f'guild:{guild.id}:delete_channel', category.delete)
+
+    # roles are found by name as create may have made some it hadn't recorded yet
+    names = {f'{game_data["game_name"]}-{row["role_name"]}' for row in await db.reference_data.rows_async('role')}
+    await ratelimit.scheduler.gather(f'guild:{guild.id}:delete_role',
+                                     [role.delete for role in guild.roles if role.name in names])
+
+    channel = guild.get_channel(game_data['discord_announce_channel_id'])
+    if channel is not None and game_data['discord_announce_message_id'] is not None:
+        try:
+            message = await channel.fetch_message(game_data['discord_announce_message_id'])
+            await message.delete()
+        except discord.NotFound:
+            pass
+
+    await set_status(game_id, GameStatus.REMOVED)
+    db.after_commit(lambda: announcement.updater.forget(game_id))
+
+
+async def discard_unfinished_games(guilds, created_before: datetime):
+    """discards the games of guilds whose create was cut short by a restart"""
+    guilds = {guild.id: guild for guild in guilds}
+    games = await db.select_rows_async('game', {'discord_guild_id': list(guilds),
+                                                'status': GameStatus.CREATING.value})
+    for row in games:
+        # a create started since this process did is still running
+        if datetime.fromisoformat(row['created_datetime']) < created_before:
+            logging.warning(f'removing {row["game_name"]}, its create did not finish')
+            await discard_unfinished(guilds[row['discord_guild_id']], row)
 
 
 async def remove(ctx):
@@ -187,87 +280,81 @@ async def remove(ctx):
     if game_data is not None and str(ctx.channel).lower() == globals.moderator_channel_name:
         game_id = game_data['game_id']
 
-        for ch in category.channels:
-            await ch.delete()
-        await category.delete()
+        await ratelimit.scheduler.gather(f'guild:{guild.id}:delete_channel',
+                                         [ch.delete for ch in category.channels],
+                                         progress=ratelimit.log_progress(f'{category} deleting channels'))
+        await ratelimit.scheduler.run(f'guild:{guild.id}:delete_channel', category.delete)
 
-        game_role = db.select_table('game_role', {'game_id': game_id})
-        for idx, row in game_role.iterrows():
-            role = guild.get_role(row['discord_role_id'])
-            await role.delete()
+        game_role = await db.select_rows_async('game_role', {'game_id': game_id})
+        roles = [guild.get_role(row['discord_role_id']) for row in game_role]
+        await ratelimit.scheduler.gather(f'guild:{guild.id}:delete_role',
+                                         [role.delete for role in roles if role is not None],
+                                         progress=ratelimit.log_progress(f'{category} deleting roles'))
 
-        db.update_table('game', {'status': GameStatus.REMOVED.value}, {'game_id': game_id})
+        await set_status(game_id, GameStatus.REMOVED)
+        db.after_commit(lambda: announcement.updater.forget(game_id))
 
 
 async def update_game_permissions(ctx, game_id, phase: str, status: GameStatus):
-    # player permissions
-    # game_players = db.select_table('game_player', {'game_id': game_id})
-    character_permissions = db.select_table('character_permission', joins={'game_player': 'character_id'},
-                                            indicators={'game_id': game_id})
-
-    character_permissions = character_permissions[
-        character_permissions['game_phase'].isin([None, phase]) & character_permissions['game_status'].isin(
-            [None, status.value])]
-    # only keep permissions that track living status
-    character_map = character_permissions.apply(lambda x: x['vitals_required'] in [None, x['vitals']], axis=1)
-    character_permissions = character_permissions[character_map]
-
-    # role permissions
-    role_permissions = db.select_table('role_permission', joins={'game_role': 'role_id'},
-                                       indicators={'game_id': game_id})
-    role_permissions = role_permissions[
-        role_permissions['game_phase'].isin([None, phase]) & role_permissions['game_status'].isin([None, status.value])]
-
-    for idx, channel_row in db.select_table('game_channel', {'game_id': game_id}).iterrows():
-        channel_id = channel_row['channel_id']
+    game_players = await db.select_rows_async('game_player', {'game_id': game_id})
+    game_roles = await db.select_rows_async('game_role', {'game_id': game_id})
+    game_channels = await db.select_rows_async('game_channel', {'game_id': game_id})
+    matrix = permissions.resolve_permissions(game_players, game_roles,
+                                             await db.reference_data.group_async('character_permission', 'character_id'),
+                                             await db.reference_data.group_async('role_permission', 'role_id'),
+                                             [row['channel_id'] for row in game_channels], phase, status.value)
+
+    syncs = []
+    for channel_row in game_channels:
         channel = ctx.guild.get_channel(channel_row['discord_channel_id'])
+        perms = {permissions.resolve_target(ctx.guild, target): values
+                 for target, values in matrix[channel_row['channel_id']].items()}
+        # members that have left the server can't be given permissions
+        perms.pop(None, None)
 
-        channel_char_perms = character_permissions[character_permissions['channel_id'].isin([None, int(channel_id)])]
-        role_char_perms = role_permissions[role_permissions['channel_id'].isin([None, int(channel_id)])]
-
-        perms = defaultdict(dict)
-        for idx, row in channel_char_perms.iterrows():
-            user = ctx.guild.get_member(row['discord_user_id'])
-            perms[user][row['permission_name']] = True if int(row['permission_value']) else False
-
-        for idx, row in role_char_perms.iterrows():
-            user = ctx.guild.get_role(row['discord_role_id'])
-            perms[user][row['permission_name']] = True if int(row['permission_value']) else False
-
+        desired = {target: discord.PermissionOverwrite(**values) for target, values in perms.items()}
         # ensures default channel cant be seen
-        old_targets = list(channel.overwrites.keys())
-        if ctx.guild.default_role in old_targets:
-            await channel.set_permissions(ctx.guild.default_role,
-                                          overwrite=discord.PermissionOverwrite(read_messages=False))
-            old_targets.remove(ctx.guild.default_role)
-
-        for target, values in perms.items():
-            if target in old_targets:
-                old_targets.remove(target)
-            values = discord.PermissionOverwrite(**values)
-            await channel.set_permissions(target, overwrite=values)
-
-        # clears out any extra permissions
-        for target in old_targets:
-            await channel.set_permissions(target, overwrite=discord.PermissionOverwrite())
-
-
-    db.update_table('game', data_to_update={'phase': phase}, update_conditions={'game_id': game_id})
+        if ctx.guild.default_role in channel.overwrites:
+            desired[ctx.guild.default_role] = discord.PermissionOverwrite(read_messages=False)
+
+        # only overwrites that differ from the channel's current ones are sent, extra ones are cleared out
+        syncs.append(permissions.sync_channel_overwrites(channel, desired))
+
+    # every channel is its own rate limit bucket so they are all updated at once
+    result = permissions.PermissionSyncResult()
+    for channel_result in await asyncio.gather(*syncs):
+        result += channel_result
+
+    logging.info(f'updated permissions for game {game_id} to {status.value} {phase}: {result}')
+
+    # an active game is in round 1 from its first phase and a new round starts every day after a night
+    game_data = await db.select_one_async('game', {'game_id': game_id})
+    round = game_data['round'] or 0
+    if status == GameStatus.ACTIVE and (round == 0 or (phase == 'day' and game_data['phase'] == 'night')):
+        round += 1
+    await db.update_table_async('game', data_to_update={'phase': phase, 'round': round},
+                                update_conditions={'game_id': game_id})
+    await history.log.record(history.event(game_id, history.PHASE, round, phase, status=status.value))
+    await history.log.request_snapshot(game_id)
+    return result
+
+
+async def get_game_player_status(ctx, game_id):
+    """the drawn player status table, cached until the game's players change"""
+    async def draw():
+        game_players = await db.select_rows_async('game_player', {'game_id': game_id})
+        game_players.sort(key=lambda row: (row['position'] is None, row['position']))
+        guild = ctx.guild
 
+        table = Texttable()
+        table.header(['Virtual Position', 'User', 'Status'])  # todo add in character if deceased
 
+        for row in game_players:
+            user = guild.get_member(row['discord_user_id'])
+            table.add_row([row['position'], user, row['vitals']])
+        return table.draw()
 
-def get_game_player_status(ctx, game_id):
-    game_players = db.select_table('game_player', {'game_id': game_id})
-    game_players = game_players.sort_values('position')
-    guild = ctx.guild
-
-    table = Texttable()
-    table.header(['Virtual Position', 'User', 'Status'])  # todo add in character if deceased
-
-    for idx, row in game_players.iterrows():
-        user = guild.get_member(row['discord_user_id'])
-        table.add_row([row['position'], user, row['vitals']])
-    return f'```{table.draw()}```'
+    return await render.cache.get(('player_status', game_id), ('game_player', render.MEMBERS), game_id, draw)
 
 
 async def game_assign_characters(ctx, scenario_id):
@@ -277,47 +364,52 @@ async def game_assign_characters(ctx, scenario_id):
     if game_data is not None and str(ctx.channel).lower() == globals.moderator_channel_name:
         game_id = game_data['game_id']
 
-        game_players = db.select_table('game_player', indicators={'game_id': game_id})
-        game_characters = db.select_table('scenario_character',
-                                          indicators={'scenario_id': scenario_id}).sample(frac=1)
+        game_players = await db.select_rows_async('game_player', indicators={'game_id': game_id})
+        game_characters = await db.select_rows_async('scenario_character', indicators={'scenario_id': scenario_id})
+        random.shuffle(game_characters)
 
         correct_chars = await game_has_correct_chars(ctx, game_id, scenario_id)
         if not correct_chars:
             return
 
-        await ctx.channel.send(f'you have {game_players.shape[0]} players and {game_characters.shape[0]}  characters')
+        await ctx.channel.send(f'you have {len(game_players)} players and {len(game_characters)}  characters')
 
-        positions = list(range(1, game_players.shape[0] + 1))
+        character_data = await db.reference_data.by_async('character', 'character_id')
+
+        positions = list(range(1, len(game_players) + 1))
         random.shuffle(positions)
         table = Texttable()
         table.header(['User', 'Role Assigned'])
-        for idx, player in game_players.iterrows():
+        player_updates = []
+        for idx, player in enumerate(game_players):
             user = ctx.guild.get_member(player['discord_user_id'])
-            character_id = game_characters['character_id'].iloc[idx]
-            character = db.select_table('character', indicators={'character_id': character_id}).iloc[0]
+            character_id = game_characters[idx]['character_id']
+            character = character_data[character_id]
 
             table.add_row([user, character["character_display_name"]])
 
-            db.update_table('game_player', {'character_id': character_id, 'starting_character_id': character_id,
-                                            'position': positions[idx], 'vitals': 'alive',
-                                            'current_affiliation': character['starting_affiliation']},
-                            {'game_id': game_id, 'discord_user_id': player['discord_user_id']})
+            player_updates.append({'game_player_id': player['game_player_id'],
+                                   'character_id': character_id, 'starting_character_id': character_id,
+                                   'position': positions[idx], 'vitals': 'alive',
+                                   'current_affiliation': character['starting_affiliation']})
 
-            # game_players = db.select_table('game_player', indicators={'game_id': game_id})
+        await db.update_many_async('game_player', player_updates, key_columns=('game_player_id',))
+        await history.log.record(*[history.event(game_id, history.ASSIGN, 0, player_affected_id=row['game_player_id'],
+                                                 character_id=row['character_id'], position=row['position'],
+                                                 affiliation=row['current_affiliation'])
+                                   for row in player_updates])
 
-        await ctx.channel.send(f'```{table.draw()}```')
+        await render.send_pages(ctx.channel, table.draw())
         await update_game_permissions(ctx, game_id, 'day', GameStatus.INITIALIZING)
         return
 
 
 async def game_has_correct_chars(ctx, game_id, scenario_id) -> bool:
-    game_players = db.select_table('game_player', indicators={'game_id': game_id})
-    scenario_characters = db.select_table('scenario_character',
-                                          indicators={'scenario_id': scenario_id}).sample(
-        frac=1)
-    if game_players.shape[0] != scenario_characters.shape[0] or game_players.shape[0] <= 0:
+    number_of_players = await db.count_rows_async('game_player', indicators={'game_id': game_id})
+    number_of_characters = await db.count_rows_async('scenario_character', indicators={'scenario_id': scenario_id})
+    if number_of_players != number_of_characters or number_of_players <= 0:
         await ctx.channel.send(
-            f'players ({game_players.shape[0]}) and characters ({scenario_characters.shape[0]}) must be equal')
+            f'players ({number_of_players}) and characters ({number_of_characters}) must be equal')
         return False
     return True
 
@@ -330,9 +422,8 @@ async def phase_set(ctx, phase):
             return
 
         game_id = game_data['game_id']
-        await update_game_permissions(ctx, game_id, phase, GameStatus.ACTIVE)
-
-    # todo post when complete (maybe do that in update_permissions
+        result = await update_game_permissions(ctx, game_id, phase, GameStatus.ACTIVE)
+        await ctx.channel.send(f'phase changed to {phase}, {result}')
 
 
 async def info(ctx):
@@ -340,15 +431,18 @@ async def info(ctx):
     if game_data is not None and str(ctx.channel).lower() == globals.moderator_channel_name:
         game_id = game_data['game_id']
 
-        game_players = db.select_table('game_player', indicators={'game_id': game_id})
+        async def draw():
+            number_of_players = await db.count_rows_async('game_player', indicators={'game_id': game_id})
 
-        table = Texttable()
-        table.header(['ID', 'Name', 'Status', 'Phase', 'Start Date', 'Players'])
+            table = Texttable()
+            table.header(['ID', 'Name', 'Status', 'Phase', 'Start Date', 'Players'])
 
-        table.add_row([game_data['game_id'], game_data['game_name'], game_data['status'], game_data['phase'],
-                       game_data['start_date'], game_players.shape[0]])
+            table.add_row([game_data['game_id'], game_data['game_name'], game_data['status'], game_data['phase'],
+                           game_data['start_date'], number_of_players])
+            return table.draw()
 
-        await ctx.channel.send(f'```{table.draw()}```')
+        table = await render.cache.get(('info', game_id), ('game', 'game_player'), game_id, draw)
+        await render.send_pages(ctx.channel, table)
 
 
 async def player_status(ctx):
@@ -356,8 +450,8 @@ async def player_status(ctx):
     if game_data is not None and str(ctx.channel).lower() == globals.moderator_channel_name:
         game_id = game_data['game_id']
 
-        status_post = get_game_player_status(ctx, game_id)
-        await ctx.channel.send(f'{status_post}')
+        status_post = await get_game_player_status(ctx, game_id)
+        await render.send_pages(ctx.channel, status_post)
 
 
 
@@ -376,21 +470,22 @@ async def start(ctx, scenario_name):
         if not correct_chars:
             return
 
-        db.update_table('game', {'status': GameStatus.INITIALIZING.value}, {'game_id': game_id})
+        await set_status(game_id, GameStatus.INITIALIZING)
 
         await game_assign_characters(ctx, scenario_id)
         await update_game_permissions(ctx, game_id, 'day', GameStatus.ACTIVE)
 
-        status_post = get_game_player_status(ctx, game_id)
+        status_post = await get_game_player_status(ctx, game_id)
         for channel in ctx.channel.category.channels:
-            if channel.name == 'player':
-                await channel.send(f'{status_post}')
+            if channel.name == globals.player_channel_name:
+                await render.send_pages(channel, status_post)
                 break
 
-        num_of_players = db.select_table('game_player', indicators={'game_id': game_id}).shape[0]
+        num_of_players = await db.count_rows_async('game_player', indicators={'game_id': game_id})
 
-        db.update_table('game', {'status': GameStatus.ACTIVE.value, 'number_of_players': num_of_players},
-                        {'game_id': game_id})
+        await set_status(game_id, GameStatus.ACTIVE, {'number_of_players': num_of_players})
+        # a game started by hand no longer needs starting when registrations close
+        await timer.timers.cancel(game_id, action='start')
 
         await update_announcement_message(game_id, ctx=ctx)
 
@@ -400,8 +495,8 @@ async def complete(ctx):
     if game_data is not None and str(ctx.channel).lower() == globals.moderator_channel_name:
         game_id = game_data['game_id']
 
-        await update_game_permissions(ctx, game_id, 'day', GameStatus.COMPLETED.value)
-        db.update_table('game', {'status': GameStatus.COMPLETED.value, 'end_date': date.today()}, {'game_id': game_id})
+        await update_game_permissions(ctx, game_id, 'day', GameStatus.COMPLETED)
+        await set_status(game_id, GameStatus.COMPLETED, {'end_date': date.today()})
 
 
 async def status_set(ctx, status):
@@ -416,6 +511,55 @@ async def status_set(ctx, status):
             return
 
         await update_game_permissions(ctx, game_id, 'day', game_status)
-        db.update_table('game', {'status': game_status.value, 'end_date': date.today()}, {'game_id': game_id})
+        await set_status(game_id, game_status, {'end_date': date.today()})
         await update_announcement_message(game_id, ctx=ctx)
         await ctx.channel.send(f'changed status to {game_status.value}')
+
+
+async def timer_set(ctx, action, when, value=None):
+    game_data = await get_game(ctx.channel)
+    if game_data is not None and str(ctx.channel).lower() == globals.moderator_channel_name:
+        game_id = game_data['game_id']
+
+        if action not in TIMER_ARGUMENTS:
+            await ctx.channel.send(f'{action} is not a timer action, use one of {", ".join(TIMER_ARGUMENTS)}')
+            return
+        if action == 'phase' and value not in ['day', 'night']:
+            await ctx.channel.send(f'not a valid phase')
+            return
+        try:
+            due = timer.parse_when(when)
+        except (ValueError, OverflowError):
+            await ctx.channel.send(f'ensure the time is a duration like "90m", "12h" or "2d" or in the format of '
+                                   f'"YYYY-MM-DD HH:MM" you provided: {when}')
+            return
+        if due <= datetime.now():
+            await ctx.channel.send(f'time you provided was not in the future, you provided {due}')
+            return
+
+        argument, default = TIMER_ARGUMENTS[action]
+        data = {argument: value or default} if argument is not None else {}
+        timer_id = await timer.timers.add(game_id, action, due, **data)
+        await ctx.channel.send(f'timer {timer_id} will {" ".join([action] + list(data.values()))} '
+                               f'at {due:%Y-%m-%d %H:%M}')
+
+
+async def timer_list(ctx):
+    game_data = await get_game(ctx.channel)
+    if game_data is not None and str(ctx.channel).lower() == globals.moderator_channel_name:
+        table = Texttable()
+        table.header(['ID', 'Action', 'Due', 'Data'])
+        for row in await timer.timers.pending(game_data['game_id']):
+            table.add_row([row['game_timer_id'], row['action'], row['due_datetime'], row['data'] or ''])
+        await render.send_pages(ctx.channel, table.draw())
+
+
+async def timer_cancel(ctx, timer_id: int):
+    game_data = await get_game(ctx.channel)
+    if game_data is not None and str(ctx.channel).lower() == globals.moderator_channel_name:
+        await timer.timers.cancel(game_data['game_id'], timer_id)
+        await ctx.channel.send(f'timer {timer_id} cancelled')
+
+
+# the commands a timer can run, each called with the moderator channel's context and the timer's data
+timer.timers.actions.update({'start': start, 'phase': phase_set, 'complete': complete})
@@ -0,0 +1,116 @@
+""" generator.py searches for scenarios that fit a number of players and a target weighting
+
+For every character (in catalogue order) and number of remaining slots it works out the set of
+total weightings the remaining characters can still reach, kept as a bitmask in a python int so
+whole sets are combined with a single shift and or. Builds are then sampled from the front: each
+character gets a random number of copies out of those that keep the target reachable, so every
+build that comes out respects max_duplicates and hits the weighting it was sampled for, starting
+from the closest one that can be made.
+"""
+
+import random
+
+# samples taken at each weighting, and in all
+MAX_ATTEMPTS = 200
+MAX_TOTAL_ATTEMPTS = 2000
+
+
+class Build:
+    __slots__ = ('counts', 'weighting')
+
+    def __init__(self, counts: dict, weighting: int):
+        self.counts = counts
+        self.weighting = weighting
+
+    def characters(self) -> str:
+        """the build in the form scenario-character-add accepts, e.g. werewolf|2,villager|4,seer"""
+        return ','.join(name if count == 1 else f'{name}|{count}' for name, count in self.counts.items())
+
+
+class ScenarioSearch:
+    """reachable weightings of every catalogue suffix for every number of slots up to players"""
+
+    def __init__(self, characters: list, players: int):
+        self.characters = characters
+        self.players = players
+        self.weights = [int(character['weighting'] or 0) for character in characters]
+        # no max_duplicates means any number of copies, 0 means none
+        self.limits = [players if character['max_duplicates'] is None else min(players, int(character['max_duplicates']))
+                       for character in characters]
+        # weightings are stored offset so the lightest possible slot is bit 0
+        self.lightest = min(self.weights, default=0)
+        self.reachable = self._reachable()
+
+    def _reachable(self) -> list:
+        # reachable[i][n] has bit b set if characters[i:] can fill n slots with offset weighting b
+        empty = [1] + [0] * self.players
+        reachable = [empty]
+        for weight, limit in zip(reversed(self.weights), reversed(self.limits)):
+            shift = weight - self.lightest
+            after = reachable[-1]
+            current = []
+            for slots in range(self.players + 1):
+                mask = 0
+                for copies in range(min(limit, slots) + 1):
+                    mask |= after[slots - copies] << (copies * shift)
+                current.append(mask)
+            reachable.append(current)
+        reachable.reverse()
+        return reachable
+
+    def weightings(self, target: int):
+        """yields the reachable total weightings nearest target first, the lower of two as near"""
+        mask = self.reachable[0][self.players]
+        offset = target - self.players * self.lightest
+        for distance in range(mask.bit_length() + abs(offset) + 1):
+            for candidate in sorted({offset - distance, offset + distance}):
+                if 0 <= candidate and mask >> candidate & 1:
+                    yield candidate + self.players * self.lightest
+
+    def closest_weighting(self, target: int):
+        """the reachable total weighting nearest target, None if the players can't be filled at all"""
+        return next(self.weightings(target), None)
+
+    def sample(self, weighting: int, rand: random.Random) -> Build:
+        """a random build of exactly players characters whose weightings add up to weighting"""
+        slots = self.players
+        offset = weighting - self.players * self.lightest
+        counts = {}
+        for index, character in enumerate(self.characters):
+            shift = self.weights[index] - self.lightest
+            choices = [copies for copies in range(min(self.limits[index], slots) + 1)
+                       if offset - copies * shift >= 0
+                       and self.reachable[index + 1][slots - copies] >> (offset - copies * shift) & 1]
+            copies = rand.choice(choices)
+            if copies:
+                counts[character['character_name']] = copies
+            slots -= copies
+            offset -= copies * shift
+        return Build(counts, weighting)
+
+
+def generate(characters: list, players: int, target: int, builds: int = 3, valid=None, seed=None) -> list:
+    """up to builds distinct builds of players characters with the reachable weightings closest to target
+
+    valid is an optional check each build has to pass, e.g. that it has a werewolf in it. When too few
+    builds at the closest weighting pass it the next closest weightings are tried, nearest first
+    """
+    if players <= 0 or not characters:
+        return []
+    search = ScenarioSearch(characters, players)
+
+    rand = random.Random(seed)
+    found = {}
+    attempts = 0
+    for weighting in search.weightings(target):
+        for attempt in range(MAX_ATTEMPTS):
+            if attempts >= MAX_TOTAL_ATTEMPTS:
+                return list(found.values())
+            attempts += 1
+            build = search.sample(weighting, rand)
+            key = tuple(sorted(build.counts.items()))
+            if key not in found and (valid is None or valid(build)):
+                found[key] = build
+                if len(found) >= builds:
+                    return list(found.values())
+    return list(found.values())
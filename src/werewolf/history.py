@@ -0,0 +1,147 @@
+""" history.py keeps the append only log of everything that changes a game
+
+Every status change, phase change, character assignment, death and resurrection is
+added to game_event with the round it happened in. Events recorded during a command
+are held back and inserted together just before the command's unit of work commits.
+
+Each phase change also stores a snapshot of the game's state in game_snapshot, so the
+current state is rebuilt from the latest snapshot and only the events after it rather
+than from the whole log.
+"""
+
+import json
+import weakref
+
+import database as db
+
+CREATE = 'create'
+STATUS = 'status'
+PHASE = 'phase'
+ASSIGN = 'assign'
+DEATH = 'death'
+RESURRECT = 'resurrect'
+
+
+def event(game_id, event_taken: str, round: int = None, phase: str = None, player_affected_id=None,
+          player_acting_id=None, **data) -> dict:
+    """builds a game_event row, anything in data is stored with it as json"""
+    return {'game_id': game_id, 'event_taken': event_taken, 'round': round, 'phase': phase,
+            'player_affected_id': player_affected_id, 'player_acting_id': player_acting_id,
+            'data': json.dumps(data, default=str) if data else None}
+
+
+class GameState:
+    """a game's status, phase, round and players as the event log has them"""
+
+    __slots__ = ('game_id', 'status', 'phase', 'round', 'players', 'last_game_event_id')
+
+    def __init__(self, game_id, status=None, phase=None, round=0, players=None, last_game_event_id=0):
+        self.game_id = game_id
+        self.status = status
+        self.phase = phase
+        self.round = round
+        # game_player_id to its character_id, position, affiliation and vitals
+        self.players = players if players is not None else {}
+        self.last_game_event_id = last_game_event_id
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        state = json.loads(snapshot['state'])
+        players = {int(game_player_id): player for game_player_id, player in state['players'].items()}
+        return cls(snapshot['game_id'], state['status'], state['phase'], state['round'], players,
+                   snapshot['last_game_event_id'])
+
+    def to_json(self) -> str:
+        return json.dumps({'status': self.status, 'phase': self.phase, 'round': self.round, 'players': self.players},
+                          separators=(',', ':'))
+
+    def apply(self, row):
+        data = json.loads(row['data']) if row['data'] else {}
+        event_taken = row['event_taken']
+        if event_taken in (CREATE, STATUS):
+            self.status = data['status']
+        elif event_taken == PHASE:
+            self.phase = row['phase']
+            self.round = row['round']
+        elif event_taken == ASSIGN:
+            self.players[row['player_affected_id']] = {'character_id': data['character_id'],
+                                                       'position': data['position'],
+                                                       'affiliation': data['affiliation'],
+                                                       'vitals': 'alive'}
+        elif event_taken in (DEATH, RESURRECT):
+            # players of games started before the log was kept have no assign event
+            player = self.players.setdefault(row['player_affected_id'], {})
+            player['vitals'] = 'deceased' if event_taken == DEATH else 'alive'
+        self.last_game_event_id = row['game_event_id']
+
+
+class EventLog:
+    def __init__(self):
+        # events and snapshots waiting on the unit of work they were recorded in
+        self._pending = weakref.WeakKeyDictionary()
+        self._snapshots = weakref.WeakKeyDictionary()
+
+    async def record(self, *events):
+        """adds events to the log, inside a unit of work they are inserted as one batch when it commits"""
+        unit = db.current_unit_of_work()
+        if unit is None:
+            await self.write(list(events))
+            return
+
+        pending = self._pending.get(unit)
+        if pending is None:
+            pending = self._pending[unit] = []
+            db.before_commit(lambda: self.write(self._pending.pop(unit, [])))
+        pending.extend(events)
+
+    async def write(self, events: list):
+        if not events:
+            return
+        # event_id points at the event reference table, 0 for actions it has no entry for
+        catalogue = await db.reference_data.by_async('event', 'event_name')
+        for row in events:
+            row['event_id'] = catalogue[row['event_taken']]['event_id'] if row['event_taken'] in catalogue else 0
+        await db.insert_many_async('game_event', events)
+
+    async def request_snapshot(self, game_id):
+        """snapshots the game once the events of the current unit of work have been written"""
+        unit = db.current_unit_of_work()
+        if unit is None:
+            await self.snapshot(game_id)
+            return
+
+        requested = self._snapshots.setdefault(unit, set())
+        if game_id not in requested:
+            requested.add(game_id)
+
+            async def snapshot():
+                # a request made after this has run, by a later phase change in the unit, is a new one
+                requested.discard(game_id)
+                await self.snapshot(game_id)
+            db.before_commit(snapshot)
+
+    async def snapshot(self, game_id):
+        """stores the game's current state unless nothing has happened since the last snapshot"""
+        state, replayed = await self.rebuild(game_id)
+        if not replayed:
+            return state
+        await db.insert_into_table_async('game_snapshot', {'game_id': game_id,
+                                                           'last_game_event_id': state.last_game_event_id,
+                                                           'round': state.round, 'phase': state.phase,
+                                                           'state': state.to_json()})
+        return state
+
+    async def rebuild(self, game_id):
+        """returns the game's current state and how many events were replayed on top of its latest snapshot"""
+        snapshot = await db.select_one_async('game_snapshot', {'game_id': game_id},
+                                             order_by='game_snapshot_id', descending=True)
+        state = GameState.from_snapshot(snapshot) if snapshot is not None else GameState(game_id)
+        events = await db.select_rows_async('game_event', {'game_id': game_id,
+                                                           'game_event_id': db.After(state.last_game_event_id)},
+                                            order_by='game_event_id')
+        for row in events:
+            state.apply(row)
+        return state, len(events)
+
+
+log = EventLog()
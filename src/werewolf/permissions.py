@@ -0,0 +1,128 @@
+""" permissions.py works out which channel permission overwrites need sending to discord
+
+resolve_permissions turns the character and role permission reference data into the
+overwrites every game channel should have, sync_channel_overwrites compares them against
+what the channel already has so only real changes cost an API call
+"""
+
+from collections import defaultdict
+import functools
+
+import discord
+
+import ratelimit
+
+MEMBER = 'member'
+ROLE = 'role'
+
+
+class PermissionSyncResult:
+    __slots__ = ('sent', 'skipped')
+
+    def __init__(self, sent=0, skipped=0):
+        self.sent = sent
+        self.skipped = skipped
+
+    def __iadd__(self, other):
+        self.sent += other.sent
+        self.skipped += other.skipped
+        return self
+
+    def __str__(self):
+        return f'{self.sent} permission updates sent, {self.skipped} unchanged skipped'
+
+
+def applies(row, phase: str, status: str) -> bool:
+    """permissions without a phase or status apply to all of them"""
+    return row['game_phase'] in (None, phase) and row['game_status'] in (None, status)
+
+
+def resolve_permissions(game_players: list, game_roles: list, character_permissions: dict, role_permissions: dict,
+                        channel_ids: list, phase: str, status: str) -> dict:
+    """works out every permission of every target in every game channel in a single pass
+
+    character_permissions and role_permissions are the reference tables grouped by character_id and role_id,
+    returns {channel_id: {(MEMBER or ROLE, discord id): {permission_name: bool}}}. Character permissions are
+    applied before role permissions and later rows win, the same order the permissions are listed in
+    """
+    matrix = {channel_id: defaultdict(dict) for channel_id in channel_ids}
+
+    for player in game_players:
+        target = (MEMBER, player['discord_user_id'])
+        # rows without a character, and players who haven't been given one, never matched in the join this replaced
+        if player['character_id'] is None:
+            continue
+        for row in character_permissions.get(player['character_id'], ()):
+            # only keep permissions that track living status
+            if not applies(row, phase, status) or row['vitals_required'] not in (None, player['vitals']):
+                continue
+            if row['channel_id'] in matrix:
+                matrix[row['channel_id']][target][row['permission_name']] = bool(int(row['permission_value']))
+
+    role_rows = defaultdict(list)
+    for role_id, rows in role_permissions.items():
+        # the same goes for permissions without a role
+        if role_id is not None:
+            role_rows[int(role_id)] += rows
+    for game_role in game_roles:
+        target = (ROLE, game_role['discord_role_id'])
+        for row in role_rows.get(game_role['role_id'], ()):
+            if not applies(row, phase, status):
+                continue
+            # role permissions without a channel apply to every channel
+            if row['channel_id'] is None:
+                channels = matrix
+            elif row['channel_id'] in matrix:
+                channels = [row['channel_id']]
+            else:
+                continue
+            for channel_id in channels:
+                matrix[channel_id][target][row['permission_name']] = bool(int(row['permission_value']))
+
+    return {channel_id: dict(targets) for channel_id, targets in matrix.items()}
+
+
+def resolve_target(guild, target):
+    """returns the member or role a resolved permission target refers to, None if it no longer exists"""
+    kind, discord_id = target
+    return guild.get_member(discord_id) if kind == MEMBER else guild.get_role(discord_id)
+
+
+def overwrite_key(overwrite: discord.PermissionOverwrite) -> tuple:
+    allow, deny = overwrite.pair()
+    return allow.value, deny.value
+
+
+EMPTY_OVERWRITE_KEY = overwrite_key(discord.PermissionOverwrite())
+
+
+def diff_overwrites(current: dict, desired: dict) -> list:
+    """returns the (target, overwrite) pairs that need setting for a channel to go from current to desired
+
+    targets in current that are missing from desired are cleared with an empty overwrite,
+    targets whose overwrite already matches are left alone
+    """
+    changes = []
+    for target, overwrite in desired.items():
+        existing = current.get(target)
+        existing_key = overwrite_key(existing) if existing is not None else EMPTY_OVERWRITE_KEY
+        if existing_key != overwrite_key(overwrite):
+            changes.append((target, overwrite))
+
+    for target, existing in current.items():
+        if target not in desired and overwrite_key(existing) != EMPTY_OVERWRITE_KEY:
+            changes.append((target, discord.PermissionOverwrite()))
+    return changes
+
+
+async def sync_channel_overwrites(channel, desired: dict) -> PermissionSyncResult:
+    """sends only the overwrites of desired that differ from the channel's current ones"""
+    current = channel.overwrites
+    changes = diff_overwrites(current, desired)
+    await ratelimit.scheduler.gather(f'channel:{channel.id}:set_permissions',
+                                     [functools.partial(channel.set_permissions, target, overwrite=overwrite)
+                                      for target, overwrite in changes])
+
+    # without the diff every target in either set would have been sent
+    candidates = len(set(current) | set(desired))
+    return PermissionSyncResult(sent=len(changes), skipped=candidates - len(changes))
@@ -0,0 +1,113 @@
+""" registration.py signs players up for games from their announcement reactions
+
+The reaction handlers only queue a registration, a worker per game drains its queue
+and applies everything that arrived together as one batch: the latest reaction of each
+user wins, game_player is updated in a single transaction and the alive role changes
+are fanned out through the rate limited scheduler. A batch that is applied after the
+game has stopped recruiting, because it was started in the meantime, is dropped
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+
+import database as db
+from globals import GameStatus
+import ratelimit
+from werewolf import announcement
+
+
+class Registration:
+    __slots__ = ('member', 'joined', 'alive_role', 'channel')
+
+    def __init__(self, member, joined: bool, alive_role, channel):
+        self.member = member
+        self.joined = joined
+        self.alive_role = alive_role
+        self.channel = channel
+
+
+class RegistrationClosed(Exception):
+    """the game stopped recruiting before a batch of its registrations was applied"""
+
+
+class RegistrationQueue:
+    """per game queues of sign ups and withdrawals, each with a worker that applies them in batches"""
+
+    def __init__(self):
+        self._queues = {}
+        self._workers = {}
+        self.batches = 0
+
+    def submit(self, game_id, member, joined: bool, alive_role, channel):
+        """queues member joining (or leaving) a game, the latest alive_role and channel are used for the batch"""
+        queue = self._queues.setdefault(game_id, asyncio.Queue())
+        queue.put_nowait(Registration(member, joined, alive_role, channel))
+        if game_id not in self._workers:
+            # the worker applies each batch in a unit of work of its own, never one the submitter is in
+            self._workers[game_id] = contextvars.Context().run(asyncio.get_running_loop().create_task,
+                                                               self._work(game_id, queue))
+
+    async def flush(self):
+        """waits for every queued registration to be applied"""
+        while self._workers:
+            await asyncio.gather(*self._workers.values(), return_exceptions=True)
+
+    async def _work(self, game_id, queue: asyncio.Queue):
+        try:
+            while not queue.empty():
+                # everything queued so far is one batch, later reactions of a user replace earlier ones
+                batch = {}
+                while not queue.empty():
+                    registration = queue.get_nowait()
+                    batch[registration.member.id] = registration
+                try:
+                    if not await self.apply(game_id, list(batch.values()), registration.alive_role):
+                        continue
+                except Exception:
+                    logging.exception(f'failed to apply {len(batch)} registrations for game {game_id}')
+                announcement.updater.request(game_id, registration.channel)
+        finally:
+            self._workers.pop(game_id, None)
+            if queue.empty():
+                self._queues.pop(game_id, None)
+
+    async def apply(self, game_id, registrations: list, alive_role) -> bool:
+        """applies a batch of registrations, returns False if it was dropped as the game isn't recruiting"""
+        joining = [registration.member for registration in registrations if registration.joined]
+        leaving = [registration.member for registration in registrations if not registration.joined]
+
+        try:
+            async with db.unit_of_work():
+                if joining:
+                    await db.insert_missing_async('game_player',
+                                                  [{'game_id': game_id, 'discord_user_id': member.id}
+                                                   for member in joining],
+                                                  key_columns=('game_id', 'discord_user_id'))
+                if leaving:
+                    await db.delete_from_table_async('game_player',
+                                                     {'game_id': game_id,
+                                                      'discord_user_id': [member.id for member in leaving]})
+                # read in the transaction the writes opened, a start can't commit between the check and them
+                game_data = await db.select_one_async('game', {'game_id': game_id})
+                if game_data is None or game_data['status'] != GameStatus.RECRUITING.value:
+                    raise RegistrationClosed()
+        except RegistrationClosed:
+            logging.info(f'game {game_id} is no longer recruiting, {len(registrations)} registrations dropped')
+            return False
+
+        if alive_role is not None:
+            guild_id = alive_role.guild.id
+            await ratelimit.scheduler.gather(
+                f'guild:{guild_id}:member_roles',
+                [functools.partial(member.add_roles, alive_role) for member in joining
+                 if alive_role not in member.roles] +
+                [functools.partial(member.remove_roles, alive_role) for member in leaving
+                 if alive_role in member.roles])
+        self.batches += 1
+        logging.info(f'game {game_id} registrations: {len(joining)} joined, {len(leaving)} left')
+        return True
+
+
+queue = RegistrationQueue()
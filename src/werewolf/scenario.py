@@ -6,14 +6,16 @@ along wtih randomizes to pick scenarios for you
 """
 
 from collections import defaultdict
-import logging
 
 from texttable import Texttable
 
 import database as db
 import globals
 from globals import GameStatus
-from werewolf import game
+import render
+from werewolf import game, generator
+
+GENERATED_BUILDS = 3
 
 
 async def parse_character_list(ctx, characters):
@@ -36,14 +38,20 @@ async def parse_character_list(ctx, characters):
     return character_list
 
 
-def draw_scenario_characters_table(scenario_id):
-    scenario_character = db.select_table('scenario_character', indicators={'scenario_id': scenario_id},
-                                         joins={'character': 'character_id'})
-    scenario_character = scenario_character.sort_values('character_name')
+async def draw_scenario_characters_table(scenario_id):
+    """the drawn table of a scenario's characters, cached until its characters change"""
+    return await render.cache.get(('scenario_characters', scenario_id), ('scenario_character', 'character'), None,
+                                  lambda: _draw_scenario_characters_table(scenario_id))
+
+
+async def _draw_scenario_characters_table(scenario_id):
+    scenario_character = await db.select_rows_async('scenario_character', indicators={'scenario_id': scenario_id},
+                                                    joins={'character': 'character_id'})
+    scenario_character.sort(key=lambda row: row['character_name'])
 
     # groups characters into quantities rather than indvidual items
     characters = defaultdict(lambda: defaultdict(int))
-    for idx, character in scenario_character.iterrows():
+    for character in scenario_character:
         characters[character['character_name']]['count'] += 1
         characters[character['character_name']]['weighting'] += character['weighting']
 
@@ -60,7 +68,15 @@ def draw_scenario_characters_table(scenario_id):
 
     table.add_row(['TOTAL', total_count, total_weight])
 
-    return table
+    return table.draw()
+
+
+def available(scenario, guild_id, game_id) -> bool:
+    """global scenarios are shared by the games of their guild, local ones belong to a single game
+
+    scenarios made before they were scoped to a guild have no guild and are shared by every guild
+    """
+    return scenario['discord_guild_id'] in (guild_id, None) and scenario['game_id'] in (game_id, None)
 
 
 async def get_scenario_data(ctx, scenario_name):
@@ -78,13 +94,13 @@ async def get_scenario_data(ctx, scenario_name):
         await ctx.channel.send(f'not allowed on this channel')
         return
 
-    scenario_data = db.select_table('scenario', indicators={'scenario_name': scenario_name})
-    scenario_data = scenario_data[scenario_data['game_id'].isin([game_id, None])]
-    if scenario_data.empty:
+    scenario_data = await db.select_rows_async('scenario', indicators={'scenario_name': scenario_name})
+    scenario_data = [row for row in scenario_data if available(row, ctx.guild.id, game_id)]
+    if not scenario_data:
         await ctx.channel.send(f'there is no scenario matching that id available to this game')
         return
 
-    scenario = scenario_data.iloc[0]
+    scenario = scenario_data[0]
     return scenario
 
 
@@ -102,13 +118,14 @@ async def create(ctx, scenario_name, scope):
         await ctx.channel.send(f'scope provided must be either "local" or "global"')
         return
 
-    scenario_data = db.select_table('scenario')
+    scenario_data = await db.select_rows_async('scenario', {'discord_guild_id': ctx.guild.id})
 
-    if scenario_name in scenario_data[
-        'scenario_name'].tolist():  # todo have this only as a requirement insiide the same scope
+    if scenario_name in [row['scenario_name'] for row in
+                         scenario_data]:  # todo have this only as a requirement insiide the same scope
         await ctx.channel.send(f'that scenario name is already taken, choose another')
 
-    db.insert_into_table('scenario', {'game_id': game_id, 'scenario_name': scenario_name, 'scope': scope})
+    await db.insert_into_table_async('scenario', {'discord_guild_id': ctx.guild.id, 'game_id': game_id,
+                                                  'scenario_name': scenario_name, 'scope': scope})
 
     # todo send a message saying what the id is
 
@@ -125,21 +142,66 @@ async def list(ctx):
         await ctx.channel.send(f'not allowed on this channel')
         return
 
-    scenario_data = db.select_table('scenario',
-                                    joins={'scenario_character': 'scenario_id', 'character': 'character_id'})
-    scenario_data = scenario_data[scenario_data['game_id'].isin([game_id, None])]
-    scenario_data['count'] = 1
+    guild_id = ctx.guild.id
+    table = await render.cache.get(('scenario_list', guild_id, game_id), ('scenario', 'scenario_character', 'character'),
+                                   None, lambda: draw_scenario_list(guild_id, game_id))
+    await render.send_pages(ctx.channel, table)
+
 
-    scenario_data = scenario_data.groupby(['scenario_id', 'scenario_name', 'scope']).sum()[
-        ['count', 'weighting']].reset_index()
+async def draw_scenario_list(guild_id, game_id):
+    scenario_data = await db.select_rows_async('scenario')
+    scenario_data = [row for row in scenario_data if available(row, guild_id, game_id)]
+    scenario_character = await db.select_rows_async('scenario_character',
+                                                    {'scenario_id': [row['scenario_id'] for row in scenario_data]},
+                                                    joins={'character': 'character_id'})
+
+    # totals the characters of each scenario
+    totals = defaultdict(lambda: defaultdict(int))
+    for character in scenario_character:
+        totals[character['scenario_id']]['count'] += 1
+        totals[character['scenario_id']]['weighting'] += character['weighting']
 
     table = Texttable()
     table.header(['ID', 'Name', 'Scope', 'Characters', 'Weighting'])
 
-    for idx, row in scenario_data.iterrows():
-        table.add_row([row['scenario_id'], row['scenario_name'], row['scope'], row['count'], row['weighting']])
+    for row in scenario_data:
+        # scenarios without characters yet are listed with 0 of each
+        total = totals[row['scenario_id']]
+        table.add_row([row['scenario_id'], row['scenario_name'], row['scope'], total['count'], total['weighting']])
+
+    return table.draw()
+
+
+def balanced(build, affiliations) -> bool:
+    """a build needs at least one werewolf and fewer werewolves than everyone else"""
+    werewolves = sum(count for name, count in build.counts.items() if affiliations[name] == 'werewolf')
+    return 0 < werewolves < sum(build.counts.values()) - werewolves
+
+
+async def generate(ctx, players, target_weighting, max_difficulty):
+    if players < 3:
+        await ctx.channel.send(f'a scenario needs at least 3 players')
+        return
+
+    characters = await db.reference_data.rows_async('character')
+    if max_difficulty is not None:
+        characters = [row for row in characters if row['difficulty'] is None or row['difficulty'] <= max_difficulty]
+    affiliations = {row['character_name']: row['starting_affiliation'] for row in characters}
+
+    builds = generator.generate(characters, players, target_weighting, GENERATED_BUILDS,
+                                valid=lambda build: balanced(build, affiliations))
+    if not builds:
+        await ctx.channel.send(f'no balanced scenario of {players} players can be made from the available characters')
+        return
+
+    table = Texttable(max_width=0)
+    table.header(['Build', 'Characters', 'Weighting'])
+    for number, build in enumerate(builds, start=1):
+        table.add_row([number, build.characters(), build.weighting])
 
-    await ctx.channel.send(f'```{table.draw()}```')
+    await render.send_pages(ctx.channel, table.draw(),
+                            f'Generated builds for {players} players with a target weighting of {target_weighting}, '
+                            f'add one with !scenario-character-add\n')
 
 
 async def character_add(ctx, characters, scenario_name):
@@ -150,24 +212,24 @@ async def character_add(ctx, characters, scenario_name):
         return
     scenario_id = scenario['scenario_id']
 
-    character_data = db.select_table('character')
+    character_data = await db.reference_data.by_async('character', 'character_name')
     character_list = await parse_character_list(ctx, characters)
+    scenario_character_data = []
     for character in character_list:
 
-        character_info = character_data[character_data['character_name'] == character]
-        if character_info.empty:
+        character_info = character_data.get(character)
+        if character_info is None:
             await ctx.channel.send(f'no character named {character}, this has not been included')
             continue
 
         print(f'adding character {character}')
-        character_info = character_info.iloc[0]
 
-        scenario_character_data = {'character_id': character_info['character_id'],
-                                   'scenario_id': scenario_id}
-        db.insert_into_table('scenario_character', scenario_character_data)
+        scenario_character_data.append({'character_id': character_info['character_id'],
+                                        'scenario_id': scenario_id})
+    await db.insert_many_async('scenario_character', scenario_character_data)
 
-    table = draw_scenario_characters_table(scenario_id)
-    await ctx.channel.send(f'Updated Build "{scenario_name}"\n```{table.draw()}```')
+    table = await draw_scenario_characters_table(scenario_id)
+    await render.send_pages(ctx.channel, table, f'Updated Build "{scenario_name}"\n')
     return
 
 
@@ -179,27 +241,28 @@ async def character_remove(ctx, characters, scenario_name):
         return
     scenario_id = scenario['scenario_id']
 
-    game_character_data = db.select_table('scenario_character',
-                                          indicators={'scenario_id': scenario_id},
-                                          joins={'character': 'character_id'})
+    game_character_data = await db.select_rows_async('scenario_character',
+                                                     indicators={'scenario_id': scenario_id},
+                                                     joins={'character': 'character_id'})
     character_list = await parse_character_list(ctx, characters)
 
     scenario_character_ids_remove = []
     for character in character_list:
-        selected = game_character_data[game_character_data['character_name'] == character]
-        selected = selected[~selected['scenario_character_id'].isin(scenario_character_ids_remove)]
-        if selected.empty:
+        selected = [row for row in game_character_data if row['character_name'] == character
+                    and row['scenario_character_id'] not in scenario_character_ids_remove]
+        if not selected:
             await ctx.channel.send(
                 f'character "{character}" was not found in scenario "{scenario_name}" and has not been remove (could be due specifying more than were in the build)')
             continue
-        row = selected.iloc[0]
+        row = selected[0]
         scenario_character_ids_remove.append(row['scenario_character_id'])
 
-    for cur_id in scenario_character_ids_remove:
-        db.delete_from_table('scenario_character', indicators={'scenario_character_id': cur_id})
+    if scenario_character_ids_remove:
+        await db.delete_from_table_async('scenario_character',
+                                         indicators={'scenario_character_id': scenario_character_ids_remove})
 
-    table = draw_scenario_characters_table(scenario_id)
-    await ctx.channel.send(f'Updated Scenario "{scenario_name}"\n```{table.draw()}```')
+    table = await draw_scenario_characters_table(scenario_id)
+    await render.send_pages(ctx.channel, table, f'Updated Scenario "{scenario_name}"\n')
 
 
 async def character_list(ctx, scenario_name):
@@ -209,8 +272,8 @@ async def character_list(ctx, scenario_name):
         return
     scenario_id = scenario['scenario_id']
 
-    table = draw_scenario_characters_table(scenario_id)
-    await ctx.channel.send(f'Scenario "{scenario_name}"\n```{table.draw()}```')
+    table = await draw_scenario_characters_table(scenario_id)
+    await render.send_pages(ctx.channel, table, f'Scenario "{scenario_name}"\n')
 
 
 async def purge(ctx, scenario_name):
@@ -220,6 +283,6 @@ async def purge(ctx, scenario_name):
         return
     scenario_id = scenario['scenario_id']
 
-    db.delete_from_table('scenario_character', indicators={'scenario_id': scenario_id})
-    db.delete_from_table('scenario', indicators={'scenario_id': scenario_id})
+    await db.delete_from_table_async('scenario_character', indicators={'scenario_id': scenario_id})
+    await db.delete_from_table_async('scenario', indicators={'scenario_id': scenario_id})
     await ctx.channel.send(f'Purged scenario "{scenario_name} and its characters"')
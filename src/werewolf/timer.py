@@ -0,0 +1,188 @@
+""" timer.py runs the game actions that are due at a set time, like closing registrations or changing phase
+
+Timers are rows of game_timer so they survive a restart, the bot loads the ones that haven't
+fired on ready. A single task serves every game: it keeps the timers in a heap ordered by when
+they are due and sleeps until the earliest one, a timer added ahead of it wakes it early.
+
+The row is what counts, the heap is only an index of it. A timer is looked up again as it comes
+due and skipped if it was cancelled in the meantime, so cancelling is a single update. A timer
+runs its action from the game's moderator channel in a unit of work, the same way the command
+would run, and is marked fired in that same transaction.
+
+The scheduler task only dispatches, each due action runs in a task of its own so a slow one,
+like starting a large game under the rate limit, doesn't hold up the other games. A game's own
+timers still run one after another in the order they came due.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+import heapq
+import json
+import logging
+import re
+
+import database as db
+import globals
+
+# the longest the scheduler sleeps before checking the clock again, in case it was changed
+MAX_SLEEP = 300
+# how many timer actions may run at once
+MAX_RUNNING = 10
+DURATION = re.compile(r'(\d+)([mhd])')
+UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+
+FIRED = 'fired'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+def parse_when(text: str, now: datetime = None) -> datetime:
+    """a time from a duration from now like 90m, 12h or 2d, otherwise a date and time like 21-06-01 17:00"""
+    now = now or datetime.now()
+    match = DURATION.fullmatch(text.strip().lower())
+    if match is not None:
+        return now + timedelta(**{UNITS[match.group(2)]: int(match.group(1))})
+    from dateutil.parser import parse  # only timers set by a moderator need the date parser
+    return parse(text, yearfirst=True)
+
+
+class TimerContext:
+    """stands in for a command's context so an action runs as if it was typed in the moderator channel"""
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.guild = channel.guild
+        self.message = self
+        self.author = channel.guild.me
+
+    async def send(self, content):
+        return await self.channel.send(content)
+
+
+class TimerScheduler:
+    def __init__(self):
+        # action name to the coroutine function it runs, called with a TimerContext and the timer's data
+        self.actions = {}
+        self.fired = 0
+        self._heap = []
+        self._wake = None
+        self._task = None
+        self._get_channel = None
+        self._slots = None
+        # the last action dispatched for each game with one still running, the next waits for it
+        self._latest = {}
+
+    async def load(self) -> int:
+        """queues every timer that hasn't fired yet, returns how many there are"""
+        rows = await db.select_rows_async('game_timer', {'fired_datetime': None})
+        for row in rows:
+            self._push(row['game_timer_id'], datetime.fromisoformat(row['due_datetime']), row['game_id'])
+        return len(rows)
+
+    def start(self, get_channel):
+        """starts the scheduler task, get_channel looks up a discord channel by its id"""
+        self._get_channel = get_channel
+        self._wake = asyncio.Event()
+        self._slots = asyncio.Semaphore(MAX_RUNNING)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self._task
+
+    async def add(self, game_id, action: str, due: datetime, **data) -> int:
+        """stores a timer running action with data at due, it is queued once the current unit of work commits"""
+        if action not in self.actions:
+            raise ValueError(f'{action} is not a timer action, use one of {", ".join(self.actions)}')
+        due = due.replace(microsecond=0, tzinfo=None)
+        timer_id = await db.insert_into_table_async('game_timer', {'game_id': game_id, 'action': action,
+                                                                   'due_datetime': due,
+                                                                   'data': json.dumps(data) if data else None})
+        db.after_commit(lambda: self._push(timer_id, due, game_id))
+        return timer_id
+
+    async def cancel(self, game_id, game_timer_id=None, action: str = None):
+        """cancels the game's timers that haven't fired, all of them unless narrowed to one id or action"""
+        indicators = {'game_id': game_id, 'fired_datetime': None}
+        if game_timer_id is not None:
+            indicators['game_timer_id'] = game_timer_id
+        if action is not None:
+            indicators['action'] = action
+        await self._mark(indicators, CANCELLED)
+
+    async def pending(self, game_id) -> list:
+        rows = await db.select_rows_async('game_timer', {'game_id': game_id, 'fired_datetime': None})
+        return sorted(rows, key=lambda row: (row['due_datetime'], row['game_timer_id']))
+
+    def _push(self, timer_id, due: datetime, game_id):
+        heapq.heappush(self._heap, (due, timer_id, game_id))
+        if self._wake is not None and self._heap[0][1] == timer_id:
+            self._wake.set()
+
+    async def _mark(self, indicators: dict, outcome: str):
+        await db.update_table_async('game_timer', {'fired_datetime': datetime.now().replace(microsecond=0),
+                                                   'outcome': outcome}, indicators)
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            if not self._heap:
+                await self._wake.wait()
+                continue
+
+            due, timer_id, game_id = self._heap[0]
+            delay = (due - datetime.now()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), min(delay, MAX_SLEEP))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            self._dispatch(timer_id, game_id)
+
+    def _dispatch(self, timer_id, game_id):
+        task = asyncio.get_running_loop().create_task(self._fire_after(self._latest.get(game_id), timer_id))
+        self._latest[game_id] = task
+
+        def done(task):
+            if self._latest.get(game_id) is task:
+                del self._latest[game_id]
+        task.add_done_callback(done)
+
+    async def _fire_after(self, previous, timer_id):
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with self._slots:
+            try:
+                await self.fire(timer_id)
+            except Exception:
+                logging.exception(f'failed to run timer {timer_id}')
+
+    async def fire(self, timer_id):
+        """runs the timer's action unless it was cancelled, returns its outcome or None if it didn't run"""
+        row = await db.select_one_async('game_timer', {'game_timer_id': timer_id, 'fired_datetime': None})
+        if row is None:
+            return None
+        moderator = await db.select_one_async('game_channel', {'game_id': row['game_id'],
+                                                               'name': globals.moderator_channel_name})
+        channel = self._get_channel(moderator['discord_channel_id']) if moderator is not None else None
+        if channel is None:
+            # the game's guild is run by another shard, or its channels are gone
+            logging.info(f'timer {timer_id} of game {row["game_id"]} has no moderator channel here, not run')
+            return None
+
+        action = self.actions[row['action']]
+        data = json.loads(row['data']) if row['data'] else {}
+        try:
+            async with db.unit_of_work():
+                await self._mark({'game_timer_id': timer_id}, FIRED)
+                await action(TimerContext(channel), **data)
+        except Exception:
+            logging.exception(f'timer {timer_id} failed to {row["action"]} game {row["game_id"]}')
+            await self._mark({'game_timer_id': timer_id}, FAILED)
+            await channel.send(f'timer {timer_id} failed to {row["action"]} the game, it will not be retried')
+            return FAILED
+        self.fired += 1
+        return FIRED
+
+
+timers = TimerScheduler()
@@ -0,0 +1,258 @@
+""" vote.py runs the day votes players cast with !vote and !unvote in their game's player channel
+
+The votes of each game's current round are tallied in memory. A VoteTally keeps every voter's
+choice alongside a count and a set of voters per nominee, so casting, changing or retracting a
+vote is a constant time update and !votes draws its table straight from the counters.
+
+Every change is also queued and written to game_vote in batches, at most one insert per flush
+interval. A tally that isn't in memory, after a restart, is rebuilt by replaying game_vote, leaving
+out the votes of and for players who have died since.
+"""
+
+import asyncio
+import contextvars
+import logging
+
+from texttable import Texttable
+
+import database as db
+import globals
+from globals import GameStatus
+import render
+import server
+from werewolf import game
+
+FLUSH_INTERVAL = 1.0
+LYNCH = 'lynch'
+
+
+class VoteTally:
+    """the lynch votes of one game's round"""
+
+    __slots__ = ('game_id', 'round', 'choices', 'counts', 'voters', 'reached', '_changes')
+
+    def __init__(self, game_id, round):
+        self.game_id = game_id
+        self.round = round
+        # voter to nominee, nominee to vote count and voters, all keyed by game_player_id
+        self.choices = {}
+        self.counts = {}
+        self.voters = {}
+        # when each nominee last gained a vote, the earlier of two tied nominees leads
+        self.reached = {}
+        self._changes = 0
+
+    def cast(self, voter, nominee):
+        """records voter's vote for nominee, returns who they voted for before"""
+        previous = self.retract(voter)
+        self.choices[voter] = nominee
+        self.counts[nominee] = self.counts.get(nominee, 0) + 1
+        self.voters.setdefault(nominee, set()).add(voter)
+        self._changes += 1
+        self.reached[nominee] = self._changes
+        return previous
+
+    def retract(self, voter):
+        """withdraws voter's vote, returns who it was for or None if they hadn't voted"""
+        previous = self.choices.pop(voter, None)
+        if previous is not None:
+            self.counts[previous] -= 1
+            self.voters[previous].discard(voter)
+            if not self.counts[previous]:
+                del self.counts[previous]
+                del self.voters[previous]
+                del self.reached[previous]
+        return previous
+
+    def standings(self) -> list:
+        """(nominee, votes, voters) for every nominee with a vote, the leader first"""
+        order = sorted(self.counts, key=lambda nominee: (-self.counts[nominee], self.reached[nominee]))
+        return [(nominee, self.counts[nominee], self.voters[nominee]) for nominee in order]
+
+
+VOTE_COLUMNS = ('game_id', 'round', 'vote_type', 'voter', 'nominee')
+
+
+def write_votes(rows: list):
+    """inserts vote changes in the order they were made, in one statement
+
+    insert_many would group retractions, which leave nominee NULL, apart from the casts and so
+    out of game_vote_id order, every change is written with the same columns instead
+    """
+    db.notify_change('game_vote', rows)
+    with db.write_connection() as connection:
+        connection.executemany(db.compile_insert('game_vote', VOTE_COLUMNS),
+                               [tuple(row[column] for column in VOTE_COLUMNS) for row in rows])
+
+
+write_votes_async = db.awaitable(write_votes, write=True)
+
+
+def majority(alive: int) -> int:
+    return alive // 2 + 1
+
+
+class VoteBook:
+    """the tally of each game's current round and the queue of vote changes waiting to be written"""
+
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self.batches = 0
+        self._tallies = {}
+        self._pending = []
+        self._task = None
+
+    async def tally(self, game_id, round) -> VoteTally:
+        tally = self._tallies.get(game_id)
+        if tally is not None and tally.round == round:
+            return tally
+
+        # only the newest round is kept, earlier rounds are in game_vote
+        tally = VoteTally(game_id, round)
+        votes = await db.select_rows_async('game_vote', {'game_id': game_id, 'round': round, 'vote_type': LYNCH},
+                                           order_by='game_vote_id')
+        # players who died while the tally wasn't in memory had their votes withdrawn by nobody
+        alive = {row['game_player_id'] for row in await game_players(game_id) if row['vitals'] == 'alive'}
+        for row in votes:
+            if row['voter'] not in alive:
+                continue
+            if row['nominee'] is None or row['nominee'] not in alive:
+                tally.retract(row['voter'])
+            else:
+                tally.cast(row['voter'], row['nominee'])
+
+        current = self._tallies.get(game_id)
+        if current is not None and current.round == round:
+            # loaded by a vote that arrived at the same time
+            return current
+        self._tallies[game_id] = tally
+        return tally
+
+    def cast(self, tally: VoteTally, voter, nominee):
+        previous = tally.cast(voter, nominee)
+        self._queue(tally, voter, nominee)
+        return previous
+
+    def retract(self, tally: VoteTally, voter):
+        previous = tally.retract(voter)
+        if previous is not None:
+            self._queue(tally, voter, None)
+        return previous
+
+    def remove_player(self, game_id, game_player_id):
+        """withdraws the votes of and for a player who has died, a tally loaded later leaves them out itself"""
+        tally = self._tallies.get(game_id)
+        if tally is None:
+            return
+        for voter in [game_player_id] + sorted(tally.voters.get(game_player_id, ())):
+            self.retract(tally, voter)
+
+    def _queue(self, tally: VoteTally, voter, nominee):
+        # a nominee of None records a retracted vote
+        self._pending.append({'game_id': tally.game_id, 'round': tally.round, 'vote_type': LYNCH,
+                              'voter': voter, 'nominee': nominee})
+        if self._task is None:
+            # the flush outlives the command that queued the change, it mustn't write in the command's unit of work
+            self._task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._run())
+
+    async def flush(self):
+        """waits for every queued vote change to be written"""
+        while self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        try:
+            while self._pending:
+                batch, self._pending = self._pending, []
+                try:
+                    await write_votes_async(batch)
+                    self.batches += 1
+                except Exception:
+                    logging.exception(f'failed to write {len(batch)} votes')
+                await asyncio.sleep(self.interval)
+        finally:
+            self._task = None
+
+
+book = VoteBook()
+
+
+async def game_players(game_id) -> list:
+    """the game's players, cached until game_player changes so votes don't read the database"""
+    return await render.cache.get(('game_players', game_id), ('game_player',), game_id,
+                                  lambda: db.select_rows_async('game_player', {'game_id': game_id}))
+
+
+async def voting_round(ctx):
+    """the game, its alive players and the voter's game_player row, None if ctx can't vote right now"""
+    if str(ctx.channel).lower() != globals.player_channel_name:
+        return None
+    game_data = await game.get_game(ctx.channel, GameStatus.ACTIVE)
+    if game_data is None:
+        return None
+    if game_data['phase'] != 'day':
+        await ctx.channel.send(f'votes can only be cast during the day')
+        return None
+
+    alive = {row['discord_user_id']: row for row in await game_players(game_data['game_id'])
+             if row['vitals'] == 'alive'}
+    voter = alive.get(ctx.author.id)
+    if voter is None:
+        await ctx.channel.send(f'only players who are alive can vote')
+        return None
+    return game_data, alive, voter
+
+
+async def cast(ctx, player):
+    voting = await voting_round(ctx)
+    if voting is None:
+        return
+    game_data, alive, voter = voting
+
+    member_id = server.parse_member_id(player)
+    candidates = {member_id} if member_id is not None else server.members.lookup(ctx.guild, player)
+    nominees = [alive[candidate] for candidate in candidates if candidate in alive]
+    if len(nominees) != 1:
+        problem = 'is not a player who is alive' if not nominees else 'matches more than one player'
+        await ctx.channel.send(f'"{player}" {problem}')
+        return
+    nominee = nominees[0]
+
+    tally = await book.tally(game_data['game_id'], game_data['round'])
+    book.cast(tally, voter['game_player_id'], nominee['game_player_id'])
+    votes = tally.counts[nominee['game_player_id']]
+    await ctx.channel.send(f'{ctx.author.display_name} votes for {ctx.guild.get_member(nominee["discord_user_id"])}, '
+                           f'{votes} of the {majority(len(alive))} votes needed')
+
+
+async def retract(ctx):
+    voting = await voting_round(ctx)
+    if voting is None:
+        return
+    game_data, alive, voter = voting
+
+    tally = await book.tally(game_data['game_id'], game_data['round'])
+    if book.retract(tally, voter['game_player_id']) is None:
+        await ctx.channel.send(f'you have not voted')
+        return
+    await ctx.channel.send(f'{ctx.author.display_name} has withdrawn their vote')
+
+
+async def standings(ctx):
+    game_data = await game.get_game(ctx.channel, GameStatus.ACTIVE)
+    if game_data is None:
+        return
+    game_id = game_data['game_id']
+
+    players = await game_players(game_id)
+    members = {row['game_player_id']: ctx.guild.get_member(row['discord_user_id']) for row in players}
+    alive = sum(row['vitals'] == 'alive' for row in players)
+    tally = await book.tally(game_id, game_data['round'])
+
+    table = Texttable()
+    table.header(['Player', 'Votes', 'Voted By'])
+    for nominee, votes, voters in tally.standings():
+        table.add_row([members.get(nominee), votes, ', '.join(sorted(str(members.get(voter)) for voter in voters))])
+
+    await render.send_pages(ctx.channel, table.draw(),
+                            f'Round {game_data["round"]} votes, {majority(alive)} of {alive} needed to lynch\n')